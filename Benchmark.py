@@ -0,0 +1,173 @@
+#-------------------------------------------------------------------------------
+# Name:        Benchmark.py
+# Purpose:     This script times each stage of creating the event table on a
+#              synthetic LRS and synthetic project csvs (see SyntheticData.py),
+#              so that the speed of a release can be compared with the last.
+#              Nothing in the data folder is read or written.
+#
+#              For each project count, it times DMS conversion, finding the
+#              routes near a point, locating a point on a route, and the whole
+#              event table.  The per-row functions (dms_to_dd,
+#              select_nearby_routes, locate_point_on_route and the row by row
+#              create_event_table) are timed on the first --sample-size rows.
+#              Loading the LRS is timed once, from the shapefile and from its
+#              cache.
+#
+#              Results are written as JSON, with one entry per benchmark and
+#              project count.
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import shapely
+import CreateEventTable
+from DMSToDD import dms_to_dd, dms_to_dd_series
+from LRSNetwork import LRSNetwork
+from Projection import project_coordinates
+from SyntheticData import make_lrs, make_projects, write_projects_csv, write_dd_csv, rawColumns
+from XY_to_Events_Step1 import convert_coordinates
+
+defaultSizes = [1000, 100000, 1000000]
+
+
+def timed(name, rows, function, repeat=1, **details):
+    """ Runs function repeat times and returns the fastest run as a result entry """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    seconds = min(times)
+    result = dict(benchmark=name, rows=rows, seconds=round(seconds, 6),
+                  rowsPerSecond=round(rows / seconds, 1) if seconds else None, **details)
+    print(f'{name:<28} {rows:>9} rows  {seconds:10.3f} s')
+    return result
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'shapely': shapely.__version__
+    }
+
+
+def benchmark_lrs(lrsPath, repeat=1):
+    """ Times loading the LRS from the shapefile and from its cache.  rows
+        is the number of routes. """
+    results = []
+    network = LRSNetwork.load(lrsPath, CreateEventTable.targetCRS) # Builds the cache
+    routes = len(network.names)
+    details = {'vertices': len(network.measures.m)}
+    results.append(timed('lrs_load_source', routes, lambda: LRSNetwork.from_source(lrsPath, CreateEventTable.targetCRS), repeat, **details))
+    results.append(timed('lrs_load_cache', routes, lambda: LRSNetwork.load(lrsPath, CreateEventTable.targetCRS), repeat, **details))
+
+    return results
+
+
+def benchmark_projects(lrs, rowCount, workDir, sampleSize, repeat=1):
+    """ Times each stage for rowCount synthetic projects """
+    results = []
+    projects = make_projects(lrs, rowCount)
+    rawPath = os.path.join(workDir, f'Projects_{rowCount}.csv')
+    ddPath = os.path.join(workDir, f'Projects_{rowCount}_DD.csv')
+    samplePath = os.path.join(workDir, f'Projects_{rowCount}_Sample_DD.csv')
+    outPath = os.path.join(workDir, f'Projects_{rowCount}_Events.csv')
+    write_projects_csv(projects, rawPath)
+    write_dd_csv(projects, ddPath)
+    sample = projects.head(sampleSize)
+    write_dd_csv(sample, samplePath)
+    details = {'projects': rowCount}
+
+    # DMS conversion
+    raw = pd.read_csv(rawPath, encoding='ISO-8859-1', dtype=str, keep_default_na=False)
+    values = raw[list(rawColumns.values())].head(sampleSize).to_numpy().ravel()
+    values = values[values != '']
+    results.append(timed('dms_to_dd', len(sample), lambda: [dms_to_dd(value) for value in values], repeat, **details))
+    results.append(timed('dms_to_dd_series', rowCount,
+                         lambda: [dms_to_dd_series(raw[column]) for column in rawColumns.values()], repeat, **details))
+    results.append(timed('convert_coordinates', rowCount, lambda: convert_coordinates(rawPath, ddPath), repeat, **details))
+
+    # Route search and linear referencing, one point at a time
+    x, y = project_coordinates(sample['begin_lng'].to_numpy(), sample['begin_lat'].to_numpy(),
+                               CreateEventTable.wgs84, CreateEventTable.targetCRS)
+    points = shapely.points(x, y)
+    pairs = list(zip(sample['rte_nm'], points))
+    results.append(timed('select_nearby_routes', len(sample),
+                         lambda: [CreateEventTable.select_nearby_routes(point, CreateEventTable.searchRadius) for point in points],
+                         repeat, **details))
+    results.append(timed('locate_point_on_route', len(sample),
+                         lambda: [CreateEventTable.locate_point_on_route(rte_nm, point) for rte_nm, point in pairs],
+                         repeat, **details))
+
+    # End to end
+    results.append(timed('create_event_table', len(sample),
+                         lambda: CreateEventTable.create_event_table(samplePath, outPath), repeat, **details))
+    results.append(timed('create_event_table_batch', rowCount,
+                         lambda: CreateEventTable.create_event_table_batch(ddPath, outPath), repeat, **details))
+
+    return results
+
+
+def run_benchmarks(sizes=defaultSizes, routeCount=200, sampleSize=10000, repeat=1, workDir=None):
+    """ Builds the synthetic LRS and runs every benchmark.  returns the
+        results as a dictionary ready to be written as JSON """
+    keep = workDir is not None
+    workDir = workDir or tempfile.mkdtemp(prefix='xy_benchmark_')
+    os.makedirs(workDir, exist_ok=True)
+    try:
+        lrsPath = os.path.join(workDir, 'LRS_Synthetic.shp')
+        lrs = make_lrs(lrsPath, routeCount)
+        print(f'Synthetic LRS with {len(lrs.names)} routes and {len(lrs.m)} vertices at "{lrsPath}"')
+
+        results = benchmark_lrs(lrsPath, repeat)
+        CreateEventTable.load_lrs(lrsPath)
+        for rowCount in sizes:
+            results += benchmark_projects(lrs, rowCount, workDir, sampleSize, repeat)
+    finally:
+        if not keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'lrs': {'routes': len(lrs.names), 'vertices': len(lrs.m)},
+        'sampleSize': sampleSize,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each stage of creating the event table on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=defaultSizes,
+                        help='numbers of projects to time (default: 1000 100000 1000000)')
+    parser.add_argument('--routes', type=int, default=200,
+                        help='number of routes in the synthetic LRS (default: 200)')
+    parser.add_argument('--sample-size', type=int, default=10000,
+                        help='rows used for the functions that run one row at a time (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='run each benchmark this many times and keep the fastest (default: 1)')
+    parser.add_argument('--workdir',
+                        help='keep the synthetic data in this folder instead of a temporary one')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file the results are written to (default: benchmark_results.json)')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.routes, args.sample_size, args.repeat, args.workdir)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Benchmark results saved at "{args.output}"')
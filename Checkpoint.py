@@ -0,0 +1,135 @@
+#-------------------------------------------------------------------------------
+# Name:        Checkpoint.py
+# Purpose:     This module lets a long run of Step 1 or Step 2 be stopped and
+#              started again without losing the work already done.  Each
+#              chunk of events is committed to a folder next to the output
+#              table as soon as it is located, along with the number of
+#              chunks done, and a run that finds the folder carries on from
+#              the last committed chunk.  The folder is only used by a run
+#              with the same input, chunk size, LRS and search radius, and
+#              is thrown away otherwise.
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import json
+import os
+import shutil
+import pandas as pd
+import CreateEventTable
+import EventTableIO
+import LRSCache
+from Instrumentation import metrics
+
+# Bump when the layout of checkpoint folders changes so old ones are started over
+checkpointVersion = 1
+
+
+def checkpoint_path(outPath):
+    """ The checkpoint of data/AllProjects_Events.csv is the folder data/AllProjects_Events.checkpoint """
+    return os.path.splitext(outPath)[0] + '.checkpoint'
+
+
+def run_key(stage, inputPath, chunkSize):
+    """ Describes the input, LRS and settings of a run.  A checkpoint left by
+        a run with another key is thrown away instead of resumed. """
+    net = CreateEventTable.get_network()
+    stat = os.stat(inputPath)
+    return {
+        'version': checkpointVersion,
+        'stage': stage,
+        'input': [os.path.abspath(inputPath), stat.st_mtime_ns, stat.st_size],
+        'chunkSize': chunkSize,
+        'lrs': LRSCache.cache_key(net.path, net.crs),
+        'searchRadius': CreateEventTable.searchRadius
+    }
+
+
+class Checkpoint:
+    """ Commits the output of a long run one chunk at a time, so that a run
+        that is stopped can pick up where it left off.
+
+        Each chunk of events is written to its own csv in the checkpoint
+        folder next to outPath, and then progress.json is updated with the
+        number of chunks done.  Both are written to a temporary file and
+        renamed, so a crash leaves either the old or the new version and
+        never a partial one.  completed is the number of chunks a resumed
+        run can skip.  Once every chunk is saved, finish joins them into
+        outPath.
+
+            run = Checkpoint(outPath, run_key('step1', csvPath, chunkSize))
+            for events in locate(chunks[run.completed:]):
+                run.save(events)
+            run.finish()
+    """
+    def __init__(self, outPath, key):
+        self.outPath = outPath
+        self.folder = checkpoint_path(outPath)
+        self.key = key
+        self.completed, self.rowCount = self.read_progress()
+
+    def __repr__(self):
+        return f'<Checkpoint {self.folder}, {self.completed} chunks done>'
+
+    def read_progress(self):
+        """ The number of chunks and rows done by an earlier run with the same
+            key.  The folder is started over if there is none. """
+        try:
+            with open(os.path.join(self.folder, 'progress.json')) as file:
+                progress = json.load(file)
+        except (OSError, ValueError):
+            progress = None
+
+        if progress is None or progress.get('key') != self.key:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            os.makedirs(self.folder)
+            return 0, 0
+
+        if progress['chunks']:
+            print(f'Resuming after {progress["chunks"]} chunks from "{self.folder}"')
+        return progress['chunks'], progress['rows']
+
+    def chunk_path(self, n):
+        return os.path.join(self.folder, f'chunk_{n:06d}.csv')
+
+    def write_durable(self, path, write):
+        """ Calls write with a file open for writing, and only moves it to path
+            once it is on disk """
+        tempPath = path + '.tmp'
+        with open(tempPath, 'w', newline='') as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tempPath, path)
+
+    def save(self, events):
+        """ Commits the next chunk of events """
+        with metrics.stage('checkpoint'):
+            self.write_durable(self.chunk_path(self.completed),
+                               lambda file: events[CreateEventTable.eventFields].to_csv(file, header=False, index=False))
+            self.completed += 1
+            self.rowCount += len(events)
+            self.write_durable(os.path.join(self.folder, 'progress.json'),
+                               lambda file: json.dump({'key': self.key, 'chunks': self.completed, 'rows': self.rowCount}, file))
+
+    def finish(self):
+        """ Joins the saved chunks into outPath, in the format of its
+            extension, and removes the checkpoint.  returns the number of rows """
+        format = EventTableIO.event_format(self.outPath)
+        tempPath = self.outPath + '.tmp'
+        with metrics.stage('write'):
+            with EventTableIO.EventWriter(tempPath, format) as writer:
+                for n in range(self.completed):
+                    if os.path.getsize(self.chunk_path(n)) == 0:
+                        continue
+                    if format == 'csv':
+                        # Copied as they are, since the csv writer would write the same text
+                        with open(self.chunk_path(n), 'rb') as chunkFile, open(tempPath, 'ab') as outFile:
+                            shutil.copyfileobj(chunkFile, outFile)
+                    else:
+                        chunk = pd.read_csv(self.chunk_path(n), header=None, names=CreateEventTable.eventFields,
+                                            dtype=str, keep_default_na=False)
+                        writer.write(chunk)
+        os.replace(tempPath, self.outPath)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+        return self.rowCount
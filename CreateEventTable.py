@@ -1,67 +1,225 @@
-import geopandas as gp
 import pandas as pd
+import numpy as np
+import collections
 import csv
-import shapefile
-from shapely.geometry import Point, LineString
-from shapely.ops import nearest_points, transform
-import pyproj
-import traceback
-import math
+import logging
+import multiprocessing
+import shapely
+from shapely.geometry import Point
+from Projection import project_coordinates, project_point
+from LRSNetwork import LRSNetwork
+from PointCache import PointCache
+import LRSCache
+import EventTableIO
+from Instrumentation import metrics
 # from main import lrsPath
 
+logger = logging.getLogger(__name__)
+
 lrsPath = 'data/LRS_Salem.shp'
-lrs = gp.read_file(lrsPath)
-lrs = lrs.to_crs(epsg=26918) # 26918 = UTM 18N
+searchRadius = 25 # Maximum distance in meters between a point and its route
+
+# Input coordinates are wgs84.  The LRS and points are projected to targetCRS
+# (UTM 18N by default) so that distances are in meters.  Other UTM zones can be
+# used by calling load_lrs with a different crs.
+wgs84 = 'EPSG:4326'
+targetCRS = 'EPSG:26918'
+
+
+# Columns of the output event table
+eventFields = ['organization', 'id', 'rte_nm', 'begin_msr', 'end_msr', 'begin_lat', 'begin_lng', 'end_lat', 'end_lng', 'comments']
+
+# The prepared LRS.  It is loaded on first use (see get_network) so that importing
+# this module is cheap, and repeat runs read it from the on-disk cache.
+network = None
+
+
+def load_lrs(path=lrsPath, crs=targetCRS, useCache=True):
+    """ Loads the LRS at path, projects it to crs, and builds the spatial index
+        and m-value lookup used by the rest of this module """
+    global lrsPath, targetCRS, network
+
+    lrsPath = path
+    targetCRS = crs
+    network = LRSNetwork.load(path, crs, useCache)
 
-# For projecting points from wgs84 to UTM 18N
-wgs84 = pyproj.CRS('EPSG:4326')
-utm = pyproj.CRS('EPSG:26918')
+    return network
 
 
-# Geopandas does not support loading m-values from the LRS.  This dictionary of m-values is populated by pyshp
-print('load m values')
-mValueDict = {}
-with shapefile.Reader(lrsPath) as shp:
-    for row in shp.iterShapeRecords():
-        try:
-            record = row.record
-            shape = row.shape
-            rte_nm = record['RTE_NM']
-            mValues = shape.m
-            mValueDict[rte_nm] = mValues
-        except:
-            print('Error finding m-value')
-            continue
+def get_network():
+    """ Returns the prepared LRS, loading it the first time it is needed """
+    if network is None:
+        load_lrs(lrsPath, targetCRS)
 
+    return network
 
-class LRSVertex:
-    def __init__(self, index, rte_nm, geom):
-        self.index = index
-        self.rte_nm = rte_nm
-        self.geom = geom
 
-    def __repr__(self):
-        return f'<LRSVertex {self.index} on {self.rte_nm}>'
+# Module attributes that used to be loaded at import time, and the LRSNetwork
+# attribute that now holds each of them
+networkAttributes = {
+    'lrs': 'frame',
+    'lrsGeoms': 'geoms',
+    'lrsNames': 'names',
+    'lrsTree': 'tree',
+    'mValueDict': 'mValueDict',
+    'routeIndex': 'routeIndex',
+    'routeMeasures': 'measures'
+}
 
 
-def find_distance(p1, p2):
-    """ Find the distance between two input shapely Points """
-    return math.sqrt(abs(p1.x - p2.x)**2 + abs(p1.y - p2.y)**2)
+def __getattr__(name):
+    if name in networkAttributes:
+        return getattr(get_network(), networkAttributes[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def find_nearby_routes(point, d):
+    """ Finds routes within d distance from the input point.
+        returns a list of (rte_nm, distance) tuples in LRS order """
+    net = get_network()
+
+    # Candidates are routes whose bounding box is within d of the point.  The
+    # exact distance check then drops the ones that are only close by envelope.
+    # This runs once per point, so it is timed by its callers rather than here.
+    candidates = net.tree.query(shapely.box(point.x - d, point.y - d, point.x + d, point.y + d))
+    candidates = np.sort(candidates) # Keep the LRS order, which decides ties
+    distances = shapely.distance(net.geoms[candidates], point)
+    keep = distances <= d
+
+    return list(zip(net.names[candidates[keep]], distances[keep]))
 
 
 def select_nearby_routes(point, d):
     """ Selects routes within d distance from the input point.
         returns a list of rte_nms """
-    output = []
-    buffer = point.buffer(d)
-    for i in lrs.index:
-        if buffer.intersects(lrs['geometry'][i]):
-            rte_nm = lrs['RTE_NM'][i]
-            output.append(rte_nm)
-    
+    return [rte_nm for rte_nm, distance in find_nearby_routes(point, d)]
+
+
+def match_routes(beginPoint, endPoint, d=searchRadius):
+    """ Finds the route that both the begin and end points lie on.
+        Routes within d of both points are ranked by the farther of the two
+        distances, then by their sum.  Returns a list of rte_nms, which has more
+        than one entry only when routes are tied (such as both directions of a
+        route sharing the same geometry).  The first entry is the LRS order
+        winner, matching the old shrinking-radius search.
+    """
+    beginRoutes = {}
+    for rte_nm, distance in find_nearby_routes(beginPoint, d):
+        beginRoutes[rte_nm] = min(distance, beginRoutes.get(rte_nm, distance))
+
+    endRoutes = {}
+    for rte_nm, distance in find_nearby_routes(endPoint, d):
+        endRoutes[rte_nm] = min(distance, endRoutes.get(rte_nm, distance))
+
+    # Distances are rounded to the micrometer so that routes with the same
+    # geometry tie exactly, the same as in match_routes_bulk
+    ranked = [(round(max(beginRoutes[rte], endRoutes[rte]), 6), round(beginRoutes[rte] + endRoutes[rte], 6), rte)
+              for rte in beginRoutes if rte in endRoutes]
+    if not ranked:
+        return []
+
+    best = min(rank[:2] for rank in ranked)
+    matchRoutes = [rte for farDist, totalDist, rte in ranked if (farDist, totalDist) == best]
+
+    if len(matchRoutes) > 1:
+        logger.debug(f'Return both routes: {matchRoutes}')
+        metrics.count('tied_routes')
+
+    return matchRoutes
+
+
+def find_nearby_routes_bulk(points, d, net=None):
+    """ Bulk version of find_nearby_routes for an array of shapely Points.
+        returns a DataFrame with one row per (point, route) pair within d,
+        where point and route are positional indexes of net (the loaded LRS
+        by default) """
+    if net is None:
+        net = get_network()
+    with metrics.stage('route_search'):
+        x = shapely.get_x(points)
+        y = shapely.get_y(points)
+        pointIdx, routeIdx = net.tree.query(shapely.box(x - d, y - d, x + d, y + d))
+        distances = shapely.distance(points[pointIdx], net.geoms[routeIdx])
+        keep = distances <= d
+
+    metrics.count('index_candidates', len(pointIdx))
+    metrics.observe_many('routes_per_point', np.bincount(pointIdx[keep], minlength=len(points)))
+
+    return pd.DataFrame({'point': pointIdx[keep], 'route': routeIdx[keep], 'distance': distances[keep]})
+
+
+def shared_routes(beginPairs, endPairs):
+    """ Every route that is near both the begin and end point of each project,
+        ranked the same way match_routes does.  beginPairs and endPairs are
+        DataFrames of (point, route, distance, ...) rows, like the ones from
+        find_nearby_routes_bulk, where point identifies the project.
+        returns the shared rows sorted by point and then rank, with the other
+        columns suffixed _begin and _end """
+    shared = beginPairs.merge(endPairs, on=['point', 'route'], suffixes=('_begin', '_end'))
+    shared['far'] = np.maximum(shared['distance_begin'], shared['distance_end']).round(6)
+    shared['total'] = (shared['distance_begin'] + shared['distance_end']).round(6)
+
+    # Ties go to the LRS order
+    return shared.sort_values(['point', 'far', 'total', 'route'])
+
+
+def rank_shared_routes(beginPairs, endPairs):
+    """ The best row of shared_routes for each project that has a shared route """
+    return shared_routes(beginPairs, endPairs).drop_duplicates('point')
+
+
+def match_routes_bulk(beginPoints, endPoints, d=searchRadius):
+    """ Bulk version of match_routes for arrays of begin and end Points.
+        returns an array with the positional index of the matching LRS route
+        for each pair, or -1 where no route is within d of both points """
+    best = rank_shared_routes(find_nearby_routes_bulk(beginPoints, d), find_nearby_routes_bulk(endPoints, d))
+
+    output = np.full(len(beginPoints), -1)
+    output[best['point'].to_numpy()] = best['route'].to_numpy()
+
     return output
 
 
+def locate_points(routes, points, net=None):
+    """ Finds the m-value for each point on the matching route.
+
+        routes - array of positional LRS indexes
+        points - array of shapely Points in targetCRS
+        net - LRSNetwork the routes index into (the loaded LRS by default)
+    """
+    if net is None:
+        net = get_network()
+    distances = shapely.line_locate_point(net.geoms[routes], points)
+    return np.round(net.measures.measures_at(routes, distances), 3)
+
+
+def locate_coordinates(lng, lat, d=searchRadius, net=None):
+    """ Projects wgs84 coordinates and finds every route of net (the loaded
+        LRS by default) within d of each point along with the point's m-value
+        on that route.
+        returns a DataFrame of (point, route, distance, measure) rows, where
+        point indexes the input arrays """
+    if net is None:
+        net = get_network()
+    with metrics.stage('projection'):
+        x, y = project_coordinates(lng, lat, wgs84, net.crs)
+        points = shapely.points(x, y)
+    candidates = find_nearby_routes_bulk(points, d, net)
+    with metrics.stage('linear_referencing'):
+        candidates['measure'] = locate_points(candidates['route'].to_numpy(), points[candidates['point'].to_numpy()], net)
+
+    return candidates
+
+
+def point_cache(path=None, maxSize=1000000, precision=7):
+    """ Creates a PointCache for the loaded LRS.  With a path, located points
+        are also kept in that sqlite file for later runs, and are thrown away
+        when the LRS or search radius changes. """
+    net = get_network()
+    lrsKey = {'lrs': LRSCache.cache_key(net.path, net.crs), 'searchRadius': searchRadius}
+    return PointCache(maxSize, precision, path, lrsKey)
+
+
 def locate_point_on_route(rte_nm, point):
     """ Given a rte_nm and point, this function will find the closest
         location along the line to the input point, then return the
@@ -72,73 +230,35 @@ def locate_point_on_route(rte_nm, point):
     """
 
     try:
-        # Get LRS rte geometry
-        lineGeom = lrs.loc[lrs['RTE_NM'] == rte_nm]['geometry'].item()
-
-        # Find point on input route
-        nearestPoints = nearest_points(lineGeom, point)
-        testPoint = nearestPoints[0]
-
-        # Find index of next and previous vertices
-        lrsIndex = 0  # Find index to look up MP values.  This needs to be tracked here because the index in multi-part lines resets with each new line
-
-        ## Find distance from each vertex to input point and store in list as tuple (index, distance).  The two shortest distances are the vertices that we need
-        vertexDistanceList = []
-        previousVertex = None
-        nextVertex = None
-
-        if lineGeom.type == 'LineString':
-            for i in range(len(lineGeom.coords) - 1):
-                if LineString([lineGeom.coords[i], lineGeom.coords[i+1]]).intersects(testPoint.buffer(0.1)):
-                    previousVertex = LRSVertex(i, rte_nm, Point(lineGeom.coords[i]))
-                    nextVertex = LRSVertex(i + 1, rte_nm, Point(lineGeom.coords[i + 1]))
-                    break
-        else:
-            for line in lineGeom:
-                for n in range(len(line.coords) - 1):
-                    if LineString([line.coords[n], line.coords[n+1]]).intersects(testPoint.buffer(0.1)):
-                        previousVertex = LRSVertex(lrsIndex, rte_nm, Point(line.coords[n]))
-                        nextVertex = LRSVertex(lrsIndex + 1, rte_nm, Point(line.coords[n + 1]))
-                        break
-                    lrsIndex += 1
-                if previousVertex is not None:
-                    break
-                lrsIndex += 1 # Because the last vertex of each line isn't accounted for (len(coords) - 1 above)
-
-        if not previousVertex or not nextVertex:
-            print(f'Could not find a the line segment that the testPoint lies on')
+        testPointMP = locate_points(np.array([get_network().find_route(rte_nm, point)]), np.array([point]))[0]
+        if np.isnan(testPointMP):
+            logger.warning(f'Could not find the m-value for {rte_nm}')
+            metrics.count('errors.no_measure')
             return None
 
-        # Find distance between previousVertex and nextVertex
-        segmentLength = find_distance(previousVertex.geom, nextVertex.geom)
-
-        # Find distance between previousVertex and testVertex
-        distToTestPoint = find_distance(previousVertex.geom, testPoint)
-
-        distRatio = distToTestPoint / segmentLength
-
-        # Find previous and next vertex MP values
-        previousVertexMP = mValueDict[rte_nm][previousVertex.index]
-        nextVertexMP = mValueDict[rte_nm][nextVertex.index]
-
-        if distRatio == 0:
-            testPointMP = previousVertexMP
-        else:
-            testPointMP = previousVertexMP + ((nextVertexMP - previousVertexMP) * distRatio)
-
-        return round(testPointMP, 3)
+        return float(testPointMP)
 
     except Exception as e:
-        print(f'locate_point_on_route failed for {rte_nm}!')
-        print(e)
-        print(traceback.format_exc())
+        logger.warning(f'locate_point_on_route failed for {rte_nm}: {e}')
+        logger.debug('locate_point_on_route traceback', exc_info=True)
+        metrics.count('errors.locate_failed')
         
         return None
 
 
-def create_event_table(csvPath, outPath):
-    outputRows = []
-    with open(csvPath, newline='') as file:
+def create_event_table(csvPath, outPath, workers=1):
+    """ Creates an event table from a csv of projects with DD coordinates.
+        With workers > 1, the csv is located in chunks by a pool of processes
+        (see create_event_table_batch), which writes the same table. """
+    if workers > 1:
+        create_event_table_batch(csvPath, outPath, workers)
+        return
+
+    # Output is collected column by column rather than as a list of row dicts.
+    # The loop is timed as a whole, since timing each point would cost more
+    # than it tells.
+    outputColumns = {field: [] for field in eventFields}
+    with open(csvPath, newline='') as file, metrics.stage('locate'):
         fileData = csv.DictReader(file)
         for row in fileData:
             try:
@@ -164,41 +284,11 @@ def create_event_table(csvPath, outPath):
                 comment = ''
 
                 # Project points
-                project = pyproj.Transformer.from_crs(wgs84, utm, always_xy=True).transform
-                beginPoint = transform(project, beginPoint)
-                endPoint = transform(project, endPoint)
-
-                # Search nearby routes until it's clear which rte_nm a project belongs to by
-                # reducing the search radius by 1 meter until only 1 rte_nm matches between
-                # both begin point and end point.
-                x = 25 # Initial search distance
-                matchRoutes = None
-                while x > 0:
-                    # Select routes found within x meters of point
-                    beginRoutes = select_nearby_routes(beginPoint, x)
-                    endRoutes = select_nearby_routes(endPoint, x)
-
-                    # Find rte_nm that matches between both points
-                    matchRoutes = [rte for rte in beginRoutes if rte in endRoutes]
-
-                    if x == 25 and len(matchRoutes) == 0:
-                        # No routes within 25m of point
-                        break
-
-                    if x < 25 and len(matchRoutes) == 0:
-                        # Both routes are close to equal distance.  Go back one meter and return both routes.
-                        print('Return both routes')
-                        x += 1
-                        beginRoutes = select_nearby_routes(beginPoint, x)
-                        endRoutes = select_nearby_routes(endPoint, x)
-                        matchRoutes = [rte for rte in beginRoutes if rte in endRoutes]
-                        break
-
-                    if len(matchRoutes) == 1:
-                        # Route found
-                        break
-
-                    x -= 1
+                beginPoint = project_point(beginPoint, wgs84, targetCRS)
+                endPoint = project_point(endPoint, wgs84, targetCRS)
+
+                # Find the route shared by both points, ranked by distance
+                matchRoutes = match_routes(beginPoint, endPoint)
 
                 if not matchRoutes:
                     comment = "ERROR No matching routes found."
@@ -228,12 +318,12 @@ def create_event_table(csvPath, outPath):
                     "comments": comment
                 }
 
-                outputRows.append(outputRow)
+                for field in eventFields:
+                    outputColumns[field].append(outputRow[field])
                 
             except Exception as e:
-                print(e)
-                # print(traceback.format_exc())
-                print(f"{row['id']}.")
+                logger.warning(f"Could not locate {row['id']}: {e}")
+                logger.debug('create_event_table traceback', exc_info=True)
                 comment = "ERROR"
                 try:
                     if not row['begin_lat']:
@@ -264,9 +354,273 @@ def create_event_table(csvPath, outPath):
                     "end_lng": row['end_lng'],
                     "comments": comment
                 }
-                outputRows.append(outputRow)
+                for field in eventFields:
+                    outputColumns[field].append(outputRow[field])
 
-    outputDF = pd.DataFrame(outputRows)
-    outputDF.to_csv(outPath, index=False)
+    outputDF = pd.DataFrame(outputColumns)
+    count_errors(outputDF['comments'])
+    with metrics.stage('write'):
+        EventTableIO.write_events(outputDF, outPath)
     print(f'Event table saved at "{outPath}"')
 
+
+
+def count_errors(comments):
+    """ Counts the rows of an event table by the kind of error in their comments """
+    # An empty table has no text to infer the column's dtype from
+    comments = comments.fillna('').astype(str)
+    metrics.count('errors.no_matching_route', comments.str.contains('No matching routes').sum())
+    metrics.count('errors.missing_coordinates', comments.str.contains('Missing').sum())
+    metrics.count('errors.identical_points', comments.str.contains('identical').sum())
+    metrics.count('errors.unreadable_coordinates', (comments == 'ERROR').sum())
+
+
+# Text that float() reads as NaN, which pd.to_numeric can't tell apart from
+# text that is not a number
+nanPattern = r'(?i)^\s*[+-]?nan\s*$'
+
+
+def readable(values):
+    """ True for the strings in values that float() can read, including the
+        ones it reads as NaN """
+    numbers = pd.to_numeric(values, errors='coerce').notna()
+    unread = ~numbers
+    numbers[unread] = values[unread].astype(str).str.match(nanPattern)
+    return numbers
+
+
+def to_float(values):
+    """ Converts a Series of strings to floats exactly as float() would,
+        with NaN for values that are missing or not numbers """
+    return values.where(readable(values)).astype(float)
+
+
+def locate_events(df, cache=None, net=None, d=None):
+    """ Vectorized version of the create_event_table loop.  Accepts a DataFrame
+        with the columns of the converted csv, read as strings, and returns the
+        event table as a DataFrame with the same rows and comments that
+        create_event_table would write.  An optional PointCache (see
+        point_cache) lets points located by earlier calls be reused.  Events
+        are located on net, or the loaded LRS by default, with routes up to d
+        from both points (searchRadius by default).  A cache must have been
+        made for the same d.
+    """
+    if net is None:
+        net = get_network()
+    if d is None:
+        d = searchRadius
+    coordFields = ['begin_lat', 'begin_lng', 'end_lat', 'end_lng']
+    raw = df[coordFields].fillna('')
+
+    # Missing end coordinates (point data) are duplicated from the begin coordinates
+    text = pd.DataFrame({
+        'begin_lat': raw['begin_lat'],
+        'begin_lng': raw['begin_lng'],
+        'end_lat': raw['end_lat'].mask(raw['end_lat'] == '', raw['begin_lat']),
+        'end_lng': raw['end_lng'].mask(raw['end_lng'] == '', raw['begin_lng'])
+    }, index=df.index)
+    coords = pd.DataFrame({field: to_float(text[field]) for field in coordFields}, index=df.index)
+    valid = np.logical_and.reduce([readable(text[field]).to_numpy() for field in coordFields])
+    good = coords[valid]
+
+    # Locate each distinct point once, since point events repeat their begin
+    # point and projects often share intersections.  Points that float() reads
+    # but that are not finite, such as 'nan', match no route.
+    finite = np.flatnonzero(np.isfinite(good.to_numpy()).all(axis=1))
+    lng = np.concatenate([good['begin_lng'].to_numpy()[finite], good['end_lng'].to_numpy()[finite]])
+    lat = np.concatenate([good['begin_lat'].to_numpy()[finite], good['end_lat'].to_numpy()[finite]])
+    if cache is None:
+        uniqueLngLat, inverse = np.unique(np.column_stack([lng, lat]), axis=0, return_inverse=True)
+        candidates = locate_coordinates(uniqueLngLat[:, 0], uniqueLngLat[:, 1], d, net)
+    else:
+        inverse, candidates = cache.locate(lng, lat, lambda lng, lat: locate_coordinates(lng, lat, d, net))
+    inverse = inverse.ravel()
+
+    # Candidate routes of each project's begin and end points
+    candidates = candidates.rename(columns={'point': 'unique'})
+    beginPairs = pd.DataFrame({'point': finite, 'unique': inverse[:len(finite)]}).merge(candidates, on='unique')
+    endPairs = pd.DataFrame({'point': finite, 'unique': inverse[len(finite):]}).merge(candidates, on='unique')
+    best = rank_shared_routes(beginPairs.drop(columns='unique'), endPairs.drop(columns='unique'))
+
+    matched = np.zeros(len(good), dtype=bool)
+    matched[best['point'].to_numpy()] = True
+    rte_nm = np.full(len(good), None, dtype=object)
+    rte_nm[best['point'].to_numpy()] = net.names[best['route'].to_numpy()]
+    begin_msr = np.full(len(good), np.nan)
+    end_msr = np.full(len(good), np.nan)
+    begin_msr[best['point'].to_numpy()] = best['measure_begin'].to_numpy()
+    end_msr[best['point'].to_numpy()] = best['measure_end'].to_numpy()
+
+    # Nudge point events apart so that the event has a length
+    nudge = (begin_msr == end_msr) & (begin_msr != 0)
+    begin_msr[nudge] -= 0.1
+    end_msr[nudge] += 0.1
+
+    comments = np.where(matched, '', 'ERROR No matching routes found.').astype(object)
+    identical = ((good['begin_lat'] == good['end_lat']) & (good['begin_lng'] == good['end_lng'])).to_numpy()
+    comments[identical] += '  ERROR Begin and end point are identical'
+
+    # Rows with missing or unreadable begin coordinates keep their input values
+    badComments = pd.Series('ERROR', index=df.index)[~valid]
+    bad = raw[~valid]
+    for field in ['begin_lat', 'begin_lng', 'end_lng', 'end_lat']:
+        badComments[bad[field] == ''] += f' Missing {field}.'
+    badIdentical = (bad != '').all(axis=1) & (bad['begin_lat'] == bad['end_lat']) & (bad['begin_lng'] == bad['end_lng'])
+    badComments[badIdentical] += '  ERROR Begin and end point are identical'
+
+    output = pd.DataFrame({
+        'organization': df['organization'],
+        'id': df['id'],
+        'rte_nm': None,
+        'begin_msr': np.nan,
+        'end_msr': np.nan,
+        'begin_lat': raw['begin_lat'].astype(object),
+        'begin_lng': raw['begin_lng'].astype(object),
+        'end_lat': raw['end_lat'].astype(object),
+        'end_lng': raw['end_lng'].astype(object),
+        'comments': badComments
+    }, index=df.index)
+    output.loc[valid, 'rte_nm'] = rte_nm
+    output.loc[valid, 'begin_msr'] = begin_msr
+    output.loc[valid, 'end_msr'] = end_msr
+    for field in coordFields:
+        output.loc[valid, field] = good[field].to_numpy()
+    output.loc[valid, 'comments'] = comments
+    count_errors(output['comments'])
+
+    return output.reset_index(drop=True)
+
+
+def locate_events_measured(df):
+    """ locate_events for a worker process.  returns the events along with
+        a snapshot of the metrics recorded while locating them, for the
+        parent to merge. """
+    metrics.reset()
+    output = locate_events(df)
+    return output, metrics.snapshot()
+
+
+def merge_measured(result):
+    """ Merges the metrics of a locate_events_measured result and returns its events """
+    output, workerMetrics = result
+    metrics.merge(workerMetrics)
+    return output
+
+
+def init_worker(path, crs):
+    """ Pool initializer.  Forked workers already share the parent's network
+        (copy-on-write), so only spawned workers need to load it, which is
+        fast from the memory-mapped cache. """
+    if network is None or network.path != path or network.crs != crs:
+        load_lrs(path, crs)
+
+
+def worker_pool(workers):
+    """ Starts a pool of workers that share the loaded LRS """
+    # Load (or build the cache for) the LRS once here so that forked workers
+    # inherit it and spawned workers find the cache ready
+    net = get_network()
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return context.Pool(workers, initializer=init_worker, initargs=(net.path, net.crs))
+
+
+def locate_events_parallel(df, workers, chunksPerWorker=4):
+    """ Runs locate_events on chunks of df in a pool of worker processes.
+        Rows are returned in their input order. """
+    chunkSize = max(1, -(-len(df) // (workers * chunksPerWorker)))
+    chunks = [df.iloc[i:i + chunkSize] for i in range(0, len(df), chunkSize)]
+    if len(chunks) <= 1:
+        return locate_events(df)
+
+    with worker_pool(workers) as pool:
+        results = pool.map(locate_events_measured, chunks)
+
+    return pd.concat([merge_measured(result) for result in results], ignore_index=True)
+
+
+def to_text(df):
+    """ Formats every value of df the way it would read back from a csv
+        written by to_csv: numbers as text and missing values as ''.  Each
+        column is formatted at once, and values that repeat, such as route
+        names and rounded measures, are only formatted once. """
+    columns = {}
+    for field in df.columns:
+        # Missing values have code -1
+        codes, uniques = pd.factorize(df[field])
+        text = np.array(list(map(str, np.asarray(uniques).tolist())) + [''], dtype=object)
+        columns[field] = text[codes]
+
+    return pd.DataFrame(columns, index=df.index, columns=df.columns)
+
+
+def read_chunks(csvPath, chunkSize):
+    """ Yields the converted csv at csvPath in DataFrames of chunkSize rows,
+        read as strings like create_event_table_batch does """
+    with pd.read_csv(csvPath, dtype=str, keep_default_na=False, chunksize=chunkSize) as reader:
+        while True:
+            with metrics.stage('parse'):
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def locate_event_chunks(chunks, workers=1, cache=None):
+    """ Yields an event table chunk for each chunk of projects.  chunks can be
+        any iterable of DataFrames with the converted csv columns, such as
+        read_chunks or the converted chunks from XY_to_Events_Step1.  With
+        workers > 1, chunks are located by a pool of processes, and at most
+        two per worker are held in memory at a time.  A PointCache can only
+        be used by a single process. """
+    if workers <= 1:
+        for chunk in chunks:
+            yield locate_events(to_text(chunk), cache)
+        return
+
+    with worker_pool(workers) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(locate_events_measured, (to_text(chunk),)))
+            if len(pending) >= workers * 2:
+                yield merge_measured(pending.popleft().get())
+        while pending:
+            yield merge_measured(pending.popleft().get())
+
+
+def write_event_chunks(chunks, outPath):
+    """ Appends each event table chunk to outPath as it arrives, so memory use
+        does not grow with the size of the input.  outPath can be a csv,
+        Parquet or Arrow file (see EventTableIO).  Finished rows of a csv are
+        already on disk if the run stops early.  returns the number of rows
+        written """
+    with EventTableIO.EventWriter(outPath) as writer:
+        for chunk in chunks:
+            with metrics.stage('write'):
+                writer.write(chunk)
+
+    return writer.rowCount
+
+
+def create_event_table_stream(csvPath, outPath, chunkSize=100000, workers=1, cache=None):
+    """ Streaming version of create_event_table_batch.  The csv is read,
+        located, and written chunkSize rows at a time. """
+    rowCount = write_event_chunks(locate_event_chunks(read_chunks(csvPath, chunkSize), workers, cache), outPath)
+    print(f'Event table with {rowCount} rows saved at "{outPath}"')
+
+
+def create_event_table_batch(csvPath, outPath, workers=1, cache=None):
+    """ Column-wise version of create_event_table for large csv files.  The
+        whole csv is located at once instead of one row at a time, split
+        across a pool of processes when workers > 1.  A PointCache can only
+        be used with a single worker. """
+    with metrics.stage('parse'):
+        df = pd.read_csv(csvPath, dtype=str, keep_default_na=False)
+    if workers > 1:
+        outputDF = locate_events_parallel(df, workers)
+    else:
+        outputDF = locate_events(df, cache)
+    with metrics.stage('write'):
+        EventTableIO.write_events(outputDF, outPath)
+    print(f'Event table saved at "{outPath}"')
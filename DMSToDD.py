@@ -1,3 +1,10 @@
+import logging
+import numpy as np
+import pandas as pd
+from Instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
 
 def dms_to_dd(dms):
     """ Accepts coordinates in DMS format written in various ways
@@ -85,7 +92,7 @@ def dms_to_dd(dms):
         m = int(numList[1])
         s = float(numList[2])
     except:
-        print(f'Error converteing {dms}')
+        logger.warning(f'Error converteing {dms}')
         return
 
     if d > 60: # In VA, this means it's longitude and should be negative
@@ -100,6 +107,122 @@ def dms_to_dd(dms):
     return(round(dd, 7))
 
 
+# Digits as float() reads them, which allows single underscores between digits
+digitPattern = r'\d(?:_?\d)*'
+
+# A whole string that float() accepts
+floatPattern = (rf'^\s*[+-]?(?:{digitPattern}\.?(?:{digitPattern})?|\.{digitPattern})(?:[eE][+-]?{digitPattern})?\s*$'
+                r'|(?i:^\s*[+-]?(?:inf(?:inity)?|nan)\s*$)')
+
+# A run of digits and decimals that dms_to_dd would keep as a number.  Runs
+# like '1.2.3' are not numbers and are skipped entirely.
+numberPattern = r'(?<![\d.])(\d+\.?\d*|\.\d+)(?![\d.])'
+
+
+def dms_to_dd_series(values, cache=None):
+    """ Column-wise version of dms_to_dd.  Accepts a pandas Series of
+        coordinates in any format that dms_to_dd accepts and converts them all
+        at once with pandas string methods instead of one value at a time.
+        Each distinct value is only parsed once.  An optional LRUCache keeps
+        parsed values between calls, such as between the chunks of a stream.
+
+        returns a tuple (dd, failed), where dd is a float Series with NaN
+        for missing and unreadable values and failed is a boolean Series that
+        is True for values that could not be parsed (where dms_to_dd returns
+        None or raises an error)
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+
+    if cache is None:
+        uniqueDD, uniqueFailed = parse_dms_series(uniques)
+    else:
+        cached = [cache.get(value) for value in uniques]
+        missing = np.array([result is None for result in cached], dtype=bool)
+        metrics.count('dms_cache.hits', (~missing).sum())
+        metrics.count('dms_cache.misses', missing.sum())
+        parsedDD, parsedFailed = parse_dms_series(uniques[missing])
+        for value, dd, fail in zip(uniques[missing], parsedDD, parsedFailed):
+            cache.put(value, (dd, fail))
+        uniqueDD = pd.Series([np.nan if result is None else result[0] for result in cached], dtype=float)
+        uniqueFailed = pd.Series([False if result is None else result[1] for result in cached], dtype=bool)
+        uniqueDD[missing] = parsedDD.to_numpy()
+        uniqueFailed[missing] = parsedFailed.to_numpy()
+
+    # Missing values have code -1
+    dd = pd.Series(np.append(uniqueDD.to_numpy(), np.nan)[codes], index=values.index)
+    failed = pd.Series(np.append(uniqueFailed.to_numpy(), False)[codes], index=values.index)
+
+    return dd, failed
+
+
+def parse_dms_series(values):
+    """ Does the parsing for dms_to_dd_series, without looking for repeats """
+    values = pd.Series(values)
+    missing = values.isna()
+    dd = pd.Series(np.nan, index=values.index)
+    failed = pd.Series(False, index=values.index)
+    text = values[~missing].astype(str)
+
+    # Blank values have no last character, which dms_to_dd can't handle
+    blank = text.str.strip() == ''
+    failed[blank[blank].index] = True
+    text = text[~blank]
+
+    # Hemisphere specified as the last char
+    trailing = text.str.strip().str[-1].isin(['N', 'W'])
+    WorS = trailing & (text.str[-1] == 'W')
+    text = text.where(~trailing, text.str[:-1])
+
+    # Hemisphere specified by negative sign as the first char.  A value that
+    # was only 'N' or 'W' is empty now, which dms_to_dd can't handle either.
+    empty = text == ''
+    failed[empty[empty].index] = True
+    text = text[~empty]
+    WorS = WorS[~empty] | (text.str[0] == '-')
+
+    # Values that are already DD
+    isFloat = text.str.match(floatPattern)
+    floatDD = text[isFloat].str.replace('_', '', regex=False).astype(float)
+    WorSFloat = WorS[isFloat]
+
+    # Everything else is split into its numbers.  Any W or S among the other
+    # characters puts it in the western or southern hemisphere.
+    rest = text[~isFloat]
+    WorSRest = WorS[~isFloat] | rest.str.contains('[WSws]')
+    numbers = rest.str.extractall(numberPattern)[0].unstack()
+    numbers = numbers.reindex(index=rest.index, columns=[0, 1, 2]).fillna('').astype(str)
+    numberCount = rest.str.count(numberPattern)
+
+    # A single number is probably DD already
+    single = numberCount == 1
+    floatDD = pd.concat([floatDD, numbers.loc[single, 0].astype(float)])
+    WorSFloat = pd.concat([WorSFloat, WorSRest[single]])
+    floatDD = floatDD.where(~(WorSFloat & (floatDD > 0)), -floatDD)
+    floatDD = floatDD.where(~(floatDD > 60), -floatDD) # In VA, this means it's longitude and should be negative
+    dd[floatDD.index] = floatDD
+
+    # Degrees and minutes must be whole numbers
+    triple = numbers[numberCount >= 3]
+    wholeDM = triple[0].str.isdecimal() & triple[1].str.isdecimal()
+    unreadable = numberCount.index[(numberCount != 1) & (numberCount < 3)].union(triple.index[~wholeDM])
+    failed[unreadable] = True
+
+    triple = triple[wholeDM]
+    d = triple[0].astype(int)
+    m = triple[1].astype(int)
+    sec = triple[2].astype(float)
+    dmsDD = d + m / 60 + sec / 3600
+    negative = WorSRest[triple.index] | (d > 60) # In VA, d > 60 means it's longitude and should be negative
+    dmsDD = dmsDD.where(~negative, -dmsDD)
+    # round, like dms_to_dd does.  np.round can be a unit in the last place
+    # off from it near ties.
+    dd[triple.index] = [round(value, 7) for value in dmsDD.tolist()]
+
+    return dd, failed
+
+
 if __name__ == '__main__':
     # input = "-80.214244°"
     # output = dms_to_dd(input)
@@ -112,4 +235,9 @@ if __name__ == '__main__':
     input = "-80.214244°"
     output = dms_to_dd(input)
     print(f'Input: {input}\nOutput: {output}\n')
-    
+
+    # Compare the column-wise parser to dms_to_dd
+    inputs = pd.Series(['37 19 09.05N', 'W79-30\'-16.35"', '-80.214244°', '37.3192', '79.5045', '37°19\'9.05"', 'N37-19\'-9.05"', None])
+    output, failed = dms_to_dd_series(inputs)
+    for value, dd, fail in zip(inputs, output, failed):
+        print(f'Input: {value}\nOutput: {dms_to_dd(value)}  Series output: {None if fail else dd}\n')
@@ -0,0 +1,490 @@
+#-------------------------------------------------------------------------------
+# Name:        EventGeometry.py
+# Purpose:     This script does the reverse of XY_to_Events_Step1.py: it
+#              takes a table of events with rte_nm, begin_msr and end_msr
+#              (such as Franklin.csv or the Step 1 event table) and finds
+#              their geometry on the LRS, for QA and mapping.  Line events
+#              become the part of their route between the two measures, and
+#              with --kind begin or end, the point at that measure.
+#
+#              Output is a GeoPackage (.gpkg) or GeoParquet (.parquet) file
+#              with the input columns, the geometry, and geometry_comments
+#              for events that could not be placed exactly (unknown routes,
+#              measures beyond the end of the route or in a gap between its
+#              parts).  The events are read and written --chunk-size rows at
+#              a time, so tables with millions of events do not need to fit
+#              in memory.
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import shapely
+import CreateEventTable
+import EventTableIO
+from Instrumentation import metrics
+from RouteMeasures import ranges
+
+# Where a measure was found on its route (see MeasureIndex.segment_at)
+positionFound = 0
+positionOutside = 1 # Beyond the first or last measure of the route, and moved to that end
+positionGap = 2 # Between the measures of two parts of the route
+positionUnmeasured = 3 # The route has no usable m-values
+
+# Geometry formats, chosen by file extension
+geometryFormats = {'.gpkg': 'gpkg', '.parquet': 'geoparquet', '.geoparquet': 'geoparquet'}
+
+
+class MeasureIndex:
+    """ Finds where measures fall on the routes of an LRS.  Built once from the
+        flat RouteMeasures arrays of a network, so that millions of measures
+        can be placed with a few numpy passes.
+
+        Routes whose m-values only increase (or only decrease) along the route
+        are searched with a vectorized binary search.  Routes whose m-values
+        go back and forth are searched segment by segment, and a measure that
+        appears more than once is placed at its first appearance.
+    """
+    def __init__(self, measures):
+        self.measures = measures
+        offsets = measures.offsets
+        m = measures.m
+        routeCount = len(offsets) - 1
+        vertexCount = np.diff(offsets)
+        self.vertexRoute = np.repeat(np.arange(routeCount), vertexCount)
+        self.vertexPart = np.repeat(np.arange(len(measures.partOffsets) - 1), np.diff(measures.partOffsets))
+        self.partStart = np.zeros(len(m) + 1, dtype=bool)
+        self.partStart[measures.partOffsets[:-1]] = True
+
+        # Direction of each route's m-values: 1 if they never decrease, -1 if
+        # they never increase, and 0 otherwise or if any are missing
+        step = np.diff(m)
+        inRoute = self.vertexRoute[1:] == self.vertexRoute[:-1]
+        segmentRoute = self.vertexRoute[:-1][inRoute]
+        step = step[inRoute]
+        notUp = np.bincount(segmentRoute[~(step >= 0)], minlength=routeCount)
+        notDown = np.bincount(segmentRoute[~(step <= 0)], minlength=routeCount)
+        self.directions = np.where(notUp == 0, 1, np.where(notDown == 0, -1, 0))
+        self.directions[vertexCount < 2] = 0
+
+        # Measure range of each route, ignoring missing m-values
+        self.mMin = np.full(routeCount, np.nan)
+        self.mMax = np.full(routeCount, np.nan)
+        nonEmpty = vertexCount > 0
+        if nonEmpty.any():
+            self.mMin[nonEmpty] = np.fmin.reduceat(m, offsets[:-1][nonEmpty])
+            self.mMax[nonEmpty] = np.fmax.reduceat(m, offsets[:-1][nonEmpty])
+        self.measured = (vertexCount >= 2) & ~np.isnan(self.mMin)
+
+        # m-values flipped on decreasing routes so every monotonic route increases
+        self.key = m * np.repeat(self.directions, vertexCount)
+
+    def __repr__(self):
+        return f'<MeasureIndex {len(self.directions)} routes, {int((self.directions == 0).sum())} not monotonic>'
+
+    def segment_at(self, routes, measures, tolerance=0):
+        """ Finds the segment of each route that measures fall on.
+
+            routes - array of route indexes
+            measures - array of m-values
+            tolerance - how far beyond the measures of a route a measure can
+                        be before it is reported as outside
+
+            returns (i, ratio, status): the index of each segment's first
+            vertex, how far along the segment (0 to 1) the measure falls, and
+            one of the position constants.  Measures beyond the ends of a
+            route are placed at the end, and measures in a gap between parts
+            are placed on the segment that joins the parts, so the caller can
+            choose which side to move them to.
+        """
+        routes = np.asarray(routes, dtype=np.int64)
+        measures = np.asarray(measures, dtype=float)
+        offsets = self.measures.offsets
+        i = np.zeros(len(routes), dtype=np.int64)
+        ratio = np.zeros(len(routes))
+        status = np.full(len(routes), positionUnmeasured)
+
+        # Binary search of the monotonic routes, one step for every event at a time
+        monotonic = np.flatnonzero(self.directions[routes] != 0)
+        direction = self.directions[routes[monotonic]]
+        target = measures[monotonic] * direction
+        low = offsets[routes[monotonic]]
+        high = offsets[routes[monotonic] + 1] - 2
+        active = low < high
+        while active.any():
+            middle = (low + high + 1) // 2
+            below = self.key[middle] <= target
+            low = np.where(active & below, middle, low)
+            high = np.where(active & ~below, middle - 1, high)
+            active = low < high
+        k0, k1 = self.key[low], self.key[low + 1]
+        span = k1 - k0
+        i[monotonic] = low
+        ratio[monotonic] = np.where(span > 0, np.clip(np.divide(target - k0, span, out=np.zeros(len(low)), where=span > 0), 0, 1),
+                                    target >= k1)
+        status[monotonic] = positionFound
+
+        # Segment by segment search of the rest
+        other = np.flatnonzero((self.directions[routes] == 0) & self.measured[routes])
+        if len(other):
+            groups = pd.Series(other).groupby(routes[other]).indices
+            for route, members in groups.items():
+                events = other[members]
+                self.search_route(route, measures[events], events, i, ratio)
+            status[other] = positionFound
+
+        outside = (measures < self.mMin[routes] - tolerance) | (measures > self.mMax[routes] + tolerance)
+        status[(status == positionFound) & outside] = positionOutside
+        inGap = (status == positionFound) & self.partStart[i + 1] & (ratio > 0) & (ratio < 1)
+        status[inGap] = positionGap
+        metrics.count('event_geometry.not_monotonic', len(other))
+
+        return i, ratio, status
+
+    def search_route(self, route, measures, events, i, ratio):
+        """ Places measures on a route with m-values that are not monotonic,
+            writing the segment and ratio of each into i and ratio at events.
+            Measures not on any segment go to the vertex with the closest
+            m-value. """
+        m = self.measures.m
+        start, end = self.measures.offsets[route], self.measures.offsets[route + 1]
+        m0, m1 = m[start:end - 1], m[start + 1:end]
+        low, high = np.fmin(m0, m1), np.fmax(m0, m1)
+        contains = (low <= measures[:, None]) & (measures[:, None] <= high)
+        segment = contains.argmax(axis=1)
+        found = contains.any(axis=1)
+
+        span = m1[segment] - m0[segment]
+        i[events] = start + segment
+        ratio[events] = np.divide(measures - m0[segment], span, out=np.zeros(len(measures)), where=span != 0)
+
+        if not found.all():
+            distance = np.abs(m[start:end] - measures[~found, None])
+            vertex = np.nanargmin(np.where(np.isnan(distance), np.inf, distance), axis=1)
+            last = vertex == end - start - 1
+            i[events[~found]] = start + vertex - last
+            ratio[events[~found]] = last.astype(float)
+
+    def nearest_part(self, i, ratio, status, measures):
+        """ ratio with the measures that are in a gap between parts moved to
+            the end of the part with the closer measure """
+        m = self.measures.m
+        gap = status == positionGap
+        ratio = ratio.copy()
+        ratio[gap] = np.abs(measures[gap] - m[i[gap] + 1]) < np.abs(measures[gap] - m[i[gap]])
+        return ratio
+
+    def points(self, i, ratio):
+        """ Coordinates that lie ratio along segments i """
+        xy = self.measures.xy
+        return xy[i] + (xy[i + 1] - xy[i]) * ratio[:, None]
+
+    def lines(self, begin, end):
+        """ The parts of the routes between two positions, in the direction
+            of the route.
+
+            begin, end - (i, ratio) tuples like segment_at returns, with begin
+                         before end on the same route.  A position in a gap
+                         between parts is expected to be at one end of the gap.
+
+            returns an array of LineStrings, MultiLineStrings for events that
+            cross a gap between parts, and None for events without two
+            distinct vertices on the same part
+        """
+        xy = self.measures.xy
+        i0, ratio0 = begin
+        i1, ratio1 = end
+        n = len(i0)
+
+        # Route vertices between the two positions, not counting ones that
+        # the positions are on
+        interiorStart = i0 + 1 + (ratio0 >= 1)
+        interiorEnd = np.maximum(i1 + (ratio1 > 0), interiorStart)
+        interior = ranges(interiorStart, interiorEnd)
+        counts = 2 + interiorEnd - interiorStart
+
+        eventStart = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=eventStart[1:])
+        coordEvent = np.repeat(np.arange(n), counts)
+        isInterior = np.ones(len(coordEvent), dtype=bool)
+        isInterior[eventStart[:-1]] = False
+        isInterior[eventStart[1:] - 1] = False
+
+        coords = np.empty((len(coordEvent), 2))
+        coordPart = np.empty(len(coordEvent), dtype=np.int64)
+        coords[eventStart[:-1]] = self.points(i0, ratio0)
+        coords[eventStart[1:] - 1] = self.points(i1, ratio1)
+        coords[isInterior] = xy[interior]
+        coordPart[eventStart[:-1]] = self.vertexPart[i0 + (ratio0 >= 1)]
+        coordPart[eventStart[1:] - 1] = self.vertexPart[i1 + (ratio1 >= 1)]
+        coordPart[isInterior] = self.vertexPart[interior]
+
+        # A new line starts with each event and at each change of part.
+        # Lines with one vertex (an event that only touches a part) are dropped.
+        newLine = np.ones(len(coordEvent), dtype=bool)
+        newLine[1:] = (coordEvent[1:] != coordEvent[:-1]) | (coordPart[1:] != coordPart[:-1])
+        lineId = np.cumsum(newLine) - 1
+        keep = np.bincount(lineId)[lineId] >= 2
+        lineId = np.cumsum(newLine & keep)[keep] - 1
+        lineEvent = coordEvent[keep][newLine[keep]]
+        lines = shapely.linestrings(coords[keep], indices=lineId)
+
+        output = np.full(n, None, dtype=object)
+        lineCount = np.bincount(lineEvent, minlength=n)
+        single = lineCount == 1
+        output[single] = lines[np.isin(lineEvent, np.flatnonzero(single))]
+        multi = np.isin(lineEvent, np.flatnonzero(lineCount > 1))
+        if multi.any():
+            output[lineCount > 1] = shapely.multilinestrings(lines[multi], indices=np.unique(lineEvent[multi], return_inverse=True)[1].ravel())
+
+        return output
+
+
+def route_indexes(net, index, names, begin, end, tolerance=0):
+    """ Position in net of the route for each rte_nm, or -1 if there is no
+        route with that name.  When more than one record has a name, the first
+        one whose measures (from its MeasureIndex) cover both begin and end is
+        used. """
+    names = pd.Series(names, dtype=object).fillna('')
+    uniqueNames, inverse = np.unique(names.to_numpy(dtype=str), return_inverse=True)
+    candidates = [net.routeIndex.get(rte_nm, [-1]) for rte_nm in uniqueNames.tolist()]
+    output = np.array([routes[0] for routes in candidates], dtype=np.int64)[inverse.ravel()]
+
+    for u in np.flatnonzero([len(routes) > 1 for routes in candidates]):
+        events = np.flatnonzero(inverse.ravel() == u)
+        chosen = np.full(len(events), candidates[u][0])
+        for route in reversed(candidates[u]):
+            low = index.mMin[route] - tolerance
+            high = index.mMax[route] + tolerance
+            covers = (begin[events] >= low) & (begin[events] <= high) & (end[events] >= low) & (end[events] <= high)
+            chosen[covers] = route
+        output[events] = chosen
+
+    return output
+
+
+# MeasureIndex of the last network used.  Built on first use by get_index.
+index = None
+
+
+def get_index(net):
+    """ Returns the MeasureIndex of net, building it if the last one was for
+        another network """
+    global index
+    if index is None or index.measures is not net.measures:
+        index = MeasureIndex(net.measures)
+
+    return index
+
+
+def event_geometries(events, kind='line', tolerance=0.1, net=None):
+    """ Finds the geometry of each event on the LRS.
+
+        events - DataFrame with rte_nm, begin_msr and end_msr columns, as
+                 numbers or as text read from a csv
+        kind - 'line' for the part of the route between begin_msr and
+               end_msr, or 'begin' or 'end' for the point at that measure
+        tolerance - how far beyond the measures of a route a measure can be
+                    without a comment.  Step 1 moves the measures of point
+                    events 0.1 apart, which can take them past the end.
+        net - LRSNetwork to use (the loaded LRS by default)
+
+        returns (geometry, comments): an array of shapely geometries (None
+        where an event could not be placed) and an array of comments
+    """
+    if net is None:
+        net = CreateEventTable.get_network()
+    index = get_index(net)
+    begin = CreateEventTable.to_float(events['begin_msr'].astype(object)).to_numpy()
+    end = CreateEventTable.to_float(events['end_msr'].astype(object)).to_numpy() if 'end_msr' in events else np.full(len(events), np.nan)
+    if kind == 'end':
+        begin = end
+    elif kind != 'line':
+        end = begin
+
+    comments = np.full(len(events), '', dtype=object)
+    with metrics.stage('route_lookup'):
+        routes = route_indexes(net, index, events['rte_nm'], begin, end, tolerance)
+    unknown = routes < 0
+    comments[unknown] += 'ERROR Route not found in the LRS.'
+    missingBegin = np.isnan(begin) & ~unknown
+    missingEnd = np.isnan(end) & ~unknown
+    comments[missingBegin] += f'ERROR Missing {"end_msr" if kind == "end" else "begin_msr"}.'
+    if kind == 'line':
+        comments[missingEnd] += '  ERROR Missing end_msr.'
+    usable = np.flatnonzero(~unknown & ~np.isnan(begin) & ~np.isnan(end))
+
+    with metrics.stage('measure_search'):
+        i0, ratio0, status0 = index.segment_at(routes[usable], begin[usable], tolerance)
+        i1, ratio1, status1 = i0, ratio0, status0
+        if kind == 'line':
+            i1, ratio1, status1 = index.segment_at(routes[usable], end[usable], tolerance)
+
+    unmeasured = (status0 == positionUnmeasured) | (status1 == positionUnmeasured)
+    comments[usable[unmeasured]] += 'ERROR Route has no measures.'
+    for name, status in [('begin_msr' if kind != 'end' else 'end_msr', status0), ('end_msr', status1 if kind == 'line' else None)]:
+        if status is None:
+            continue
+        comments[usable[status == positionOutside]] += f'  WARNING {name} is beyond the end of the route.'
+        comments[usable[status == positionGap]] += f'  WARNING {name} is in a gap between parts of the route.'
+    placed = ~unmeasured
+
+    geometry = np.full(len(events), None, dtype=object)
+    with metrics.stage('geometry'):
+        if kind == 'line':
+            # Order the ends along the route, then move ends in a gap onto
+            # the part on their side of the event
+            swap = (i1 < i0) | ((i1 == i0) & (ratio1 < ratio0))
+            i0, i1 = np.where(swap, i1, i0), np.where(swap, i0, i1)
+            ratio0, ratio1 = np.where(swap, ratio1, ratio0), np.where(swap, ratio0, ratio1)
+            status0, status1 = np.where(swap, status1, status0), np.where(swap, status0, status1)
+            ratio0[status0 == positionGap] = 1
+            ratio1[status1 == positionGap] = 0
+            empty = (i1 < i0) | ((i1 == i0) & (ratio1 < ratio0))
+            comments[usable[placed & empty]] += '  ERROR Event is entirely in a gap between parts of the route.'
+            draw = np.flatnonzero(placed & ~empty)
+            geometry[usable[draw]] = index.lines((i0[draw], ratio0[draw]), (i1[draw], ratio1[draw]))
+        else:
+            ratio0 = index.nearest_part(i0, ratio0, status0, begin[usable])
+            draw = np.flatnonzero(placed)
+            xy = index.points(i0[draw], ratio0[draw])
+            geometry[usable[draw]] = shapely.points(xy)
+
+    comments = np.array([comment.strip() for comment in comments.tolist()], dtype=object)
+    metrics.count('event_geometry.unplaced', int(sum(g is None for g in geometry.tolist())))
+
+    return geometry, comments
+
+
+def geometry_format(path):
+    """ The format of the geometry file at path, from its extension """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in geometryFormats:
+        raise ValueError(f'Unknown geometry format "{extension}" for {path}.  Use one of {", ".join(geometryFormats)}')
+    return geometryFormats[extension]
+
+
+class GeometryWriter:
+    """ Writes events with their geometry to a GeoPackage or GeoParquet file
+        one chunk at a time.
+
+            with GeometryWriter('data/Franklin.gpkg', 'EPSG:26918', 'line') as writer:
+                writer.write(events, geometry)
+
+        GeoPackage needs pyogrio, and GeoParquet needs pyarrow.  Columns in
+        EventTableIO.floatFields are written as numbers and the rest as text.
+    """
+    def __init__(self, path, crs, kind='line', layer=None, format=None):
+        self.path = path
+        self.crs = crs
+        self.kind = kind
+        self.layer = layer or os.path.splitext(os.path.basename(path))[0]
+        self.format = format or geometry_format(path)
+        self.geometryType = 'MultiLineString' if kind == 'line' else 'Point'
+        self.rowCount = 0
+        self.writer = None
+        self.schema = None
+
+        if os.path.exists(path):
+            os.remove(path)
+
+    def __repr__(self):
+        return f'<GeometryWriter {self.format} {self.path}, {self.rowCount} rows>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def columns(self, events):
+        """ events with numbers in floatFields and text everywhere else """
+        columns = {}
+        for field in events.columns:
+            if field in EventTableIO.floatFields:
+                columns[field] = CreateEventTable.to_float(events[field].astype(object)).to_numpy()
+            else:
+                values = events[field].astype(object)
+                columns[field] = values.where(values.notna(), '').astype(str).to_numpy(dtype=object)
+        return pd.DataFrame(columns)
+
+    def write(self, events, geometry, comments=None):
+        frame = self.columns(events)
+        if comments is not None:
+            frame['geometry_comments'] = comments
+        if self.format == 'gpkg':
+            self.write_gpkg(frame, geometry)
+        else:
+            self.write_geoparquet(frame, geometry)
+        self.rowCount += len(frame)
+
+    def write_gpkg(self, frame, geometry):
+        try:
+            import pyogrio
+        except ImportError:
+            raise ImportError('GeoPackage output requires pyogrio (pip install pyogrio)')
+        import geopandas as gp
+        frame = gp.GeoDataFrame(frame, geometry=gp.GeoSeries(geometry, index=frame.index), crs=self.crs)
+        pyogrio.write_dataframe(frame, self.path, layer=self.layer, driver='GPKG', append=self.rowCount > 0,
+                                geometry_type=self.geometryType, promote_to_multi=self.kind == 'line')
+
+    def write_geoparquet(self, frame, geometry):
+        pa = EventTableIO.import_pyarrow()
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.append_column('geometry', pa.array(shapely.to_wkb(geometry), pa.binary()))
+        if self.writer is None:
+            import pyproj
+            geo = {
+                'version': '1.0.0',
+                'primary_column': 'geometry',
+                'columns': {'geometry': {'encoding': 'WKB', 'crs': pyproj.CRS(self.crs).to_json_dict(),
+                                         'geometry_types': ['LineString', 'MultiLineString'] if self.kind == 'line' else ['Point']}}
+            }
+            self.schema = table.schema.with_metadata({b'geo': json.dumps(geo).encode()})
+            self.writer = pa.parquet.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def create_event_geometries(eventPath, outPath, kind='line', chunkSize=100000, tolerance=0.1, layer=None):
+    """ Finds the geometry of every event in eventPath and writes them to
+        outPath (a GeoPackage or GeoParquet file) chunkSize rows at a time.
+        returns the number of events written """
+    net = CreateEventTable.get_network()
+    with GeometryWriter(outPath, net.crs, kind, layer) as writer:
+        for chunk in EventTableIO.read_event_chunks(eventPath, chunkSize, typed=True):
+            geometry, comments = event_geometries(chunk, kind, tolerance, net)
+            with metrics.stage('write'):
+                writer.write(chunk, geometry, comments)
+
+    print(f'{writer.rowCount} event geometries saved at "{outPath}"')
+    return writer.rowCount
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the geometry of rte_nm / begin_msr / end_msr events on the LRS')
+    parser.add_argument('events',
+                        help='csv, Parquet or Arrow table with rte_nm, begin_msr and end_msr columns')
+    parser.add_argument('output',
+                        help='GeoPackage (.gpkg) or GeoParquet (.parquet) file to write')
+    parser.add_argument('--kind', default='line', choices=['line', 'begin', 'end'],
+                        help='line between the measures, or the point at begin_msr or end_msr (default: line)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='events read and written at a time (default: 100000)')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='how far past the end of a route a measure can be without a warning (default: 0.1)')
+    parser.add_argument('--layer',
+                        help='GeoPackage layer name (default: the output file name)')
+    parser.add_argument('--lrs', default=CreateEventTable.lrsPath,
+                        help=f'LRS shapefile (default: {CreateEventTable.lrsPath})')
+    args = parser.parse_args()
+
+    CreateEventTable.load_lrs(args.lrs)
+    create_event_geometries(args.events, args.output, args.kind, args.chunk_size, args.tolerance, args.layer)
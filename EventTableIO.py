@@ -0,0 +1,230 @@
+import os
+import pandas as pd
+import CreateEventTable
+from Instrumentation import metrics
+
+# Event table formats, chosen by file extension.  csv is the default and the
+# only one that does not need pyarrow.
+formats = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+extensions = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Columns stored as text, as numbers, and as dictionaries of their repeated values
+textFields = ['organization', 'id']
+floatFields = ['begin_msr', 'end_msr', 'begin_lat', 'begin_lng', 'end_lat', 'end_lng']
+categoryFields = ['rte_nm', 'comments']
+
+
+def event_format(path):
+    """ The format of the event table at path, from its extension """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in formats:
+        raise ValueError(f'Unknown event table format "{extension}" for {path}.  Use one of {", ".join(formats)}')
+    return formats[extension]
+
+
+def with_format(path, format):
+    """ path with the extension of format, e.g. data/AllProjects_Events.parquet """
+    return os.path.splitext(path)[0] + extensions[format]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet and Arrow event tables require pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+def event_schema(pa):
+    """ Arrow schema of an event table: measures and coordinates are float64,
+        and rte_nm and comments are dictionary encoded """
+    types = {}
+    for field in textFields:
+        types[field] = pa.string()
+    for field in floatFields:
+        types[field] = pa.float64()
+    for field in categoryFields:
+        types[field] = pa.dictionary(pa.int32(), pa.string())
+
+    return pa.schema([(field, types[field]) for field in CreateEventTable.eventFields])
+
+
+def grow_categories(values, categories):
+    """ values as a Categorical whose categories are the list categories with
+        any new values added to the end.  Missing and empty values are left
+        out. """
+    values = values.astype(object).where(values.notna() & (values != ''))
+    categories += list(pd.Index(values.dropna().unique()).difference(pd.Index(categories), sort=False))
+    return pd.Categorical(values, categories=categories)
+
+
+def typed_events(events, categories=None):
+    """ Converts an event table, either as located or as read back as text,
+        to typed columns.  Missing and unreadable numbers become NaN.
+
+        categories - optional dictionary with a list of the values seen so far
+                     for each of categoryFields.  New values are added to the
+                     end, so the categories of every chunk of a stream start
+                     with those of the chunks before it.
+    """
+    if categories is None:
+        categories = {field: [] for field in categoryFields}
+
+    typed = pd.DataFrame(index=events.index)
+    for field in CreateEventTable.eventFields:
+        values = events[field]
+        if field in floatFields:
+            typed[field] = CreateEventTable.to_float(values.astype(object))
+        elif field in categoryFields:
+            typed[field] = grow_categories(values, categories[field])
+        else:
+            typed[field] = values.astype(object).where(values.notna(), '').astype(str)
+
+    return typed
+
+
+class EventWriter:
+    """ Writes an event table to path one chunk at a time, as csv, Parquet, or
+        Arrow IPC (chosen by the extension of path unless format is given).
+        The columnar formats are written straight from the typed columns,
+        with each chunk as its own row group or record batch.  Subclasses can
+        write other columns by overriding fields, arrow_schema and typed.
+
+            with EventWriter('data/AllProjects_Events.parquet') as writer:
+                writer.write(chunk)
+    """
+    def __init__(self, path, format=None):
+        self.path = path
+        self.format = format or event_format(path)
+        self.rowCount = 0
+        self.categories = {field: [] for field in categoryFields}
+        self.writer = None
+
+        if self.format == 'csv':
+            pd.DataFrame(columns=self.fields()).to_csv(path, index=False)
+            return
+
+        pa = import_pyarrow()
+        self.schema = self.arrow_schema(pa)
+        if self.format == 'parquet':
+            self.writer = pa.parquet.ParquetWriter(path, self.schema)
+        else:
+            # Dictionaries only grow between chunks, so they can be written as deltas
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self.writer = pa.ipc.new_file(path, self.schema, options=options)
+
+    def __repr__(self):
+        return f'<EventWriter {self.format} {self.path}, {self.rowCount} rows>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fields(self):
+        """ Columns written, in order """
+        return CreateEventTable.eventFields
+
+    def arrow_schema(self, pa):
+        return event_schema(pa)
+
+    def typed(self, events):
+        """ The columns of a chunk as they are written to Parquet and Arrow """
+        return typed_events(events, self.categories)
+
+    def write(self, events):
+        if self.format == 'csv':
+            events[self.fields()].to_csv(self.path, mode='a', header=False, index=False)
+        else:
+            pa = import_pyarrow()
+            table = pa.Table.from_pandas(self.typed(events), schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+        self.rowCount += len(events)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def write_events(events, path, format=None):
+    """ Writes a whole event table to path.  See EventWriter. """
+    with EventWriter(path, format) as writer:
+        writer.write(events)
+
+
+def read_events(path, format=None, typed=False):
+    """ Reads an event table in any of the formats as text, the same as
+        pd.read_csv(path, dtype=str, keep_default_na=False) reads a csv.
+        With typed, Parquet and Arrow columns are kept as they are stored
+        (see event_schema) instead of being formatted as text.  csv is read
+        as text either way. """
+    format = format or event_format(path)
+    if format == 'csv':
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+    pa = import_pyarrow()
+    if format == 'parquet':
+        table = pa.parquet.read_table(path)
+    else:
+        with pa.ipc.open_file(path) as reader:
+            table = reader.read_all()
+
+    return arrow_frame(table, typed)
+
+
+def arrow_frame(table, typed=False):
+    """ DataFrame of an Arrow table, with its columns formatted as text unless
+        typed is set """
+    events = table.to_pandas()
+    return events if typed else CreateEventTable.to_text(events)
+
+
+def arrow_batches(path, format, chunkSize):
+    """ Yields the record batches of a Parquet or Arrow event table, reading
+        one at a time """
+    pa = import_pyarrow()
+    if format == 'parquet':
+        yield from pa.parquet.ParquetFile(path).iter_batches(batch_size=chunkSize)
+        return
+    with pa.ipc.open_file(path) as reader:
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def read_event_chunks(path, chunkSize, typed=False):
+    """ Yields the events at path in chunks of chunkSize rows, as text or, for
+        Parquet and Arrow with typed, as stored (see read_events).  Every
+        format is read a chunk at a time. """
+    format = event_format(path)
+    if format == 'csv':
+        yield from CreateEventTable.read_chunks(path, chunkSize)
+        return
+
+    pa = import_pyarrow()
+    batches = arrow_batches(path, format, chunkSize)
+    pending = []
+    rowCount = 0
+    start = 0
+    while True:
+        # Gather batches until there is a whole chunk, or the table ends
+        with metrics.stage('parse'):
+            while rowCount < chunkSize:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append(batch)
+                rowCount += batch.num_rows
+            if rowCount == 0:
+                return
+            table = pa.Table.from_batches(pending)
+            pending = table.slice(chunkSize).to_batches()
+            rowCount = max(rowCount - chunkSize, 0)
+            chunk = arrow_frame(table.slice(0, chunkSize), typed)
+        # Number the rows through the table, like the csv chunks
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
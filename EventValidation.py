@@ -0,0 +1,245 @@
+#-------------------------------------------------------------------------------
+# Name:        EventValidation.py
+# Purpose:     This script checks an event table from XY_to_Events_Step1.py
+#              against the coordinates it was made from.  The begin and end
+#              points of each event are found again from its measures and
+#              compared with the input coordinates, and the routes near the
+#              input points are searched again to find matches that could
+#              have gone either way, such as the two carriageways of a
+#              divided highway.
+#
+#              The output is the event table with these columns added, so
+#              that problem rows can be found with a filter:
+#                  begin_offset, end_offset, max_offset - distance (in meters)
+#                      from each input point to the point at its measure
+#                  route_distance - how far the farther input point is from
+#                      the event's route
+#                  nudged - Step 1 moved the measures of this point event
+#                      0.1 apart (the offsets are measured without the nudge)
+#                  m_direction - 1 if the event runs with the route's
+#                      measures, -1 if against them, 0 for point events
+#                  alt_rte_nm, alt_distance, alt_m_direction - the next best
+#                      route near both points
+#                  route_found - the route and measures were found in the LRS
+#                  offset_exceeded - max_offset is over --max-offset
+#                  ambiguous - the next best route is within
+#                      --ambiguity-margin of the event's route
+#                  direction_mismatch - the event runs against its route's
+#                      measures but with the next best route's
+#                  qa_pass - none of the problems above
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import argparse
+import numpy as np
+import pandas as pd
+import CreateEventTable
+import EventGeometry
+import EventTableIO
+from Instrumentation import metrics
+from Projection import project_coordinates
+
+# How far apart Step 1 moves the measures of point events
+nudge = 0.1
+
+# Columns added to the event table, and their types in Parquet and Arrow
+qaFields = ['begin_offset', 'end_offset', 'max_offset', 'route_distance', 'nudged', 'm_direction',
+            'alt_rte_nm', 'alt_distance', 'alt_m_direction',
+            'route_found', 'offset_exceeded', 'ambiguous', 'direction_mismatch', 'qa_pass']
+qaFloatFields = ['begin_offset', 'end_offset', 'max_offset', 'route_distance', 'alt_distance']
+qaIntFields = ['m_direction', 'alt_m_direction']
+qaBoolFields = ['nudged', 'route_found', 'offset_exceeded', 'ambiguous', 'direction_mismatch', 'qa_pass']
+
+
+def direction(begin, end):
+    """ 1 where end is past begin, -1 where it is before, and 0 where they are
+        the same or missing """
+    return np.nan_to_num(np.sign(end - begin)).astype(np.int8)
+
+
+def candidate_routes(beginLng, beginLat, endLng, endLat, d, net):
+    """ Every route near both points of each project, ranked like Step 1
+        ranks them (see CreateEventTable.shared_routes), with the point column
+        holding the project's position in the input arrays """
+    lng = np.concatenate([beginLng, endLng])
+    lat = np.concatenate([beginLat, endLat])
+    uniqueLngLat, inverse = np.unique(np.column_stack([lng, lat]), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    candidates = CreateEventTable.locate_coordinates(uniqueLngLat[:, 0], uniqueLngLat[:, 1], d, net)
+    candidates = candidates.rename(columns={'point': 'unique'})
+
+    projects = np.arange(len(beginLng))
+    beginPairs = pd.DataFrame({'point': projects, 'unique': inverse[:len(projects)]}).merge(candidates, on='unique')
+    endPairs = pd.DataFrame({'point': projects, 'unique': inverse[len(projects):]}).merge(candidates, on='unique')
+    return CreateEventTable.shared_routes(beginPairs.drop(columns='unique'), endPairs.drop(columns='unique'))
+
+
+def validate_events(events, maxOffset=CreateEventTable.searchRadius, ambiguityMargin=5, net=None):
+    """ Adds the QA columns described at the top of this file to an event
+        table.
+
+        events - DataFrame of a Step 1 event table, as text or typed
+        maxOffset - largest distance between an input point and the point at
+                    its measure that passes, in the units of the LRS crs
+        ambiguityMargin - a match is ambiguous if the next best route is at
+                          most this much farther from the points
+        net - LRSNetwork to check against (the loaded LRS by default)
+
+        returns the events with the QA columns added
+    """
+    if net is None:
+        net = CreateEventTable.get_network()
+    index = EventGeometry.get_index(net)
+    n = len(events)
+
+    def column(field):
+        return CreateEventTable.to_float(events[field].astype(object)).to_numpy()
+    beginLat, beginLng, endLat, endLng = column('begin_lat'), column('begin_lng'), column('end_lat'), column('end_lng')
+    beginMsr, endMsr = column('begin_msr'), column('end_msr')
+    names = events['rte_nm'].astype(object).where(events['rte_nm'].notna(), '').astype(str).to_numpy(dtype=object)
+    valid = np.flatnonzero(np.isfinite(beginLat) & np.isfinite(beginLng) & np.isfinite(endLat) & np.isfinite(endLng))
+
+    # Routes near both input points.  The event's own route gives the distances
+    # and the located measures, and the best route with another name is the
+    # alternative.
+    with metrics.stage('qa_route_search'):
+        shared = candidate_routes(beginLng[valid], beginLat[valid], endLng[valid], endLat[valid],
+                                  CreateEventTable.searchRadius, net)
+    shared['point'] = valid[shared['point'].to_numpy()]
+    sameName = net.names[shared['route'].to_numpy()] == names[shared['point'].to_numpy()]
+    own = shared[sameName].drop_duplicates('point')
+    alt = shared[~sameName].drop_duplicates('point')
+
+    routes = EventGeometry.route_indexes(net, index, names, beginMsr, endMsr, nudge)
+    routes[own['point'].to_numpy()] = own['route'].to_numpy()
+    routeDistance = np.full(n, np.nan)
+    routeDistance[own['point'].to_numpy()] = own['far'].to_numpy()
+
+    # Point events that Step 1 nudged apart are checked at their located measure
+    nudged = np.zeros(n, dtype=bool)
+    locatedBegin = own['measure_begin'].to_numpy()
+    locatedEnd = own['measure_end'].to_numpy()
+    ownPoints = own['point'].to_numpy()
+    nudged[ownPoints] = ((locatedBegin == locatedEnd) & (locatedBegin != 0) &
+                         np.isclose(beginMsr[ownPoints], locatedBegin - nudge, rtol=0, atol=1e-6) &
+                         np.isclose(endMsr[ownPoints], locatedEnd + nudge, rtol=0, atol=1e-6))
+    beginCheck = np.where(nudged, beginMsr + nudge, beginMsr)
+    endCheck = np.where(nudged, endMsr - nudge, endMsr)
+
+    # Points at the measures, compared with the input points
+    with metrics.stage('qa_offsets'):
+        placed = np.flatnonzero((routes >= 0) & np.isfinite(beginCheck) & np.isfinite(endCheck))
+        offsets = {}
+        for name, measures, lng, lat in [('begin', beginCheck, beginLng, beginLat), ('end', endCheck, endLng, endLat)]:
+            i, ratio, status = index.segment_at(routes[placed], measures[placed], nudge)
+            ratio = index.nearest_part(i, ratio, status, measures[placed])
+            xy = index.points(i, ratio)
+            x, y = project_coordinates(lng[placed], lat[placed], CreateEventTable.wgs84, net.crs)
+            offset = np.full(n, np.nan)
+            offset[placed] = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+            offset[placed[status == EventGeometry.positionUnmeasured]] = np.nan
+            offsets[name] = offset
+
+    routeFound = np.isfinite(offsets['begin']) & np.isfinite(offsets['end'])
+    farthest = np.fmax(offsets['begin'], offsets['end'])
+    altNames = np.full(n, '', dtype=object)
+    altNames[alt['point'].to_numpy()] = net.names[alt['route'].to_numpy()]
+    altDistance = np.full(n, np.nan)
+    altDistance[alt['point'].to_numpy()] = alt['far'].to_numpy()
+    altDirection = np.zeros(n, dtype=np.int8)
+    altDirection[alt['point'].to_numpy()] = direction(alt['measure_begin'].to_numpy(), alt['measure_end'].to_numpy())
+    mDirection = direction(beginCheck, endCheck)
+
+    output = events.copy()
+    output['begin_offset'] = offsets['begin']
+    output['end_offset'] = offsets['end']
+    output['max_offset'] = farthest
+    output['route_distance'] = routeDistance
+    output['nudged'] = nudged
+    output['m_direction'] = mDirection
+    output['alt_rte_nm'] = altNames
+    output['alt_distance'] = altDistance
+    output['alt_m_direction'] = altDirection
+    output['route_found'] = routeFound
+    output['offset_exceeded'] = routeFound & ~(farthest <= maxOffset)
+    output['ambiguous'] = routeFound & (altDistance - np.where(np.isnan(routeDistance), farthest, routeDistance) <= ambiguityMargin)
+    output['direction_mismatch'] = routeFound & (mDirection == -1) & (altDirection == 1)
+    output['qa_pass'] = routeFound & ~(output['offset_exceeded'] | output['ambiguous'] | output['direction_mismatch'])
+
+    for field in ['nudged', 'offset_exceeded', 'ambiguous', 'direction_mismatch']:
+        metrics.count(f'qa.{field}', output[field].sum())
+    metrics.count('qa.not_found', (~routeFound).sum())
+    metrics.observe_many('qa_max_offset', farthest[routeFound])
+
+    return output
+
+
+class ValidationWriter(EventTableIO.EventWriter):
+    """ EventWriter for an event table with the QA columns.  Flags are written
+        to Parquet and Arrow as booleans, directions as int8, and alt_rte_nm
+        is dictionary encoded like rte_nm. """
+    def __init__(self, path, format=None):
+        self.altCategories = []
+        super().__init__(path, format)
+
+    def fields(self):
+        return CreateEventTable.eventFields + qaFields
+
+    def arrow_schema(self, pa):
+        schema = EventTableIO.event_schema(pa)
+        for field in qaFields:
+            if field in qaFloatFields:
+                schema = schema.append(pa.field(field, pa.float64()))
+            elif field in qaIntFields:
+                schema = schema.append(pa.field(field, pa.int8()))
+            elif field in qaBoolFields:
+                schema = schema.append(pa.field(field, pa.bool_()))
+            else:
+                schema = schema.append(pa.field(field, pa.dictionary(pa.int32(), pa.string())))
+        return schema
+
+    def typed(self, events):
+        typed = EventTableIO.typed_events(events, self.categories)
+        for field in qaFields:
+            if field == 'alt_rte_nm':
+                typed[field] = EventTableIO.grow_categories(events[field], self.altCategories)
+            else:
+                typed[field] = events[field].to_numpy()
+        return typed
+
+
+def create_validation_table(eventPath, outPath, chunkSize=100000, maxOffset=CreateEventTable.searchRadius, ambiguityMargin=5):
+    """ Validates the event table at eventPath chunkSize rows at a time and
+        writes it with the QA columns to outPath (csv, Parquet or Arrow).
+        returns the number of rows that did not pass """
+    net = CreateEventTable.get_network()
+    failed = 0
+    with ValidationWriter(outPath) as writer:
+        for chunk in EventTableIO.read_event_chunks(eventPath, chunkSize, typed=True):
+            checked = validate_events(chunk, maxOffset, ambiguityMargin, net)
+            failed += int((~checked['qa_pass']).sum())
+            with metrics.stage('write'):
+                writer.write(checked)
+
+    print(f'{writer.rowCount} events checked, {failed} flagged.  QA table saved at "{outPath}"')
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a Step 1 event table against its input coordinates')
+    parser.add_argument('events',
+                        help='event table from XY_to_Events_Step1.py (csv, Parquet or Arrow)')
+    parser.add_argument('output',
+                        help='event table with the QA columns to write (csv, Parquet or Arrow)')
+    parser.add_argument('--max-offset', type=float, default=CreateEventTable.searchRadius,
+                        help=f'largest distance in meters between an input point and its measure that passes (default: {CreateEventTable.searchRadius})')
+    parser.add_argument('--ambiguity-margin', type=float, default=5,
+                        help='flag events whose next best route is at most this many meters farther away (default: 5)')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='events checked at a time (default: 100000)')
+    parser.add_argument('--lrs', default=CreateEventTable.lrsPath,
+                        help=f'LRS shapefile (default: {CreateEventTable.lrsPath})')
+    args = parser.parse_args()
+
+    CreateEventTable.load_lrs(args.lrs)
+    create_validation_table(args.events, args.output, args.chunk_size, args.max_offset, args.ambiguity_margin)
@@ -0,0 +1,121 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import CreateEventTable
+import EventTableIO
+import LRSCache
+from Instrumentation import metrics
+
+# Bump when a change to the locating code should recompute every row
+manifestVersion = 1
+
+# Input columns that decide a project's event
+hashFields = ['organization', 'id', 'begin_lat', 'begin_lng', 'end_lat', 'end_lng']
+
+
+def manifest_path(outPath):
+    """ The manifest for data/AllProjects_Events.csv is data/AllProjects_Events.manifest.json """
+    return os.path.splitext(outPath)[0] + '.manifest.json'
+
+
+def row_hashes(df):
+    """ A 64 bit hash of the hashFields of each row of the converted csv """
+    return pd.util.hash_pandas_object(df[hashFields], index=False).to_numpy()
+
+
+def run_key():
+    """ Describes the LRS and settings that events were located with """
+    net = CreateEventTable.get_network()
+    return {
+        'version': manifestVersion,
+        'lrs': LRSCache.cache_key(net.path, net.crs),
+        'searchRadius': CreateEventTable.searchRadius
+    }
+
+
+def table_fingerprint(path):
+    """ Size and modification time of an event table.  The manifest keeps the
+        fingerprint of the table it was written with, so a table and manifest
+        from different runs are never used together. """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_previous(outPath, key):
+    """ Reads the previous event table and the row hashes it was made from.
+        returns (events, hashes), or None when there is no usable previous
+        run, such as when the LRS has changed since or the table is not the
+        one the manifest was written with """
+    try:
+        with open(manifest_path(outPath)) as file:
+            manifest = json.load(file)
+        if manifest.get('key') != key or manifest.get('table') != table_fingerprint(outPath):
+            return None
+        events = EventTableIO.read_events(outPath)
+    except (OSError, ValueError):
+        return None
+
+    if len(manifest.get('hashes', [])) != len(events):
+        return None
+
+    hashes = np.array([int(h, 16) for h in manifest['hashes']], dtype=np.uint64)
+    return events, hashes
+
+
+def write_atomic(df, path, key, hashes):
+    """ Writes df in the format of path, and its manifest, to temporary files
+        first so that a crash never leaves a half written table.  The table
+        is moved into place before the manifest, and the manifest holds the
+        table's fingerprint, so a crash in between leaves an old manifest that
+        load_previous rejects. """
+    tempPath = path + '.tmp'
+    EventTableIO.write_events(df, tempPath, EventTableIO.event_format(path))
+    manifestTemp = manifest_path(path) + '.tmp'
+    with open(manifestTemp, 'w') as file:
+        json.dump({'key': key, 'table': table_fingerprint(tempPath),
+                   'hashes': [format(h, '016x') for h in hashes.tolist()]}, file)
+
+    # os.replace keeps the size and modification time of the table
+    os.replace(tempPath, path)
+    os.replace(manifestTemp, manifest_path(path))
+
+
+def create_event_table_incremental(csvPath, outPath, workers=1, cache=None):
+    """ Like create_event_table_batch, but only locates rows that are new or
+        changed since the last run.  Each input row is hashed on hashFields
+        and the hashes are kept in a manifest next to outPath.  Unchanged rows
+        are copied from the previous event table.  Every row is located again
+        when the LRS (or the search radius) has changed.
+    """
+    with metrics.stage('parse'):
+        df = pd.read_csv(csvPath, dtype=str, keep_default_na=False)
+    hashes = row_hashes(df)
+    key = run_key()
+
+    previous = load_previous(outPath, key)
+    if previous is None:
+        reuse = np.zeros(len(df), dtype=bool)
+    else:
+        previousEvents, previousHashes = previous
+        reuse = np.isin(hashes, previousHashes)
+
+    changed = df[~reuse]
+    if workers > 1:
+        located = CreateEventTable.locate_events_parallel(changed, workers)
+    else:
+        located = CreateEventTable.locate_events(changed, cache)
+
+    # Events are stored as text, the same as they read back from the csv
+    output = pd.DataFrame('', index=np.arange(len(df)), columns=CreateEventTable.eventFields)
+    output.loc[~reuse] = CreateEventTable.to_text(located).to_numpy()
+    if reuse.any():
+        previousRow = pd.Series(np.arange(len(previousHashes)), index=previousHashes)
+        previousRow = previousRow[~previousRow.index.duplicated(keep='last')]
+        output.loc[reuse] = previousEvents.iloc[previousRow[hashes[reuse]].to_numpy()][CreateEventTable.eventFields].to_numpy()
+
+    metrics.count('incremental.reused', reuse.sum())
+    with metrics.stage('write'):
+        write_atomic(output, outPath, key, hashes)
+
+    print(f'Event table saved at "{outPath}" ({len(changed)} of {len(df)} rows located, {reuse.sum()} reused)')
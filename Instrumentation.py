@@ -0,0 +1,222 @@
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import math
+import pstats
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """ Count, total, min, and max of the values observed for one name, and
+        how many fell in each power of two bucket.  Bucket e holds values from
+        2 ** (e - 1) up to 2 ** e, and bucket None holds zeros, so timings from
+        microseconds to minutes fit in a few dozen buckets. """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = collections.Counter()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[math.frexp(value)[1] if value > 0 else None] += 1
+
+    def add_many(self, values):
+        """ Adds each value of an array at once """
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        exponents = np.frexp(values)[1]
+        self.buckets[None] += int((values <= 0).sum())
+        exponents, counts = np.unique(exponents[values > 0], return_counts=True)
+        for exponent, n in zip(exponents.tolist(), counts.tolist()):
+            self.buckets[exponent] += n
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets.update(other.buckets)
+
+    def percentile(self, q):
+        """ Upper edge of the bucket that holds the q-th percentile """
+        target = q / 100 * self.count
+        seen = 0
+        for exponent in sorted(self.buckets, key=lambda e: -math.inf if e is None else e):
+            seen += self.buckets[exponent]
+            if seen >= target:
+                return 0.0 if exponent is None else min(2.0 ** exponent, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': {('0' if e is None else f'<{2.0 ** e:g}'): n
+                        for e, n in sorted(self.buckets.items(), key=lambda item: -math.inf if item[0] is None else item[0])}
+        }
+
+
+class Metrics:
+    """ Wall-time histograms for each stage of a run, histograms of other
+        per-item values (such as the routes found near each point), and
+        counters (such as cache hits and errors by category).
+
+        Stages are timed with
+            with metrics.stage('route_search'):
+                ...
+    """
+    def __init__(self):
+        self.stages = collections.defaultdict(Histogram)
+        self.values = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+
+    def __repr__(self):
+        return f'<Metrics {len(self.stages)} stages, {len(self.values)} histograms, {len(self.counters)} counters>'
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name].add(time.perf_counter() - start)
+
+    def observe(self, name, value):
+        self.values[name].add(value)
+
+    def observe_many(self, name, values):
+        self.values[name].add_many(values)
+
+    def count(self, name, n=1):
+        if n:
+            self.counters[name] += int(n)
+
+    def reset(self):
+        self.stages.clear()
+        self.values.clear()
+        self.counters.clear()
+
+    def snapshot(self):
+        """ A copy of everything recorded so far that can be sent between processes
+            and added to another Metrics with merge """
+        snapshot = Metrics()
+        snapshot.merge(self)
+        return snapshot
+
+    def merge(self, other):
+        for name, histogram in other.stages.items():
+            self.stages[name].merge(histogram)
+        for name, histogram in other.values.items():
+            self.values[name].merge(histogram)
+        self.counters.update(other.counters)
+
+    def summary(self):
+        return {
+            'stages': {name: histogram.summary() for name, histogram in sorted(self.stages.items())},
+            'values': {name: histogram.summary() for name, histogram in sorted(self.values.items())},
+            'counters': dict(sorted(self.counters.items()))
+        }
+
+
+class LogSink:
+    """ Writes a metrics summary to a logger, one line per stage, histogram and counter """
+    def __init__(self, log=logger, level=logging.INFO):
+        self.log = log
+        self.level = level
+
+    def write(self, summary):
+        for name, stage in summary['stages'].items():
+            self.log.log(self.level, f"{name}: {stage['count']} calls, {stage['total']:.3f} s total, "
+                                     f"p50 {stage['p50']:.6f} s, p99 {stage['p99']:.6f} s, max {stage['max']:.6f} s")
+        for name, values in summary['values'].items():
+            if values['count']:
+                self.log.log(self.level, f"{name}: {values['count']} values, mean {values['mean']:.2f}, "
+                                         f"p99 {values['p99']:g}, max {values['max']:g}")
+        for name, count in summary['counters'].items():
+            self.log.log(self.level, f'{name}: {count}')
+
+
+class JSONSink:
+    """ Writes a metrics summary to a JSON file """
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, summary):
+        with open(self.path, 'w') as file:
+            json.dump(summary, file, indent=2)
+
+
+# Metrics for this process.  Workers record into their own copy, which the
+# parent merges from the snapshots they return.
+metrics = Metrics()
+
+
+def report(sinks):
+    """ Writes the summary of metrics to each sink """
+    summary = metrics.summary()
+    for sink in sinks:
+        sink.write(summary)
+
+    return summary
+
+
+@contextlib.contextmanager
+def profiled(path=None, profiler='cProfile'):
+    """ Profiles the code run inside the block.  With cProfile, the stats are
+        saved to path (for snakeviz or pstats) or the top functions are
+        logged.  With 'pyinstrument' (which is optional and must be
+        installed), the report is saved to path as html or logged as text. """
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError('The pyinstrument profiler is not installed (pip install pyinstrument)')
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            if path:
+                with open(path, 'w') as file:
+                    file.write(profile.output_html())
+            else:
+                logger.info(profile.output_text())
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        if path:
+            profile.dump_stats(path)
+        else:
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(25)
+            logger.info(output.getvalue())
@@ -0,0 +1,181 @@
+import datetime
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyproj
+from RouteMeasures import RouteMeasures
+
+# Bump when the layout of the cache changes so old caches are rebuilt
+cacheVersion = 3
+
+# Arrays saved for each cache.  names holds the RTE_NM of each route as text,
+# and namesMissing is True where the route has no RTE_NM.
+arrayNames = ['names', 'namesMissing', 'xy', 'm', 'chainage', 'offsets', 'partOffsets', 'routeParts']
+
+
+def cache_path(path):
+    """ The cache for data/LRS_Salem.shp is the folder data/LRS_Salem.lrscache """
+    return os.path.splitext(path)[0] + '.lrscache'
+
+
+def source_files(path):
+    """ Files whose changes invalidate the cache.  A shapefile's attributes
+        live in the .dbf next to it. """
+    files = [path]
+    if path.lower().endswith('.shp'):
+        dbf = os.path.splitext(path)[0] + '.dbf'
+        if os.path.exists(dbf):
+            files.append(dbf)
+
+    return files
+
+
+def cache_key(path, crs):
+    """ Describes the source data and projection that a cache was built from """
+    files = {}
+    for f in source_files(path):
+        stat = os.stat(f)
+        files[os.path.basename(f)] = [stat.st_mtime_ns, stat.st_size]
+
+    return {
+        'version': cacheVersion,
+        'files': files,
+        'crs': pyproj.CRS(crs).to_string()
+    }
+
+
+def text_array(values):
+    """ The text of each value and a mask of the missing ones, so that object
+        arrays can be saved without pickling them """
+    values = pd.Series(np.asarray(values, dtype=object), dtype=object)
+    missing = values.isna().to_numpy()
+    return values.where(~missing, '').astype(str).to_numpy(dtype=str), missing
+
+
+def object_array(text, missing):
+    """ Undoes text_array, with None for the missing values """
+    values = np.asarray(text).astype(object)
+    values[np.asarray(missing)] = None
+    return values
+
+
+def frame_arrays(name, frame):
+    """ Splits a DataFrame into arrays that np.load can read without pickle.
+        Numeric, boolean and date columns are saved as they are, and other
+        columns as text_array.  returns (arrays, columns), where columns
+        describes each column for read_frame. """
+    arrays = {}
+    columns = []
+    for k, column in enumerate(frame.columns):
+        values = frame[column]
+        if values.dtype == object and values.map(lambda v: isinstance(v, datetime.date)).where(values.notna(), True).all():
+            if values.notna().any():
+                values = pd.to_datetime(values)
+        if values.dtype.kind in 'biufM':
+            arrays[f'{name}.{k}'] = values.to_numpy()
+            columns.append([str(column), 'values'])
+        else:
+            arrays[f'{name}.{k}'], arrays[f'{name}.{k}.missing'] = text_array(values)
+            columns.append([str(column), 'text'])
+
+    return arrays, columns
+
+
+def read_frame(folder, name):
+    """ Reads a DataFrame saved by write_arrays.  returns None if any of its
+        files are missing or damaged. """
+    try:
+        with open(os.path.join(folder, f'{name}.json')) as file:
+            columns = json.load(file)
+        frame = {}
+        for k, (column, kind) in enumerate(columns):
+            values = np.load(os.path.join(folder, f'{name}.{k}.npy'))
+            if kind == 'text':
+                values = object_array(values, np.load(os.path.join(folder, f'{name}.{k}.missing.npy')))
+            frame[column] = values
+    except (OSError, ValueError):
+        return None
+
+    return pd.DataFrame(frame, columns=[column for column, kind in columns])
+
+
+def read_arrays(folder, key, names):
+    """ Memory-maps the arrays that write_arrays saved in folder, so only the
+        parts that are used are read from disk.  returns a dictionary of
+        arrays, or None if the folder is missing, was written for another key,
+        or has missing or damaged arrays """
+    try:
+        with open(os.path.join(folder, 'key.json')) as file:
+            storedKey = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if storedKey != key:
+        return None
+
+    try:
+        return {name: np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r') for name in names}
+    except (OSError, ValueError):
+        return None
+
+
+def write_arrays(folder, key, arrays, frames=None):
+    """ Saves each array in arrays (and each DataFrame in frames, see
+        frame_arrays) to folder, along with key.  Nothing is pickled.  The
+        files are written to a temporary folder first so that a crash never
+        leaves a partial cache. """
+    tempDir = folder + '.tmp'
+    shutil.rmtree(tempDir, ignore_errors=True)
+    os.makedirs(tempDir)
+
+    arrays = dict(arrays)
+    for name, frame in (frames or {}).items():
+        frameArrays, columns = frame_arrays(name, frame)
+        arrays.update(frameArrays)
+        with open(os.path.join(tempDir, f'{name}.json'), 'w') as file:
+            json.dump(columns, file)
+    for name, array in arrays.items():
+        np.save(os.path.join(tempDir, f'{name}.npy'), array, allow_pickle=False)
+
+    # The key is written last, so a cache without one is never loaded
+    with open(os.path.join(tempDir, 'key.json'), 'w') as file:
+        json.dump(key, file)
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tempDir, folder)
+
+
+def load_cache(path, crs):
+    """ Loads the prepared LRS for path from its cache.  The vertex arrays are
+        memory-mapped, so only the parts that are used are read from disk.
+        returns (names, RouteMeasures, attributes), or None if there is no cache, the
+        source has changed since it was written, or its files are damaged """
+    cacheDir = cache_path(path)
+    arrays = read_arrays(cacheDir, cache_key(path, crs), arrayNames)
+    if arrays is None:
+        return None
+    attributes = read_frame(cacheDir, 'attributes')
+    if attributes is None:
+        return None
+
+    names = object_array(arrays.pop('names'), arrays.pop('namesMissing'))
+
+    return names, RouteMeasures(**arrays), attributes
+
+
+def save_cache(path, crs, names, measures, attributes):
+    """ Writes the prepared LRS next to path """
+    nameText, namesMissing = text_array(names)
+    arrays = {
+        'names': nameText,
+        'namesMissing': namesMissing,
+        'xy': measures.xy,
+        'm': measures.m,
+        'chainage': measures.chainage,
+        'offsets': measures.offsets,
+        'partOffsets': measures.partOffsets,
+        'routeParts': measures.routeParts
+    }
+    write_arrays(cache_path(path), cache_key(path, crs), arrays, {'attributes': attributes})
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pandas as pd
+import pyproj
+import shapefile
+from Projection import project_coordinates
+
+
+class LoadedLRS:
+    """ The routes of an LRS read in a single pass, before building the
+        network.  Every vertex of every route is stored in order in xy and m.
+
+        names - RTE_NM of each route, one per record (duplicates are kept)
+        xy - (n, 2) array of vertex coordinates in crs
+        m - m-value of each vertex (NaN where the source has none)
+        partOffsets - part j owns the vertices partOffsets[j]:partOffsets[j + 1]
+        routeParts - route i owns the parts routeParts[i]:routeParts[i + 1]
+        attributes - DataFrame of every attribute column, one row per route
+        crs - crs of xy
+    """
+    def __init__(self, names, xy, m, partOffsets, routeParts, attributes, crs):
+        self.names = names
+        self.xy = xy
+        self.m = m
+        self.partOffsets = partOffsets
+        self.routeParts = routeParts
+        self.attributes = attributes
+        self.crs = crs
+
+    def __repr__(self):
+        return f'<LoadedLRS {len(self.names)} routes, {len(self.m)} vertices>'
+
+    def to_crs(self, crs):
+        """ Projects every vertex to crs in a single transform call """
+        x, y = project_coordinates(self.xy[:, 0], self.xy[:, 1], self.crs, crs)
+        xy = np.column_stack([x, y])
+        return LoadedLRS(self.names, xy, self.m, self.partOffsets, self.routeParts, self.attributes, crs)
+
+
+class RouteBuilder:
+    """ Collects routes part by part into flat arrays """
+    def __init__(self):
+        self.xy = []
+        self.m = []
+        self.partOffsets = [0]
+        self.routeParts = [0]
+        self.records = []
+
+    def add_part(self, xy, m):
+        self.xy.extend(xy)
+        self.m.extend(m)
+        self.partOffsets.append(len(self.m))
+
+    def end_route(self, record):
+        self.routeParts.append(len(self.partOffsets) - 1)
+        self.records.append(record)
+
+    def build(self, nameField, crs):
+        attributes = pd.DataFrame(self.records)
+        if nameField not in attributes:
+            raise KeyError(f'LRS has no {nameField} field')
+
+        m = np.array([np.nan if value is None else value for value in self.m], dtype=float)
+        return LoadedLRS(
+            attributes[nameField].to_numpy(dtype=object),
+            np.array(self.xy, dtype=float).reshape(-1, 2),
+            m,
+            np.array(self.partOffsets, dtype=np.int64),
+            np.array(self.routeParts, dtype=np.int64),
+            attributes,
+            crs
+        )
+
+
+def read_shapefile(path, nameField='RTE_NM'):
+    """ Reads the geometry, m-values, and attributes of a shapefile in one
+        pass over the .shp and .dbf.  The crs is read from the .prj file. """
+    prjPath = os.path.splitext(path)[0] + '.prj'
+    if not os.path.exists(prjPath):
+        raise FileNotFoundError(f'{prjPath} is needed to know the crs of the LRS')
+    with open(prjPath) as file:
+        crs = pyproj.CRS.from_wkt(file.read())
+
+    builder = RouteBuilder()
+    with shapefile.Reader(path) as shp:
+        for row in shp.iterShapeRecords():
+            shape = row.shape
+            points = shape.points if shape.shapeType != shapefile.NULL else []
+            # pyshp returns None for m-values that are "no data"
+            mValues = getattr(shape, 'm', None) or [None] * len(points)
+            parts = list(shape.parts) + [len(points)] if points else []
+            for start, end in zip(parts[:-1], parts[1:]):
+                builder.add_part([p[:2] for p in points[start:end]], mValues[start:end])
+            builder.end_route(row.record.as_dict())
+
+    return builder.build(nameField, crs)
+
+
+def read_ogr(path, layer=None, nameField='RTE_NM'):
+    """ Reads an LRS with m-values from any format GDAL can open, such as a
+        GeoPackage or a FileGDB export.  This needs the GDAL python bindings
+        (osgeo), which are optional for shapefiles. """
+    try:
+        from osgeo import ogr
+    except ImportError:
+        raise ImportError(f'Reading {path} requires the GDAL python bindings (osgeo.ogr)')
+
+    dataSource = ogr.Open(path)
+    if dataSource is None:
+        raise OSError(f'Could not open {path}')
+    source = dataSource.GetLayer() if layer is None else dataSource.GetLayer(layer)
+    crs = pyproj.CRS.from_wkt(source.GetSpatialRef().ExportToWkt())
+    fields = [field.GetName() for field in source.schema]
+
+    builder = RouteBuilder()
+    for feature in source:
+        geom = feature.GetGeometryRef()
+        if geom is not None:
+            lines = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())] if geom.GetGeometryCount() else [geom]
+            for line in lines:
+                count = line.GetPointCount()
+                builder.add_part([(line.GetX(i), line.GetY(i)) for i in range(count)],
+                                 [line.GetM(i) if line.IsMeasured() else None for i in range(count)])
+        builder.end_route({field: feature.GetField(field) for field in fields})
+
+    return builder.build(nameField, crs)
+
+
+def read_lrs(path, layer=None, nameField='RTE_NM'):
+    """ Reads the LRS at path in a single pass, using pyshp for shapefiles and
+        GDAL for everything else """
+    if path.lower().endswith('.shp'):
+        return read_shapefile(path, nameField)
+    return read_ogr(path, layer, nameField)
@@ -0,0 +1,91 @@
+import logging
+import geopandas as gp
+import numpy as np
+import shapely
+from shapely import STRtree
+from RouteMeasures import RouteMeasures
+import LRSCache
+import LRSLoader
+
+logger = logging.getLogger(__name__)
+
+
+class LRSNetwork:
+    """ A prepared LRS: route names, projected route geometries, the spatial
+        index over them, and the per-route measure arrays.
+
+        names - array of RTE_NM values, one per route
+        measures - RouteMeasures for the routes in the same order
+        crs - the projected crs of the geometries
+        geoms - optional array of the route geometries.  Rebuilt from
+                measures if not given.
+        attributes - optional DataFrame of the LRS attribute columns
+    """
+    def __init__(self, names, measures, crs, path=None, geoms=None, attributes=None):
+        self.names = np.asarray(names, dtype=object)
+        self.measures = measures
+        self.crs = crs
+        self.path = path
+        self.attributes = attributes
+        self.geoms = measures.to_geometries() if geoms is None else geoms
+
+        # Spatial index over the route geometries.  Built once here so that finding the
+        # routes near a point is an index query instead of a scan of the whole LRS.
+        self.tree = STRtree(self.geoms)
+
+        # Positions of each RTE_NM.  A name can appear on more than one record,
+        # and every record is kept as its own route.
+        self.routeIndex = {}
+        for i, rte_nm in enumerate(self.names):
+            self.routeIndex.setdefault(rte_nm, []).append(i)
+
+    def __repr__(self):
+        return f'<LRSNetwork {len(self.names)} routes from {self.path}>'
+
+    @classmethod
+    def from_source(cls, path, crs, layer=None):
+        """ Reads the LRS at path in a single pass and projects it to crs """
+        loaded = LRSLoader.read_lrs(path, layer).to_crs(crs)
+        measures = RouteMeasures.from_arrays(loaded.xy, loaded.m, loaded.partOffsets, loaded.routeParts)
+
+        return cls(loaded.names, measures, crs, path, attributes=loaded.attributes)
+
+    @classmethod
+    def load(cls, path, crs, useCache=True):
+        """ Loads the LRS at path projected to crs.  With useCache, the prepared
+            arrays are read from the on-disk cache when the source has not
+            changed, and the cache is (re)built otherwise. """
+        if useCache:
+            cached = LRSCache.load_cache(path, crs)
+            if cached is not None:
+                names, measures, attributes = cached
+                return cls(names, measures, crs, path, attributes=attributes)
+
+        network = cls.from_source(path, crs)
+        if useCache:
+            try:
+                LRSCache.save_cache(path, crs, network.names, network.measures, network.attributes)
+            except OSError as e:
+                logger.warning(f'Could not write LRS cache for {path}: {e}')
+
+        return network
+
+    def find_route(self, rte_nm, point):
+        """ Position of the route named rte_nm.  If more than one record has
+            that name, the one closest to point is used. """
+        routes = self.routeIndex[rte_nm]
+        if len(routes) == 1:
+            return routes[0]
+        distances = shapely.distance(self.geoms[routes], point)
+        return routes[int(np.argmin(distances))]
+
+    @property
+    def frame(self):
+        """ The routes as a GeoDataFrame with RTE_NM and geometry columns """
+        return gp.GeoDataFrame({'RTE_NM': self.names}, geometry=self.geoms, crs=self.crs)
+
+    @property
+    def mValueDict(self):
+        """ The m-values of each route keyed by RTE_NM.  For duplicate names
+            only the first record is included. """
+        return {rte_nm: list(self.measures.route_m(routes[0])) for rte_nm, routes in self.routeIndex.items()}
@@ -0,0 +1,47 @@
+import collections
+
+
+class LRUCache:
+    """ A bounded mapping that forgets the least recently used entries once
+        it holds maxSize of them, and counts hits and misses """
+    def __init__(self, maxSize=100000):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'<LRUCache {len(self.entries)}/{self.maxSize} entries, {self.hits} hits, {self.misses} misses>'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """ Returns the value stored for key and counts a hit, or counts a
+            miss and returns default """
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """ Hit and miss counts as a dictionary """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.entries),
+            'maxSize': self.maxSize
+        }
@@ -0,0 +1,287 @@
+#-------------------------------------------------------------------------------
+# Name:        LocateServer.py
+# Purpose:     This script keeps the LRS loaded and answers locate requests,
+#              so that other applications can look up measures as they need
+#              them instead of waiting for the nightly event table.  It
+#              listens on a local HTTP port, or reads JSON lines from stdin
+#              with --stdio.
+#
+#              HTTP endpoints (request and response bodies are JSON):
+#                  POST /locate        {"lng": -77.43, "lat": 37.54}
+#                      -> [{"rte_nm", "measure", "distance"}, ...]
+#                  POST /locate/batch  {"points": [[lng, lat], ...]}
+#                      -> one list of routes per point
+#                  POST /event         {"organization", "id", "begin_lat",
+#                                       "begin_lng", "end_lat", "end_lng"}
+#                      -> the event table row for the project
+#                  POST /event/batch   {"rows": [{...}, ...]}
+#                      -> one event table row per project
+#                  GET  /health        -> {"status": "ok", "routes": ...}
+#
+#              With --stdio, each line of stdin is a request like
+#              {"id": 1, "method": "locate", "params": {"lng": ..., "lat": ...}}
+#              where method is locate, locate_batch, event or event_batch, and
+#              each reply is written to stdout as {"id": 1, "result": ...} or
+#              {"id": 1, "error": "..."}.  Replies can come back in a
+#              different order than the requests.
+#
+#              Single lookups are answered straight away.  Batch requests
+#              are run by a pool of --workers processes, which read the LRS
+#              from its memory-mapped cache, so large batches do not hold up
+#              other requests.
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import CreateEventTable
+from Locator import Locator
+
+logger = logging.getLogger(__name__)
+
+# Locator for this process.  Pool workers build their own (see init_worker).
+locator = None
+
+# Largest request body accepted over HTTP, in bytes
+maxBodySize = 64 * 1024 * 1024
+
+routes = {
+    '/locate': 'locate',
+    '/locate/batch': 'locate_batch',
+    '/event': 'event',
+    '/event/batch': 'event_batch'
+}
+
+statusText = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+              413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    """ A request that could not be answered because of its content """
+    pass
+
+
+def init_worker(path, crs):
+    """ Pool initializer.  Forked workers already have the parent's locator,
+        so only spawned workers load the LRS. """
+    global locator
+    if locator is None:
+        locator = Locator.load(path, crs)
+
+
+def call(method, params):
+    """ Runs one request on the locator of this process and returns its result """
+    if not isinstance(params, dict):
+        raise RequestError('params must be a JSON object')
+    try:
+        if method == 'locate':
+            return locator.locate(float(params['lng']), float(params['lat']))
+        if method == 'locate_batch':
+            points = params['points']
+            located = locator.locate_many([float(lng) for lng, lat in points], [float(lat) for lng, lat in points])
+            return [locator.describe(routes) for routes in located]
+        if method == 'event':
+            return locator.event(params)
+        if method == 'event_batch':
+            return locator.events(params['rows'])
+    except KeyError as e:
+        raise RequestError(f'Missing parameter {e}')
+    except (TypeError, ValueError) as e:
+        raise RequestError(f'Invalid parameters: {e}')
+
+    raise RequestError(f'Unknown method "{method}"')
+
+
+async def dispatch(method, params, pool):
+    """ Answers a request, running batches on the worker pool """
+    if method.endswith('_batch') and pool is not None:
+        return await asyncio.get_running_loop().run_in_executor(pool, call, method, params)
+    return call(method, params)
+
+
+def health(pool):
+    """ Status of the server.  The point cache stats are those of the server
+        process, which answers single lookups.  Batch workers keep caches of
+        their own, which are not included. """
+    scope = 'server process; batch workers keep their own' if pool is not None else 'server process'
+    return {'status': 'ok', 'routes': len(locator.network.names), 'lrs': locator.network.path,
+            'crs': locator.network.crs, 'cache': locator.points.stats(), 'cacheScope': scope}
+
+
+async def reply(method, params, pool):
+    """ (status, result) for a request """
+    try:
+        return 200, await dispatch(method, params, pool)
+    except RequestError as e:
+        return 400, {'error': str(e)}
+    except Exception as e:
+        logger.exception(f'{method} failed')
+        return 500, {'error': str(e)}
+
+
+async def handle_http(reader, writer, pool):
+    """ Serves the requests of one HTTP connection, keeping it open between
+        requests unless the client asks to close it """
+    try:
+        while True:
+            requestLine = await reader.readline()
+            if not requestLine:
+                break
+            try:
+                verb, target, version = requestLine.decode('latin-1').split()
+            except ValueError:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            # The end of the body is unknown without a valid length, so the
+            # connection is closed after the error
+            length = headers.get('content-length', '0')
+            if not (length.isascii() and length.isdigit()):
+                status, result = 400, {'error': f'Invalid Content-Length "{length}"'}
+                keepAlive = False
+            elif int(length) > maxBodySize:
+                status, result = 413, {'error': f'Requests are limited to {maxBodySize} bytes'}
+                keepAlive = False
+            else:
+                body = await reader.readexactly(int(length))
+                keepAlive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+                path = target.split('?')[0].rstrip('/')
+                if path == '/health':
+                    status, result = (200, health(pool)) if verb == 'GET' else (405, {'error': 'Use GET'})
+                elif path not in routes:
+                    status, result = 404, {'error': f'No endpoint at {path}'}
+                elif verb != 'POST':
+                    status, result = 405, {'error': 'Use POST'}
+                else:
+                    try:
+                        params = json.loads(body)
+                    except ValueError as e:
+                        status, result = 400, {'error': f'Request body is not JSON: {e}'}
+                    else:
+                        status, result = await reply(routes[path], params, pool)
+
+            payload = json.dumps(result).encode()
+            writer.write(f'HTTP/1.1 {status} {statusText[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\n'
+                         f'Connection: {"keep-alive" if keepAlive else "close"}\r\n\r\n'.encode() + payload)
+            await writer.drain()
+            if not keepAlive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def handle_line(line, pool, output):
+    """ Answers one JSON-lines request and writes the reply to output """
+    requestId = None
+    try:
+        request = json.loads(line)
+        requestId = request.get('id')
+        status, result = await reply(request['method'], request.get('params', {}), pool)
+        response = {'id': requestId, 'result': result} if status == 200 else {'id': requestId, 'error': result['error']}
+    except (ValueError, KeyError, AttributeError) as e:
+        response = {'id': requestId, 'error': f'Invalid request: {e}'}
+
+    output.write(json.dumps(response) + '\n')
+    output.flush()
+
+
+def read_lines(input, loop, lines):
+    """ Reads input one line at a time and puts each line on the asyncio
+        Queue lines, ending with an empty line when input is closed.  Runs in
+        a thread, since the event loop on Windows cannot read pipes. """
+    while True:
+        line = input.readline()
+        loop.call_soon_threadsafe(lines.put_nowait, line)
+        if not line:
+            return
+
+
+async def serve_stdio(pool, input=None, output=sys.stdout):
+    """ Answers JSON-lines requests from input (stdin by default) until it
+        is closed """
+    lines = asyncio.Queue()
+    # A daemon thread, so a read that is still waiting does not hold up exit
+    threading.Thread(target=read_lines, args=(input or sys.stdin.buffer, asyncio.get_running_loop(), lines),
+                     daemon=True).start()
+
+    pending = set()
+    while True:
+        line = await lines.get()
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.ensure_future(handle_line(line, pool, output))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.wait(pending)
+
+
+async def serve_http(host, port, pool):
+    server = await asyncio.start_server(lambda reader, writer: handle_http(reader, writer, pool), host, port, limit=maxBodySize)
+    logger.info(f'Listening on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
+
+
+def worker_executor(workers):
+    """ Process pool for batch requests, or None to answer them in the event loop """
+    if workers < 1:
+        return None
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return concurrent.futures.ProcessPoolExecutor(workers, context, initializer=init_worker,
+                                                  initargs=(locator.network.path, locator.network.crs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer locate requests over HTTP or stdin with the LRS kept loaded')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port to listen on (default: 8765)')
+    parser.add_argument('--stdio', action='store_true',
+                        help='read JSON-lines requests from stdin and reply on stdout instead of serving HTTP')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes that run batch requests, or 0 to run them in the server process (default: one per CPU)')
+    parser.add_argument('--lrs', default=CreateEventTable.lrsPath,
+                        help=f'LRS shapefile (default: {CreateEventTable.lrsPath})')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='logging level (default: INFO)')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(levelname)s %(name)s: %(message)s')
+
+    # Load the LRS before starting the pool so forked workers share it
+    locator = Locator.load(args.lrs, CreateEventTable.targetCRS)
+    logger.info(f'Loaded {len(locator.network.names)} routes from {args.lrs}')
+
+    pool = worker_executor(args.workers)
+    try:
+        if args.stdio:
+            asyncio.run(serve_stdio(pool))
+        else:
+            asyncio.run(serve_http(args.host, args.port, pool))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import shapely
+import CreateEventTable
+from LRSNetwork import LRSNetwork
+from LRUCache import LRUCache
+from Projection import get_transformer
+
+
+class Locator:
+    """ Locates wgs84 coordinates and projects on an LRS that stays loaded,
+        for services that answer many small requests instead of running the
+        whole event table at once.  Nothing here reads the CreateEventTable
+        globals, so several Locators for different LRSs can live side by side.
+
+        network - LRSNetwork to locate on
+        searchRadius - maximum distance between a point and its route, in the
+                       units of network.crs
+        cacheSize - number of located coordinates remembered.  Coordinates are
+                    cached exactly as given, so a cached answer is always the
+                    same as a new one.
+    """
+    def __init__(self, network, searchRadius=CreateEventTable.searchRadius, cacheSize=100000):
+        self.network = network
+        self.searchRadius = searchRadius
+        self.points = LRUCache(cacheSize)
+        self.transformer = get_transformer(CreateEventTable.wgs84, network.crs)
+
+    def __repr__(self):
+        return f'<Locator {len(self.network.names)} routes from {self.network.path}, {self.points!r}>'
+
+    @classmethod
+    def load(cls, path=CreateEventTable.lrsPath, crs=CreateEventTable.targetCRS, useCache=True, **kwargs):
+        """ Loads the LRS at path (from its cache when it is up to date) and
+            returns a Locator for it """
+        return cls(LRSNetwork.load(path, crs, useCache), **kwargs)
+
+    def locate_many(self, lng, lat):
+        """ Finds the routes within searchRadius of each lng/lat.  returns one
+            list per point of (route, distance, measure) tuples, closest route
+            first, with ties in LRS order.  Distances and measures are the
+            same as CreateEventTable.locate_coordinates finds. """
+        keys = list(zip(np.asarray(lng, dtype=float).tolist(), np.asarray(lat, dtype=float).tolist()))
+        output = [self.points.get(key) for key in keys]
+        missing = [i for i, routes in enumerate(output) if routes is None]
+        if not missing:
+            return output
+
+        net = self.network
+        d = self.searchRadius
+        x, y = self.transformer.transform(np.array([keys[i][0] for i in missing]), np.array([keys[i][1] for i in missing]))
+        points = shapely.points(x, y)
+        pointIdx, routeIdx = net.tree.query(shapely.box(x - d, y - d, x + d, y + d))
+        distances = shapely.distance(points[pointIdx], net.geoms[routeIdx])
+        keep = distances <= d
+        pointIdx, routeIdx, distances = pointIdx[keep], routeIdx[keep], distances[keep]
+        along = shapely.line_locate_point(net.geoms[routeIdx], points[pointIdx])
+        measures = np.round(net.measures.measures_at(routeIdx, along), 3)
+
+        order = np.lexsort((routeIdx, distances, pointIdx))
+        located = [[] for i in missing]
+        for k in order.tolist():
+            located[pointIdx[k]].append((int(routeIdx[k]), float(distances[k]), float(measures[k])))
+        for i, routes in zip(missing, located):
+            output[i] = routes
+            self.points.put(keys[i], routes)
+
+        return output
+
+    def locate(self, lng, lat):
+        """ The routes near one coordinate, as dictionaries of rte_nm, measure
+            and distance, closest first """
+        return self.describe(self.locate_many([lng], [lat])[0])
+
+    def describe(self, routes):
+        """ (route, distance, measure) tuples as dictionaries ready for json.
+            Routes without m-values have a measure of None. """
+        return [{'rte_nm': self.network.names[route], 'measure': None if np.isnan(measure) else measure, 'distance': distance}
+                for route, distance, measure in routes]
+
+    def events(self, rows):
+        """ Locates projects given as dictionaries with the event table input
+            columns (organization, id, begin_lat, begin_lng, end_lat, end_lng).
+            Values may be strings, as read from a csv, or numbers, and missing
+            end coordinates make a point event.  returns one event table row
+            per project, as CreateEventTable.locate_events would write it with
+            this Locator's searchRadius. """
+        columns = ['organization', 'id', 'begin_lat', 'begin_lng', 'end_lat', 'end_lng']
+        df = pd.DataFrame([{column: '' if row.get(column) is None else str(row[column]) for column in columns} for row in rows],
+                          columns=columns)
+        output = CreateEventTable.locate_events(df, net=self.network, d=self.searchRadius)
+        output = output.astype(object).where(output.notna(), None)
+
+        return output[CreateEventTable.eventFields].to_dict('records')
+
+    def event(self, row):
+        return self.events([row])[0]
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from LRUCache import LRUCache
+from Instrumentation import metrics
+
+
+class PointCache:
+    """ Remembers the routes found near each input coordinate, so that points
+        that repeat (point events, shared intersections, projects submitted
+        again) are only projected, matched, and located once.
+
+        Points are keyed by their lng/lat rounded to precision decimal places
+        (7 places is about a centimeter), and located at the rounded
+        coordinate so that a result never depends on what is already cached.
+        Each entry is an (n, 3) array of (route, distance, measure) rows for
+        the n routes within the search radius of the point.
+
+        maxSize - number of points kept in memory
+        path - optional sqlite file that keeps located points between runs
+        lrsKey - anything json can write that identifies the LRS and search
+                 settings.  A persistent cache made with another key is cleared.
+    """
+    def __init__(self, maxSize=1000000, precision=7, path=None, lrsKey=None):
+        self.memory = LRUCache(maxSize)
+        self.precision = precision
+        self.diskHits = 0
+        self.path = path
+        self.db = None
+        if path is not None:
+            self.open_db(path, json.dumps({'lrs': lrsKey, 'precision': precision}, sort_keys=True))
+
+    def __repr__(self):
+        return f'<PointCache {self.memory!r} on disk: {self.path}>'
+
+    def open_db(self, path, key):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS points (lng REAL, lat REAL, routes TEXT, PRIMARY KEY (lng, lat))')
+        stored = self.db.execute('SELECT key FROM meta').fetchone()
+        if stored is None or stored[0] != key:
+            # Located with a different LRS, so none of the stored points are valid
+            self.db.execute('DELETE FROM points')
+            self.db.execute('DELETE FROM meta')
+            self.db.execute('INSERT INTO meta VALUES (?)', (key,))
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stats(self):
+        """ Hit and miss counts of the in-memory cache.  Points found in the
+            sqlite file count as misses here and as diskHits. """
+        stats = self.memory.stats()
+        stats['diskHits'] = self.diskHits
+        return stats
+
+    def read_db(self, keys):
+        """ Looks keys up in the sqlite file with a single join.  returns a
+            dictionary of the positions in keys that were found and their
+            entries """
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (position INTEGER, lng REAL, lat REAL)')
+        self.db.execute('DELETE FROM lookup')
+        self.db.executemany('INSERT INTO lookup VALUES (?, ?, ?)', [(k, lng, lat) for k, (lng, lat) in enumerate(keys)])
+        rows = self.db.execute('SELECT lookup.position, points.routes FROM lookup '
+                               'JOIN points ON points.lng = lookup.lng AND points.lat = lookup.lat').fetchall()
+        found = {position: np.array(json.loads(routes), dtype=float).reshape(-1, 3) for position, routes in rows}
+        self.diskHits += len(found)
+
+        return found
+
+    def write_db(self, keys, entries):
+        self.db.executemany('INSERT OR REPLACE INTO points VALUES (?, ?, ?)',
+                            [(lng, lat, json.dumps(routes.tolist())) for (lng, lat), routes in zip(keys, entries)])
+        self.db.commit()
+
+    def locate(self, lng, lat, locateFunction):
+        """ Finds the routes near each lng/lat, using cached results where
+            possible and calling locateFunction for the rest.
+
+            locateFunction - called with arrays of lng and lat.  Returns a
+                             DataFrame of (point, route, distance, measure)
+                             rows, where point indexes the input arrays.
+
+            returns (inverse, candidates): candidates is a DataFrame like the
+            one locateFunction returns, for the distinct rounded points, and
+            inverse gives the candidates point for each input coordinate
+        """
+        # Each lng/lat as one complex number, which np.unique sorts much faster
+        # than the rows of a two column array
+        rounded = np.round(np.asarray(lng, dtype=float), self.precision) + 1j * np.round(np.asarray(lat, dtype=float), self.precision)
+        uniqueRounded, inverse = np.unique(rounded, return_inverse=True)
+        inverse = inverse.ravel()
+        uniqueLngLat = np.column_stack([uniqueRounded.real, uniqueRounded.imag])
+        keys = list(zip(uniqueLngLat[:, 0].tolist(), uniqueLngLat[:, 1].tolist()))
+        self.memory.hits += len(rounded) - len(keys) # Repeats within this call
+
+        entries = [self.memory.get(key) for key in keys]
+        missing = np.array([routes is None for routes in entries], dtype=bool)
+        metrics.count('point_cache.hits', len(rounded) - missing.sum())
+        if missing.any() and self.db is not None:
+            missingIdx = np.flatnonzero(missing)
+            found = self.read_db([keys[i] for i in missingIdx])
+            for position, routes in found.items():
+                entries[missingIdx[position]] = routes
+                self.memory.put(keys[missingIdx[position]], routes)
+            missing[missingIdx[list(found)]] = False
+            metrics.count('point_cache.disk_hits', len(found))
+        metrics.count('point_cache.misses', missing.sum())
+
+        if missing.any():
+            missingIdx = np.flatnonzero(missing)
+            located = locateFunction(uniqueLngLat[missingIdx, 0], uniqueLngLat[missingIdx, 1])
+            order = np.argsort(located['point'].to_numpy(), kind='stable')
+            point = located['point'].to_numpy()[order]
+            values = located[['route', 'distance', 'measure']].to_numpy(dtype=float)[order]
+            new = np.split(values, np.cumsum(np.bincount(point, minlength=len(missingIdx)))[:-1])
+            for i, routes in zip(missingIdx.tolist(), new):
+                entries[i] = routes
+                self.memory.put(keys[i], routes)
+            if self.db is not None:
+                self.write_db([keys[i] for i in missingIdx], new)
+
+        counts = np.array([len(routes) for routes in entries], dtype=np.int64)
+        values = np.concatenate(entries) if entries else np.empty((0, 3))
+        candidates = pd.DataFrame({
+            'point': np.repeat(np.arange(len(keys), dtype=np.int64), counts),
+            'route': values[:, 0].astype(np.int64),
+            'distance': values[:, 1],
+            'measure': values[:, 2]
+        })
+
+        return inverse, candidates
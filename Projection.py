@@ -0,0 +1,28 @@
+import functools
+import numpy as np
+import pyproj
+from shapely.ops import transform
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(sourceCRS, targetCRS):
+    """ Returns a Transformer from sourceCRS to targetCRS with x/y (lng/lat)
+        axis order.  Building a Transformer needs PROJ database lookups, so
+        one is created per CRS pair and reused for every later call.
+
+        sourceCRS, targetCRS - anything pyproj.CRS accepts, such as 'EPSG:4326'
+    """
+    return pyproj.Transformer.from_crs(sourceCRS, targetCRS, always_xy=True)
+
+
+def project_coordinates(x, y, sourceCRS, targetCRS):
+    """ Projects whole arrays of x (lng) and y (lat) coordinates in one call.
+        returns a tuple of numpy arrays (x, y) """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return get_transformer(sourceCRS, targetCRS).transform(x, y)
+
+
+def project_point(point, sourceCRS, targetCRS):
+    """ Projects a single shapely geometry using the cached transformer """
+    return transform(get_transformer(sourceCRS, targetCRS).transform, point)
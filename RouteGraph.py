@@ -0,0 +1,522 @@
+import itertools
+import logging
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+import CreateEventTable
+import Checkpoint
+import EventTableIO
+import LRSCache
+from LRUCache import LRUCache
+from Instrumentation import metrics
+from Projection import project_coordinates
+
+logger = logging.getLogger(__name__)
+
+# Step 1 comment on events that could not be placed on a single route
+noMatchComment = 'ERROR No matching routes found.'
+
+# Bump when the layout of the graph cache changes so old caches are rebuilt
+graphVersion = 1
+
+# Arrays saved for each graph cache
+graphArrays = ['vertexNode', 'data', 'indices', 'indptr', 'edgeSegment']
+
+
+def graph_cache_path(path):
+    """ The graph of data/LRS_Salem.shp is cached in the folder data/LRS_Salem.graphcache """
+    return os.path.splitext(path)[0] + '.graphcache'
+
+
+def graph_cache_key(network, precision):
+    """ Describes the LRS and settings that a graph cache was built from """
+    return dict(LRSCache.cache_key(network.path, network.crs), graphVersion=graphVersion, precision=precision)
+
+
+def sorted_unique(values):
+    """ The distinct values of an integer array in order.  Sorting and
+        comparing neighbours is much faster than np.unique for the large
+        arrays of segment and node ids that searches collect. """
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+
+class SnappedPoints:
+    """ Points snapped onto the segments of the LRS.
+
+        route - route index of each point (-1 where nothing was in range)
+        segment - index of the first vertex of the segment the point is on
+        ratio - how far along the segment the point is (0 to 1)
+        measure - m-value at the point
+        xy - location of the snapped point
+    """
+    def __init__(self, route, segment, ratio, measure, xy):
+        self.route = route
+        self.segment = segment
+        self.ratio = ratio
+        self.measure = measure
+        self.xy = xy
+
+    def __len__(self):
+        return len(self.route)
+
+
+class SearchTree:
+    """ The result of a shortest path search from one node.  Only the nodes
+        that the search reached are kept.
+
+        source - node the search started from
+        limit - distance at which the search stopped.  Distances are exact
+                up to limit, and nodes further away were not reached.
+        nodes - sorted ids of the reached nodes
+        distances - distance from source to each reached node
+        predecessors - node before each reached node on its path (negative at the source)
+
+        The search is given over a subset of the graph: graphNodes are the
+        sorted ids of its nodes, and distances and predecessors are the
+        search results over them, as scipy's dijkstra returns them.
+    """
+    def __init__(self, source, limit, graphNodes, distances, predecessors):
+        self.source = source
+        self.limit = limit
+        reached = np.flatnonzero(np.isfinite(distances))
+        self.nodes = graphNodes[reached]
+        self.distances = distances[reached]
+        predecessors = predecessors[reached]
+        self.predecessors = np.where(predecessors >= 0, graphNodes[np.maximum(predecessors, 0)], -1)
+
+    def __repr__(self):
+        return f'<SearchTree from node {self.source}, {len(self.nodes)} nodes within {self.limit}>'
+
+    def position(self, node):
+        i = np.searchsorted(self.nodes, node)
+        if i < len(self.nodes) and self.nodes[i] == node:
+            return i
+        return None
+
+    def distance(self, node):
+        """ Distance from source to node, or inf if the search did not reach it """
+        i = self.position(node)
+        return np.inf if i is None else self.distances[i]
+
+    def path(self, node):
+        """ Nodes on the shortest path from source to node """
+        nodes = [node]
+        while True:
+            previous = self.predecessors[self.position(nodes[-1])]
+            if previous < 0:
+                break
+            nodes.append(previous)
+        nodes.reverse()
+
+        return nodes
+
+
+class RouteGraph:
+    """ A routable graph of the LRS.  Every vertex is a node, and vertices of
+        different routes that share a location (to the millimeter by default)
+        are the same node, so paths can turn from one route onto another at
+        any shared vertex.  Each edge is one segment of a route, weighted by
+        its length.  Where routes overlap, the edge uses the first route in
+        LRS order, matching how Step 1 breaks ties.
+
+        Use from_network to build a graph, or load to read it from the cache
+        next to the LRS.
+
+        network - the LRSNetwork the graph was built from
+        vertexNode - node of each vertex of network.measures
+        matrix - CSR adjacency matrix of edge lengths
+        edgeSegment - segment followed by each entry of matrix
+        treeCacheSize - number of recent search trees kept for reuse
+    """
+    # The first search from a begin point goes this many times the straight
+    # line distance to the end point, plus searchMargin.  Paths longer than
+    # that are searched for again out to maxDistance.
+    detourFactor = 2
+    searchMargin = 1000
+
+    def __init__(self, network, vertexNode, matrix, edgeSegment, precision=3, treeCacheSize=256):
+        self.network = network
+        self.precision = precision
+        self.vertexNode = np.asarray(vertexNode)
+        self.matrix = matrix
+        self.edgeSegment = np.asarray(edgeSegment)
+        self.nodeCount = matrix.shape[0]
+
+        measures = network.measures
+        xy = np.asarray(measures.xy)
+        self.vertexRoute = np.repeat(np.arange(len(measures.offsets) - 1), np.diff(measures.offsets))
+
+        # A vertex at each node, to find where the node is
+        self.nodeVertex = np.zeros(self.nodeCount, dtype=np.int64)
+        self.nodeVertex[self.vertexNode] = np.arange(len(self.vertexNode))
+
+        # A segment joins each vertex to the next one in the same part
+        partEnd = np.zeros(len(xy), dtype=bool)
+        partEnd[np.asarray(measures.partOffsets)[1:] - 1] = True
+        self.partEnd = partEnd
+
+        # Spatial index over the segments, used to snap points.  Zero-length
+        # segments are left out so every snapped point has a direction.
+        segments = np.flatnonzero(~partEnd[:-1])
+        segments = segments[self.segment_length(segments) > 0]
+        self.segments = segments
+        self.segmentTree = STRtree(shapely.linestrings(np.stack([xy[segments], xy[segments + 1]], axis=1)))
+
+        self.trees = LRUCache(treeCacheSize)
+
+    def __repr__(self):
+        return f'<RouteGraph {self.nodeCount} nodes, {len(self.edgeSegment)} edges>'
+
+    @classmethod
+    def from_network(cls, network, precision=3):
+        """ Builds the graph of network, joining vertices that are the same
+            when rounded to precision decimals """
+        measures = network.measures
+        xy = np.asarray(measures.xy)
+
+        # Nodes are the distinct vertex locations
+        nodeXY, vertexNode = np.unique(np.round(xy, precision), axis=0, return_inverse=True)
+        vertexNode = vertexNode.ravel()
+        nodeCount = len(nodeXY)
+
+        partEnd = np.zeros(len(xy), dtype=bool)
+        partEnd[np.asarray(measures.partOffsets)[1:] - 1] = True
+        segment = np.flatnonzero(~partEnd[:-1])
+        u = vertexNode[segment]
+        v = vertexNode[segment + 1]
+        weight = np.asarray(measures.chainage)[segment + 1] - np.asarray(measures.chainage)[segment]
+        keep = u != v
+        segment, u, v, weight = segment[keep], u[keep], v[keep], weight[keep]
+
+        # Edges run both ways.  Keep the shortest (then first) segment between
+        # each pair of nodes.
+        u, v = np.concatenate([u, v]), np.concatenate([v, u])
+        weight = np.concatenate([weight, weight])
+        segment = np.concatenate([segment, segment])
+        order = np.lexsort((segment, weight, v, u))
+        u, v, weight, segment = u[order], v[order], weight[order], segment[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        u, v, weight, segment = u[first], v[first], weight[first], segment[first]
+
+        indptr = np.searchsorted(u, np.arange(nodeCount + 1))
+        matrix = csr_matrix((weight, v, indptr), shape=(nodeCount, nodeCount))
+
+        return cls(network, vertexNode, matrix, segment, precision)
+
+    @classmethod
+    def load(cls, network, precision=3, useCache=True):
+        """ Returns the graph of network.  With useCache, the graph is read
+            from the folder next to the LRS when the LRS has not changed, and
+            is built and saved there otherwise. """
+        if not useCache or network.path is None:
+            return cls.from_network(network, precision)
+
+        folder = graph_cache_path(network.path)
+        key = graph_cache_key(network, precision)
+        arrays = LRSCache.read_arrays(folder, key, graphArrays)
+        if arrays is not None:
+            nodeCount = len(arrays['indptr']) - 1
+            matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=(nodeCount, nodeCount))
+            return cls(network, arrays['vertexNode'], matrix, arrays['edgeSegment'], precision)
+
+        graph = cls.from_network(network, precision)
+        arrays = {
+            'vertexNode': graph.vertexNode,
+            'data': graph.matrix.data,
+            'indices': graph.matrix.indices,
+            'indptr': graph.matrix.indptr,
+            'edgeSegment': graph.edgeSegment
+        }
+        try:
+            LRSCache.write_arrays(folder, key, arrays)
+        except OSError as e:
+            logger.warning(f'Could not write graph cache for {network.path}: {e}')
+
+        return graph
+
+    def snap(self, points, maxDistance=None):
+        """ Snaps each shapely Point (in the LRS crs) to the nearest segment
+            within maxDistance (the Step 1 search radius by default).  Where
+            segments are equally near, the first in LRS order is used. """
+        if maxDistance is None:
+            maxDistance = CreateEventTable.searchRadius
+        xy = np.asarray(self.network.measures.xy)
+        m = self.network.measures.m
+        points = np.asarray(points, dtype=object)
+        route = np.full(len(points), -1)
+        segment = np.zeros(len(points), dtype=np.int64)
+        ratio = np.zeros(len(points))
+        measure = np.full(len(points), np.nan)
+        snappedXY = np.full((len(points), 2), np.nan)
+
+        pointIdx, treeIdx = self.segmentTree.query_nearest(points, max_distance=maxDistance, all_matches=True)
+        order = np.lexsort((treeIdx, pointIdx))
+        pointIdx, treeIdx = pointIdx[order], treeIdx[order]
+        first = np.ones(len(pointIdx), dtype=bool)
+        first[1:] = pointIdx[1:] != pointIdx[:-1]
+        pointIdx, i = pointIdx[first], self.segments[treeIdx[first]]
+
+        # Project each point onto its segment
+        start = xy[i]
+        direction = xy[i + 1] - start
+        offset = shapely.get_coordinates(points[pointIdx]) - start
+        distRatio = np.clip(np.sum(offset * direction, axis=1) / np.sum(direction ** 2, axis=1), 0, 1)
+
+        route[pointIdx] = self.vertexRoute[i]
+        segment[pointIdx] = i
+        ratio[pointIdx] = distRatio
+        measure[pointIdx] = m[i] + (m[i + 1] - m[i]) * distRatio
+        snappedXY[pointIdx] = start + direction * distRatio[:, None]
+
+        return SnappedPoints(route, segment, ratio, measure, snappedXY)
+
+    def segment_length(self, segment):
+        chainage = self.network.measures.chainage
+        return chainage[segment + 1] - chainage[segment]
+
+    def edge_segment(self, u, v):
+        """ The segment that the edge from node u to node v follows """
+        start, end = self.matrix.indptr[u], self.matrix.indptr[u + 1]
+        return self.edgeSegment[start + np.searchsorted(self.matrix.indices[start:end], v)]
+
+    def local_graph(self, sources, limit):
+        """ The nodes that a search from sources could reach within limit, and
+            the graph between them.  A path no longer than limit stays within
+            limit of its source, so only the segments within limit of a source
+            are needed.  Sources are grouped by grid cells of that size, and
+            the segments are found with one box per cell (with an extra meter
+            for the rounding of node locations).  Searching this graph gives
+            the same trees as searching the whole LRS, without arrays the size
+            of the whole graph for every source.
+
+            returns (nodes, matrix), where nodes are the sorted ids of the
+            nodes and matrix is the CSR matrix of the edges between them, in
+            the same order
+        """
+        xy = np.asarray(self.network.measures.xy)[self.nodeVertex[sources]]
+        d = limit + 1
+        cells = np.unique(np.floor(xy / d), axis=0)
+        low, high = cells * d - d, (cells + 1) * d + d
+        treeIdx = self.segmentTree.query(shapely.box(low[:, 0], low[:, 1], high[:, 0], high[:, 1]))[1]
+        segments = self.segments[sorted_unique(treeIdx)]
+        nodes = sorted_unique(np.concatenate([sources, self.vertexNode[segments], self.vertexNode[segments + 1]]))
+
+        # Copying most of the graph costs more than it saves
+        if len(nodes) > self.nodeCount // 2:
+            return np.arange(self.nodeCount), self.matrix
+
+        # Rows of those nodes, keeping the edges that end at one of them
+        rows = self.matrix[nodes]
+        position = np.minimum(np.searchsorted(nodes, rows.indices), len(nodes) - 1)
+        inside = nodes[position] == rows.indices
+        rowOf = np.repeat(np.arange(len(nodes)), np.diff(rows.indptr))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rowOf[inside], minlength=len(nodes)))])
+        matrix = csr_matrix((rows.data[inside], position[inside], indptr), shape=(len(nodes), len(nodes)))
+
+        return nodes, matrix
+
+    def search_trees(self, sources, limit):
+        """ Returns a dictionary with a SearchTree reaching at least limit from
+            each node in sources.  Trees are reused from recent searches where
+            possible, and the rest are found with one multi-source solve on
+            the part of the graph they can reach (see local_graph). """
+        trees = {}
+        missing = []
+        for node in np.unique(sources):
+            tree = self.trees.get(node)
+            if tree is not None and tree.limit >= limit:
+                trees[node] = tree
+            else:
+                missing.append(node)
+
+        metrics.count('search_trees.reused', len(trees))
+        metrics.count('search_trees.solved', len(missing))
+        if missing:
+            missing = np.array(missing, dtype=np.int64)
+            nodes, matrix = self.local_graph(missing, limit)
+            metrics.observe_many('search_graph_nodes', [len(nodes)])
+            distances, predecessors = dijkstra(matrix, indices=np.searchsorted(nodes, missing), limit=limit,
+                                               return_predecessors=True)
+            for node, nodeDistances, nodePredecessors in zip(missing.tolist(), distances, predecessors):
+                trees[node] = SearchTree(node, limit, nodes, nodeDistances, nodePredecessors)
+                self.trees.put(node, trees[node])
+
+        return trees
+
+    def trace(self, begin, end, maxDistance=50000, batchSize=32, cellSize=2000):
+        """ Finds the shortest path along the LRS between each pair of snapped
+            begin and end points.
+
+            Projects are sorted by the cellSize grid cell their begin point is
+            in, so that each batch of batchSize projects starts from nearby
+            points and shares its search trees.  Each search only goes as far
+            as the batch needs, and projects whose path is longer than that
+            are searched for again out to maxDistance.
+
+            returns a list with, for each pair, a list of (route, begin_msr,
+            end_msr) for each route the path follows, or None if there is no
+            path within maxDistance
+        """
+        output = [None] * len(begin)
+        traceable = np.flatnonzero((begin.route >= 0) & (end.route >= 0))
+        cell = np.floor(begin.xy[traceable] / cellSize)
+        traceable = traceable[np.lexsort((cell[:, 1], cell[:, 0]))]
+        straight = np.hypot(*(end.xy - begin.xy).T)
+
+        for batchStart in range(0, len(traceable), batchSize):
+            batch = traceable[batchStart:batchStart + batchSize]
+            limit = min(maxDistance, self.detourFactor * straight[batch].max() + self.searchMargin)
+            while len(batch):
+                sources = np.concatenate([
+                    self.vertexNode[begin.segment[batch]],
+                    self.vertexNode[begin.segment[batch] + 1]
+                ])
+                trees = self.search_trees(sources, limit)
+                retry = []
+                for i in batch:
+                    output[i] = self.trace_one(begin, end, i, trees, limit, maxDistance)
+                    if output[i] is None and limit < maxDistance:
+                        retry.append(i)
+                batch = np.array(retry, dtype=np.int64)
+                limit = maxDistance
+
+        return output
+
+    def trace_one(self, begin, end, i, trees, limit, maxDistance):
+        """ Builds the route runs for pair i from the search trees of its
+            begin segment.  returns None if there is no path, or if searches
+            that stopped at limit cannot tell whether the path is shortest. """
+        m = self.network.measures.m
+        s0, t = begin.segment[i], begin.ratio[i]
+        s1, s = end.segment[i], end.ratio[i]
+        length0 = self.segment_length(s0)
+        length1 = self.segment_length(s1)
+
+        # Both points are on the same segment
+        if s0 == s1:
+            return [(begin.route[i], begin.measure[i], end.measure[i])]
+
+        # Leave the begin segment through either of its vertices and enter
+        # the end segment through either of its vertices
+        best = None
+        for startVertex, startCost in [(s0, t * length0), (s0 + 1, (1 - t) * length0)]:
+            tree = trees[self.vertexNode[startVertex]]
+            for endVertex, endCost in [(s1, s * length1), (s1 + 1, (1 - s) * length1)]:
+                cost = startCost + tree.distance(self.vertexNode[endVertex]) + endCost
+                if np.isfinite(cost) and (best is None or cost < best[0]):
+                    best = (cost, tree, startVertex, endVertex)
+
+        # A path costing more than limit could be beaten by one through a
+        # node that the bounded search did not reach
+        if best is None or (best[0] > limit and limit < maxDistance):
+            return None
+
+        cost, tree, startVertex, endVertex = best
+        nodes = tree.path(self.vertexNode[endVertex])
+
+        # (route, entry m-value, exit m-value) for each piece of the path
+        pieces = [(begin.route[i], begin.measure[i], m[startVertex])]
+        for u, v in zip(nodes[:-1], nodes[1:]):
+            segment = self.edge_segment(u, v)
+            forward = self.vertexNode[segment] == u
+            entry, exit = (segment, segment + 1) if forward else (segment + 1, segment)
+            pieces.append((self.vertexRoute[segment], m[entry], m[exit]))
+        pieces.append((end.route[i], m[endVertex], end.measure[i]))
+
+        # Join consecutive pieces on the same route
+        runs = []
+        for route, entry, exit in pieces:
+            if runs and runs[-1][0] == route:
+                runs[-1][2] = exit
+            else:
+                runs.append([route, entry, exit])
+
+        return [tuple(run) for run in runs if run[1] != run[2] or len(runs) == 1]
+
+
+# The graph of the loaded LRS.  Built on first use by get_graph.
+graph = None
+
+
+def get_graph():
+    """ Returns the RouteGraph of CreateEventTable's LRS, loading it from its
+        cache (or building it) the first time it is needed """
+    global graph
+    net = CreateEventTable.get_network()
+    if graph is None or graph.network is not net:
+        graph = RouteGraph.load(net)
+
+    return graph
+
+
+def trace_events(events, maxDistance=50000, batchSize=32):
+    """ Traces the events that Step 1 could not place on a single route.
+
+        events - DataFrame of a Step 1 event table, as text or typed
+
+        returns a DataFrame with the event table columns and one row for each
+        route that a traced event follows.  Events without a path, or without
+        readable coordinates, keep a single row with an error comment.
+    """
+    rows = events[events['comments'] == noMatchComment].reset_index(drop=True)
+    routeGraph = get_graph()
+    names = routeGraph.network.names
+    crs = CreateEventTable.targetCRS
+
+    # Step 1 leaves the coordinates of some rows blank, such as ones that were
+    # 'nan'.  Those rows are not traced.
+    def column(field):
+        return CreateEventTable.to_float(rows[field].astype(object)).to_numpy()
+    beginLng, beginLat, endLng, endLat = column('begin_lng'), column('begin_lat'), column('end_lng'), column('end_lat')
+    readable = np.isfinite(beginLng) & np.isfinite(beginLat) & np.isfinite(endLng) & np.isfinite(endLat)
+    metrics.count('errors.untraceable_coordinates', (~readable).sum())
+
+    with metrics.stage('projection'):
+        beginX, beginY = project_coordinates(beginLng[readable], beginLat[readable], CreateEventTable.wgs84, crs)
+        endX, endY = project_coordinates(endLng[readable], endLat[readable], CreateEventTable.wgs84, crs)
+    with metrics.stage('route_search'):
+        begin = routeGraph.snap(shapely.points(beginX, beginY))
+        end = routeGraph.snap(shapely.points(endX, endY))
+    with metrics.stage('path_search'):
+        paths = [None] * len(rows)
+        for k, path in zip(np.flatnonzero(readable), routeGraph.trace(begin, end, maxDistance, batchSize)):
+            paths[k] = path
+
+    outputRows = []
+    for row, path, traced in zip(rows.itertuples(index=False), paths, readable):
+        outputRow = row._asdict()
+        if not traced:
+            outputRows.append(dict(outputRow, rte_nm=None, begin_msr=None, end_msr=None,
+                                   comments='ERROR Missing or unreadable coordinates.'))
+            continue
+        if not path:
+            outputRows.append(dict(outputRow, rte_nm=None, begin_msr=None, end_msr=None,
+                                   comments='ERROR No network path found.'))
+            continue
+
+        for k, (route, begin_msr, end_msr) in enumerate(path):
+            outputRows.append(dict(outputRow, rte_nm=names[route], begin_msr=round(float(begin_msr), 3),
+                                   end_msr=round(float(end_msr), 3), comments=f'Traced route {k + 1} of {len(path)}'))
+
+    return pd.DataFrame(outputRows, columns=CreateEventTable.eventFields)
+
+
+def trace_events_checkpointed(eventPath, outPath, chunkSize=10000):
+    """ Runs trace_events on the event table at eventPath chunkSize events at
+        a time, committing the traced events of each chunk as it is done (see
+        Checkpoint.Checkpoint).  Running it again after it was stopped skips
+        the committed chunks and writes the same table an uninterrupted run
+        would.  returns the number of rows written """
+    run = Checkpoint.Checkpoint(outPath, Checkpoint.run_key('step2', eventPath, chunkSize))
+    for events in itertools.islice(EventTableIO.read_event_chunks(eventPath, chunkSize, typed=True), run.completed, None):
+        run.save(trace_events(events))
+
+    return run.finish()
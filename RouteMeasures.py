@@ -0,0 +1,160 @@
+import numpy as np
+import shapely
+
+
+def ranges(starts, ends):
+    """ The integers in each range starts[i]:ends[i], joined into one array """
+    lengths = ends - starts
+    output = np.ones(lengths.sum(), dtype=np.int64)
+    if not len(output):
+        return output
+    nonEmpty = lengths > 0
+    firsts = np.zeros(len(starts), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=firsts[1:])
+    output[firsts[nonEmpty]] = starts[nonEmpty]
+    output[firsts[nonEmpty][1:]] -= ends[nonEmpty][:-1] - 1
+    return np.cumsum(output)
+
+
+class RouteMeasures:
+    """ Vertex coordinates, distances, and m-values for every route in the
+        LRS, stored as flat numpy arrays so that a measure can be found with a
+        binary search instead of walking the route's segments.
+
+        Route i owns the vertices offsets[i]:offsets[i + 1] and the parts
+        routeParts[i]:routeParts[i + 1].  Part j owns the vertices
+        partOffsets[j]:partOffsets[j + 1].  chainage is a
+        running distance over all routes that never decreases: it grows by the
+        segment length within a part, stays the same across the gap between
+        parts of a multi-part route, and jumps by 1 between routes.
+    """
+    def __init__(self, xy, m, chainage, offsets, partOffsets, routeParts):
+        self.xy = xy
+        self.m = m
+        self.chainage = chainage
+        self.offsets = offsets
+        self.partOffsets = partOffsets
+        self.routeParts = routeParts
+
+    def __repr__(self):
+        return f'<RouteMeasures {len(self.offsets) - 1} routes, {len(self.m)} vertices>'
+
+    @classmethod
+    def from_arrays(cls, xy, m, partOffsets, routeParts):
+        """ Builds the measure arrays from flat vertex arrays, as read by
+            LRSLoader.  xy and m hold every vertex of every route in order,
+            and partOffsets and routeParts are as described above. """
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        m = np.asarray(m, dtype=float)
+        partOffsets = np.asarray(partOffsets, dtype=np.int64)
+        routeParts = np.asarray(routeParts, dtype=np.int64)
+        offsets = partOffsets[routeParts]
+
+        step = np.zeros(len(xy))
+        step[1:] = np.hypot(*np.diff(xy, axis=0).T)
+        step[partOffsets[:-1][np.diff(partOffsets) > 0]] = 0
+        routeStarts = offsets[:-1][np.diff(offsets) > 0]
+        step[routeStarts[1:]] = 1
+        chainage = np.cumsum(step)
+
+        return cls(xy, m, chainage, offsets, partOffsets, routeParts)
+
+    @classmethod
+    def from_routes(cls, geoms, mValues):
+        """ Builds the arrays from a sequence of shapely (Multi)LineStrings and
+            a matching sequence of m-value lists, one m-value per vertex """
+        geoms = np.asarray(geoms, dtype=object)
+        parts, partRoute = shapely.get_parts(geoms, return_index=True)
+        xy, vertexPart = shapely.get_coordinates(parts, return_index=True)
+
+        partOffsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(vertexPart, minlength=len(parts)), out=partOffsets[1:])
+        routeParts = np.zeros(len(geoms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(partRoute, minlength=len(geoms)), out=routeParts[1:])
+        offsets = partOffsets[routeParts]
+
+        m = np.full(len(xy), np.nan)
+        for i, routeM in enumerate(mValues):
+            if routeM is not None and len(routeM) == offsets[i + 1] - offsets[i]:
+                m[offsets[i]:offsets[i + 1]] = np.array(routeM, dtype=float)
+
+        return cls.from_arrays(xy, m, partOffsets, routeParts)
+
+    def to_geometries(self):
+        """ Rebuilds the route geometries from the vertex arrays.  Routes with
+            one part become LineStrings, the rest MultiLineStrings. """
+        partCount = np.diff(self.routeParts)
+        lineIndex = np.repeat(np.arange(len(self.partOffsets) - 1), np.diff(self.partOffsets))
+        lines = shapely.linestrings(self.xy, indices=lineIndex)
+
+        geoms = np.full(len(partCount), None, dtype=object)
+        single = np.flatnonzero(partCount == 1)
+        geoms[single] = lines[self.routeParts[single]]
+        multi = np.flatnonzero(partCount > 1)
+        for i in multi:
+            geoms[i] = shapely.MultiLineString(list(lines[self.routeParts[i]:self.routeParts[i + 1]]))
+
+        return geoms
+
+    def subset(self, routes):
+        """ The measures of only the given routes, which must be in increasing
+            order.  chainage values are copied as they are rather than
+            recomputed, so a measure found on the subset is exactly the same
+            as one found on the whole LRS. """
+        routes = np.asarray(routes, dtype=np.int64)
+        parts = ranges(self.routeParts[routes], self.routeParts[routes + 1])
+        vertices = ranges(self.partOffsets[parts], self.partOffsets[parts + 1])
+
+        partOffsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum(self.partOffsets[parts + 1] - self.partOffsets[parts], out=partOffsets[1:])
+        routeParts = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum(self.routeParts[routes + 1] - self.routeParts[routes], out=routeParts[1:])
+
+        return RouteMeasures(np.asarray(self.xy[vertices]), np.asarray(self.m[vertices]), np.asarray(self.chainage[vertices]),
+                             partOffsets[routeParts], partOffsets, routeParts)
+
+    def route_distance(self, routes):
+        """ chainage at the first vertex of each route """
+        return self.chainage[self.offsets[routes]]
+
+    def route_xy(self, route):
+        """ Vertex coordinates of a single route """
+        return self.xy[self.offsets[route]:self.offsets[route + 1]]
+
+    def route_m(self, route):
+        """ m-values of a single route """
+        return self.m[self.offsets[route]:self.offsets[route + 1]]
+
+    def segment_at(self, routes, distances):
+        """ Finds the segment that lies distances along routes.
+
+            routes - array of route indexes
+            distances - array of distances from the start of each route, as
+                        returned by shapely.line_locate_point
+
+            returns (i, ratio): the index of each segment's first vertex, and
+            how far along the segment (0 to 1) the distance falls
+        """
+        routes = np.asarray(routes)
+        target = self.route_distance(routes) + np.asarray(distances, dtype=float)
+
+        # Index of the segment's first vertex, kept inside the route
+        i = np.searchsorted(self.chainage, target, side='right') - 1
+        i = np.clip(i, self.offsets[routes], self.offsets[routes + 1] - 2)
+
+        segmentLength = self.chainage[i + 1] - self.chainage[i]
+        distRatio = np.divide(target - self.chainage[i], segmentLength,
+                              out=np.zeros(len(i)), where=segmentLength > 0)
+        distRatio = np.clip(distRatio, 0, 1)
+
+        return i, distRatio
+
+    def measures_at(self, routes, distances):
+        """ Interpolates the m-values at distances along routes.
+
+            routes - array of route indexes
+            distances - array of distances from the start of each route, as
+                        returned by shapely.line_locate_point
+        """
+        i, distRatio = self.segment_at(routes, distances)
+        return self.m[i] + (self.m[i + 1] - self.m[i]) * distRatio
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import pyproj
+import shapefile
+import LRSLoader
+
+# Synthetic data is placed around Salem, VA so it falls in the same UTM zone as the real LRS
+defaultOrigin = (-80.06, 37.28)
+
+metersPerMile = 1609.344
+
+# Input csv columns for the begin and end coordinates, the same as the
+# project spreadsheet that XY_to_Events_Step1.py reads
+rawColumns = {
+    'begin_lat': 'Project Start Location Latitude',
+    'begin_lng': 'Project Start Location Longitude',
+    'end_lat': 'Project End Location Latitude',
+    'end_lng': 'Project End Location Longitude'
+}
+
+
+def degrees_per_meter(lat):
+    """ (degrees of longitude, degrees of latitude) in one meter at lat """
+    return 1 / (111320 * np.cos(np.radians(lat))), 1 / 110574
+
+
+def make_lrs(path, routeCount=200, routeSpacing=400, vertexSpacing=50, multipartShare=0.1, origin=defaultOrigin, seed=0):
+    """ Writes a synthetic LRS to the shapefile path (PolyLineM with an RTE_NM
+        field and a WGS84 .prj) and returns it read back as a LoadedLRS.
+
+        The routes form a grid, half running east and half running north,
+        routeSpacing meters apart.  Vertices are every vertexSpacing meters,
+        so where routeSpacing is a multiple of vertexSpacing every crossing is
+        a shared vertex.  multipartShare of the routes are split in two by
+        dropping a vertex.  M-values are miles from the start of the route.
+    """
+    rng = np.random.default_rng(seed)
+    eastCount = routeCount // 2
+    northCount = routeCount - eastCount
+    lngScale, latScale = degrees_per_meter(origin[1])
+
+    # Integer meter offsets, so crossing routes have exactly the same vertices
+    eastOffsets = np.arange(0, (northCount - 1) * routeSpacing + 1, vertexSpacing)
+    northOffsets = np.arange(0, (eastCount - 1) * routeSpacing + 1, vertexSpacing)
+    multipart = rng.random(routeCount) < multipartShare
+
+    with shapefile.Writer(path, shapeType=shapefile.POLYLINEM) as w:
+        w.field('RTE_NM', 'C', 40)
+        for i in range(routeCount):
+            if i < eastCount:
+                offsets = eastOffsets
+                x = origin[0] + offsets * lngScale
+                y = np.full(len(offsets), origin[1] + i * routeSpacing * latScale)
+                rte_nm = f'R-VA   SR{i:05d}EB'
+            else:
+                offsets = northOffsets
+                x = np.full(len(offsets), origin[0] + (i - eastCount) * routeSpacing * lngScale)
+                y = origin[1] + offsets * latScale
+                rte_nm = f'R-VA   SR{i:05d}NB'
+
+            vertices = np.column_stack([x, y, np.round(offsets / metersPerMile, 3)]).tolist()
+            if multipart[i] and len(vertices) >= 5:
+                gap = int(rng.integers(2, len(vertices) - 2))
+                parts = [vertices[:gap], vertices[gap + 1:]]
+            else:
+                parts = [vertices]
+            w.linem(parts)
+            w.record(rte_nm)
+
+    with open(path[:-4] + '.prj', 'w') as file:
+        file.write(pyproj.CRS('EPSG:4326').to_wkt(pyproj.enums.WktVersion.WKT1_ESRI))
+
+    return LRSLoader.read_lrs(path)
+
+
+def make_projects(lrs, rowCount, pointShare=0.2, crossShare=0.1, missShare=0.02, jitter=3, seed=0):
+    """ Creates rowCount projects on a LoadedLRS in WGS84 (such as the one
+        make_lrs returns).
+
+        Line events begin and end at vertices of the same route, and point
+        events have no end coordinates.  crossShare of the line events end on
+        another route, so they need Step 2, and missShare of the projects are
+        moved a kilometer off the network.  Every coordinate is moved up to
+        jitter meters from its vertex.
+
+        returns a DataFrame with the columns of the DD csv, plus the rte_nm
+        that each project begins on
+    """
+    rng = np.random.default_rng(seed)
+    routeStart = lrs.partOffsets[lrs.routeParts[:-1]]
+    routeEnd = lrs.partOffsets[lrs.routeParts[1:]]
+    lngScale, latScale = degrees_per_meter(np.mean(lrs.xy[:, 1]))
+
+    route = rng.integers(0, len(routeStart), rowCount)
+    begin = routeStart[route] + (rng.random(rowCount) * (routeEnd - routeStart)[route]).astype(np.int64)
+    end = routeStart[route] + (rng.random(rowCount) * (routeEnd - routeStart)[route]).astype(np.int64)
+    crossRoute = rng.integers(0, len(routeStart), rowCount)
+    cross = rng.random(rowCount) < crossShare
+    end[cross] = routeStart[crossRoute[cross]] + (rng.random(cross.sum()) * (routeEnd - routeStart)[crossRoute[cross]]).astype(np.int64)
+
+    def jittered(vertices):
+        offset = rng.uniform(-jitter, jitter, (len(vertices), 2)) * [lngScale, latScale]
+        return lrs.xy[vertices] + offset
+
+    beginXY = jittered(begin)
+    endXY = jittered(end)
+    miss = rng.random(rowCount) < missShare
+    beginXY[miss] += [1000 * lngScale, 1000 * latScale]
+    endXY[miss] += [1000 * lngScale, 1000 * latScale]
+    endXY[rng.random(rowCount) < pointShare] = np.nan
+
+    return pd.DataFrame({
+        'organization': rng.choice(['Salem', 'Roanoke', 'VDOT'], rowCount),
+        'id': np.arange(1, rowCount + 1),
+        'begin_lat': np.round(beginXY[:, 1], 6),
+        'begin_lng': np.round(beginXY[:, 0], 6),
+        'end_lat': np.round(endXY[:, 1], 6),
+        'end_lng': np.round(endXY[:, 0], 6),
+        'rte_nm': lrs.names[route]
+    })
+
+
+def format_coordinates(values, isLat, dmsShare=0.5, seed=0):
+    """ Writes DD values as text in the mix of formats found in the project
+        spreadsheets, such as 37 19 09.05N, W79-30'-16.35" and 37.319181°.
+        dmsShare of the values are written as DMS, and the rest as DD
+        (longitudes sometimes without their minus sign).  Missing values are
+        written as empty strings. """
+    rng = np.random.default_rng(seed)
+    values = np.asarray(values, dtype=float)
+    hemisphere = 'N' if isLat else 'W'
+
+    # Whole hundredths of a second, so seconds never round up to 60
+    hundredths = np.round(np.abs(np.nan_to_num(values)) * 360000).astype(np.int64)
+    d = hundredths // 360000
+    m = hundredths // 6000 % 60
+    s = hundredths % 6000 / 100
+    dms = rng.random(len(values)) < dmsShare
+    style = rng.integers(0, 3, len(values))
+
+    text = []
+    for value, isDMS, k, dd, mm, ss in zip(values, dms, style, d, m, s):
+        if np.isnan(value):
+            text.append('')
+        elif not isDMS:
+            text.append([f'{value:.6f}', f'{value:.6f}°', f'{abs(value):.6f}'][k])
+        else:
+            text.append([f'{dd} {mm:02d} {ss:05.2f}{hemisphere}', f'{hemisphere}{dd}-{mm}\'-{ss:.2f}"', f'{dd}°{mm}\'{ss:.2f}"'][k])
+
+    return text
+
+
+def write_projects_csv(projects, path, dmsShare=0.5, seed=0):
+    """ Writes projects (from make_projects) to path in the format of the input
+        csv of XY_to_Events_Step1.py, with coordinates in mixed DMS/DD formats """
+    output = pd.DataFrame({'Organization': projects['organization'], 'id': projects['id']})
+    for k, (field, column) in enumerate(rawColumns.items()):
+        output[column] = format_coordinates(projects[field], field.endswith('lat'), dmsShare, seed + k)
+    output.to_csv(path, index=False, encoding='ISO-8859-1')
+
+
+def write_dd_csv(projects, path):
+    """ Writes projects (from make_projects) to path in the format of the DD
+        csv that XY_to_Events_Step1.py creates """
+    projects.drop(columns='rte_nm').to_csv(path, index=False)
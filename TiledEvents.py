@@ -0,0 +1,133 @@
+import multiprocessing
+import numpy as np
+import pandas as pd
+import CreateEventTable
+import EventTableIO
+import LRSCache
+from Instrumentation import metrics
+from LRSNetwork import LRSNetwork
+from Projection import project_coordinates
+from RouteMeasures import RouteMeasures
+
+# (names, namesMissing, RouteMeasures) of the whole LRS, memory-mapped from its cache so
+# that only the vertices of the routes a tile uses are read from disk
+source = None
+
+
+def cached_measures(path, crs):
+    """ Memory-maps the names and measures of the LRS at path from its cache,
+        building the cache first if it is missing or out of date """
+    cacheDir = LRSCache.cache_path(path)
+    arrays = LRSCache.read_arrays(cacheDir, LRSCache.cache_key(path, crs), LRSCache.arrayNames)
+    if arrays is None:
+        LRSNetwork.load(path, crs)
+        arrays = LRSCache.read_arrays(cacheDir, LRSCache.cache_key(path, crs), LRSCache.arrayNames)
+        if arrays is None:
+            raise OSError(f'Could not write the LRS cache for {path}, which tiled runs read from')
+
+    names = arrays.pop('names')
+    namesMissing = arrays.pop('namesMissing')
+    return names, namesMissing, RouteMeasures(**arrays)
+
+
+def route_bounds(measures):
+    """ (minx, miny, maxx, maxy) of each route, found in one pass over the
+        vertices.  Routes without vertices have NaN bounds. """
+    starts, ends = measures.offsets[:-1], measures.offsets[1:]
+    bounds = np.full((len(starts), 4), np.nan)
+    nonEmpty = ends > starts
+    if nonEmpty.any():
+        xy = measures.xy
+        for k, (reduce, column) in enumerate([(np.minimum, 0), (np.minimum, 1), (np.maximum, 0), (np.maximum, 1)]):
+            bounds[nonEmpty, k] = reduce.reduceat(xy[:, column], starts[nonEmpty])
+
+    return bounds
+
+
+def tile_routes(bounds, tile, tileSize, margin):
+    """ Routes whose bounding box comes within margin of the tile at grid
+        position tile (column, row) """
+    x0 = tile[0] * tileSize - margin
+    y0 = tile[1] * tileSize - margin
+    x1 = (tile[0] + 1) * tileSize + margin
+    y1 = (tile[1] + 1) * tileSize + margin
+    return np.flatnonzero((bounds[:, 0] <= x1) & (bounds[:, 2] >= x0) & (bounds[:, 1] <= y1) & (bounds[:, 3] >= y0))
+
+
+def init_tile_worker(path, crs):
+    global source
+    source = cached_measures(path, crs)
+
+
+def locate_tile(routes, rows):
+    """ Runs locate_events on rows with only the given routes of the LRS
+        loaded.  returns the events indexed like rows. """
+    names, namesMissing, measures = source
+    tileNetwork = LRSNetwork(LRSCache.object_array(names[routes], namesMissing[routes]), measures.subset(routes),
+                             CreateEventTable.targetCRS, CreateEventTable.lrsPath)
+
+    output = CreateEventTable.locate_events(rows, net=tileNetwork)
+    output.index = rows.index
+    return output
+
+
+def locate_tile_measured(routes, rows):
+    """ locate_tile for a worker process, returning its metrics as well (see
+        CreateEventTable.locate_events_measured) """
+    metrics.reset()
+    output = locate_tile(routes, rows)
+    return output, metrics.snapshot()
+
+
+def create_event_table_tiled(csvPath, outPath, tileSize=20000, margin=None, workers=1):
+    """ Partitioned version of create_event_table_batch for an LRS that is too
+        big to hold in memory.  The LRS is read from its memory-mapped cache,
+        and projects are located one tile at a time (split across a pool of
+        processes when workers > 1) with only that tile's routes loaded.
+
+        Projects are bucketed by the tileSize square (in the units of
+        targetCRS) that holds their begin point.  A tile loads every route,
+        whole, that comes within margin of it.  Since margin is at least the
+        search radius, each project sees every route that it could match,
+        with the same geometry and measures as the whole LRS, so the event
+        table is the same as a whole network run even when the end point is
+        in another tile.
+    """
+    global source
+    margin = CreateEventTable.searchRadius if margin is None else margin
+    if margin < CreateEventTable.searchRadius:
+        raise ValueError(f'The tile margin ({margin}) must be at least the search radius ({CreateEventTable.searchRadius})')
+
+    path, crs = CreateEventTable.lrsPath, CreateEventTable.targetCRS
+    with metrics.stage('parse'):
+        df = pd.read_csv(csvPath, dtype=str, keep_default_na=False)
+    source = cached_measures(path, crs)
+    bounds = route_bounds(source[2])
+
+    with metrics.stage('projection'):
+        x, y = project_coordinates(CreateEventTable.to_float(df['begin_lng']).to_numpy(),
+                                   CreateEventTable.to_float(df['begin_lat']).to_numpy(), CreateEventTable.wgs84, crs)
+    keys = np.column_stack([np.floor(x / tileSize), np.floor(y / tileSize)])
+
+    # Projects without a begin point only need their error comments, which
+    # any tile can give them
+    valid = np.isfinite(keys).all(axis=1)
+    keys[~valid] = keys[valid][0] if valid.any() else 0
+    tiles, tileIndex = np.unique(keys, axis=0, return_inverse=True)
+    tileIndex = tileIndex.ravel()
+    tasks = [(tile_routes(bounds, tile, tileSize, margin), df[tileIndex == t]) for t, tile in enumerate(tiles)]
+    metrics.observe_many('routes_per_tile', [len(routes) for routes, rows in tasks])
+    print(f'Locating {len(df)} projects in {len(tasks)} tiles')
+
+    if workers <= 1 or len(tasks) <= 1:
+        results = [locate_tile(routes, rows) for routes, rows in tasks]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with context.Pool(workers, initializer=init_tile_worker, initargs=(path, crs)) as pool:
+            results = [CreateEventTable.merge_measured(result) for result in pool.starmap(locate_tile_measured, tasks)]
+
+    outputDF = pd.concat(results).sort_index().reset_index(drop=True) if results else pd.DataFrame(columns=CreateEventTable.eventFields)
+    with metrics.stage('write'):
+        EventTableIO.write_events(outputDF, outPath)
+    print(f'Event table saved at "{outPath}"')
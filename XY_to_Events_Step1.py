@@ -12,9 +12,20 @@
 #
 # Created:     3/22/2021
 #-------------------------------------------------------------------------------
+import argparse
+import contextlib
+import itertools
+import logging
 import pandas as pd
-from DMSToDD import dms_to_dd
-from CreateEventTable import create_event_table
+from DMSToDD import dms_to_dd_series
+from CreateEventTable import create_event_table, create_event_table_batch, locate_event_chunks, write_event_chunks, point_cache
+from IncrementalEvents import create_event_table_incremental
+from TiledEvents import create_event_table_tiled
+from EventValidation import create_validation_table
+from Checkpoint import Checkpoint, run_key
+from EventTableIO import with_format
+from LRUCache import LRUCache
+from Instrumentation import metrics, report, profiled, LogSink, JSONSink
 
 # This should be a csv with all projects in a single sheet
 inputFilePath = r'data\AllProjects.csv'
@@ -24,35 +35,162 @@ inputFileConverted = r'data\AllProjects_DD.csv'
 
 outputEventTable = r'data\AllProjects_Events.csv'
 
+# Event table with the QA columns, written with --validate
+validationTable = r'data\AllProjects_Events_QA.csv'
 
+logger = logging.getLogger(__name__)
 
+# Output DD field for each coordinate column of the input csv
+coordinateColumns = {
+    "begin_lat": 'Project Start Location Latitude',
+    "begin_lng": 'Project Start Location Longitude',
+    "end_lat": 'Project End Location Latitude',
+    "end_lng": 'Project End Location Longitude'
+}
+
+
+
+
+
+def convert_chunk(df, cache=None):
+    """ Converts a DataFrame of the input csv to DD coordinates.  Each
+        coordinate column is parsed in one pass by dms_to_dd_series, reusing
+        values parsed before if an LRUCache is given. """
+    outputDF = pd.DataFrame({
+        "organization": df['Organization'],
+        "id": df['id']
+    })
+    for field, column in coordinateColumns.items():
+        with metrics.stage('dms_conversion'):
+            outputDF[field], failed = dms_to_dd_series(df[column], cache)
+        if failed.any():
+            logger.warning(f'Could not convert {failed.sum()} values in "{column}"')
+            metrics.count('errors.unconverted_coordinates', failed.sum())
+
+    return outputDF
 
 
 def convert_coordinates(csvPath, outputPath):
     """ Converts input csv file with multiple coordinate formats
         into an output csv file with DD format coordinates """
-    outputData = []
-    df = pd.read_csv(csvPath, encoding = "ISO-8859-1")
-    for i in range(len(df)):
-        data = {
-            "organization": df.iloc[i]['Organization'],
-            "id": df.iloc[i]['id'],
-            "begin_lat": dms_to_dd(df.iloc[i]['Project Start Location Latitude']),
-            "begin_lng": dms_to_dd(df.iloc[i]['Project Start Location Longitude']),
-            "end_lat": dms_to_dd(df.iloc[i]['Project End Location Latitude']),
-            "end_lng": dms_to_dd(df.iloc[i]['Project End Location Longitude'])
-        }
-        outputData.append(data)
-
-    outputDF = pd.DataFrame(outputData)
-    outputDF.to_csv(outputPath, index=False)
-
-
-
-# Convert coordinates from DMS/DD to DD and ensure that they are all in the
-# correct hemisphere
-convert_coordinates(inputFilePath, inputFileConverted)
-
-# Create an output events table.  Events that span multiple routes will require
-# further processing with the network analyst
-create_event_table(inputFileConverted, outputEventTable)
\ No newline at end of file
+    with metrics.stage('parse'):
+        df = pd.read_csv(csvPath, encoding = "ISO-8859-1")
+    outputDF = convert_chunk(df)
+    with metrics.stage('write'):
+        outputDF.to_csv(outputPath, index=False)
+
+
+def convert_coordinates_stream(csvPath, chunkSize=100000, skip=0):
+    """ Yields the input csv converted to DD coordinates, chunkSize rows at a
+        time.  Values are read as text, so a chunk's ids look the same no
+        matter which other rows share the chunk.  Coordinates that repeat
+        between chunks are only parsed once.  The first skip chunks are read
+        past without being converted. """
+    cache = LRUCache(100000)
+    with pd.read_csv(csvPath, encoding = "ISO-8859-1", dtype=str, chunksize=chunkSize) as reader:
+        for i in itertools.count():
+            with metrics.stage('parse'):
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            if i >= skip:
+                yield convert_chunk(chunk, cache)
+
+
+def run_pipeline(csvPath, outPath, chunkSize=100000, workers=1, cache=None, checkpoint=False):
+    """ Converts and locates the input csv in chunks and appends each chunk of
+        events to outPath, without writing the intermediate DD csv.  With
+        checkpoint, each chunk is committed as it is done (see
+        Checkpoint.Checkpoint) and a run that was stopped carries on from the
+        last committed chunk. """
+    if not checkpoint:
+        chunks = convert_coordinates_stream(csvPath, chunkSize)
+        rowCount = write_event_chunks(locate_event_chunks(chunks, workers, cache), outPath)
+        print(f'Event table with {rowCount} rows saved at "{outPath}"')
+        return
+
+    run = Checkpoint(outPath, run_key('step1', csvPath, chunkSize))
+    chunks = convert_coordinates_stream(csvPath, chunkSize, skip=run.completed)
+    for events in locate_event_chunks(chunks, workers, cache):
+        run.save(events)
+    rowCount = run.finish()
+    print(f'Event table with {rowCount} rows saved at "{outPath}"')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find line events on the LRS from project begin and end coordinates')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to locate projects (default: 1)')
+    parser.add_argument('--chunk-size', type=int,
+                        help='stream the input in chunks of this many rows, without writing the DD csv')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='commit the event table in chunks (of --chunk-size rows, 100000 by default) so that a stopped run can be resumed')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only locate projects that are new or changed since the last run')
+    parser.add_argument('--point-cache',
+                        help='sqlite file that keeps located points between runs (single worker only)')
+    parser.add_argument('--tile-size', type=float,
+                        help='locate projects in square tiles of this size (in meters), loading only the routes near each tile')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'arrow'],
+                        help='format of the event table (default: csv).  parquet and arrow need pyarrow')
+    parser.add_argument('--validate', action='store_true',
+                        help='check the event table against the input coordinates and save it with QA columns (see EventValidation.py)')
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='level of the messages to show (default: WARNING).  INFO also shows the timing summary')
+    parser.add_argument('--stats',
+                        help='write the stage timings and counters to this JSON file')
+    parser.add_argument('--profile',
+                        help='profile the run and save the stats to this file')
+    parser.add_argument('--profiler', default='cProfile', choices=['cProfile', 'pyinstrument'],
+                        help='profiler used by --profile (default: cProfile)')
+    args = parser.parse_args()
+    if args.incremental and args.chunk_size:
+        parser.error('--incremental reads the whole DD csv and cannot be used with --chunk-size')
+    if args.tile_size and (args.incremental or args.chunk_size or args.point_cache):
+        parser.error('--tile-size cannot be used with --incremental, --chunk-size or --point-cache')
+    if args.checkpoint and (args.incremental or args.tile_size):
+        parser.error('--checkpoint cannot be used with --incremental or --tile-size')
+    if args.point_cache and args.workers > 1:
+        parser.error('--point-cache can only be used by a single worker (--workers 1)')
+    if args.checkpoint and not args.chunk_size:
+        args.chunk_size = 100000
+
+    logging.basicConfig(level=args.log_level, format='%(levelname)s %(name)s: %(message)s')
+    outputEventTable = with_format(outputEventTable, args.format)
+    validationTable = with_format(validationTable, args.format)
+
+    cache = None
+    if args.point_cache:
+        cache = point_cache(args.point_cache)
+
+    with profiled(args.profile, args.profiler) if args.profile else contextlib.nullcontext():
+        if args.chunk_size:
+            # Convert and locate each chunk, appending events to the output as they are found
+            run_pipeline(inputFilePath, outputEventTable, args.chunk_size, args.workers, cache, args.checkpoint)
+        else:
+            # Convert coordinates from DMS/DD to DD and ensure that they are all in the
+            # correct hemisphere
+            convert_coordinates(inputFilePath, inputFileConverted)
+
+            # Create an output events table.  Events that span multiple routes will require
+            # further processing with the network analyst
+            if args.tile_size:
+                create_event_table_tiled(inputFileConverted, outputEventTable, args.tile_size, workers=args.workers)
+            elif args.incremental:
+                create_event_table_incremental(inputFileConverted, outputEventTable, args.workers, cache)
+            elif cache is None:
+                create_event_table(inputFileConverted, outputEventTable, workers=args.workers)
+            else:
+                create_event_table_batch(inputFileConverted, outputEventTable, cache=cache)
+
+        if args.validate:
+            create_validation_table(outputEventTable, validationTable)
+
+    if cache is not None:
+        print(f'Point cache: {cache.stats()}')
+        cache.close()
+
+    sinks = [LogSink()]
+    if args.stats:
+        sinks.append(JSONSink(args.stats))
+    report(sinks)
@@ -14,6 +14,12 @@
 #                   -All_Points - the begin and end points combined into a single
 #                    point feature class
 #
+#              Each project is committed to the output lines as it is solved,
+#              and its id is added to a progress file next to the input.  If
+#              the run is stopped, running the script again skips the projects
+#              already in the progress file and carries on with the rest.  The
+#              progress file is removed once every project has been processed.
+#
 #              Written for Python 2.7
 #
 # Author:      daniel.fourquet@vdot.virginia.gov
@@ -23,6 +29,7 @@
 
 import arcpy
 import csv
+import os
 import traceback
 
 arcpy.env.overwriteOutput = True
@@ -40,13 +47,51 @@ outputLinesPath = r'C:\Users\daniel.fourquet\Documents\GitHub\XY-to-Line-Event-T
 outputLinesFileName = 'NetworkAnalyst'
 outputLines = "{}\\{}".format(outputLinesPath, outputLinesFileName)
 
+# ids of the projects saved to outputLines so far, one per line
+progressPath = inputData[:-4] + '_NetworkAnalyst.progress'
+
+
+def read_progress(path):
+    """ Returns the set of ids in the progress file, or an empty set if there
+        is none """
+    done = set()
+    if os.path.exists(path):
+        with open(path, 'r') as progressFile:
+            for line in progressFile:
+                if line.strip():
+                    done.add(line.strip())
+
+    return done
+
+
+def resume(path):
+    """ Returns the ids saved by an earlier run that was stopped.  Lines that
+        were appended to outputLines after the last id was recorded are
+        deleted, since those projects will be solved again.  Without a
+        progress file, the output is started over. """
+    if not os.path.exists(path):
+        if arcpy.Exists(outputLines):
+            arcpy.Delete_management(outputLines)
+        return set()
+
+    done = read_progress(path)
+    if arcpy.Exists(outputLines):
+        with arcpy.da.UpdateCursor(outputLines, 'nameID') as cur:
+            for row in cur:
+                if row[0] not in done:
+                    cur.deleteRow()
+
+    print('Resuming after {} projects'.format(len(done)))
+    return done
+
 print('Make Route Layer')
 rteLyr = arcpy.na.MakeRouteLayer(NetworkDataset, "rteLyr", "Length")
 
 print('Make point layers')
 all_points = arcpy.MakeFeatureLayer_management(all_points, "end_points")
 
-outputRecords = False # Track if first record was written yet
+done = resume(progressPath)
+progressFile = open(progressPath, 'a')
 with open(inputData, 'r') as csvFile:
     csvData = csv.DictReader(csvFile)
     for i, record in enumerate(csvData):
@@ -56,7 +101,11 @@ with open(inputData, 'r') as csvFile:
 
             # Only process projects that are not found but have coordinates available
             if comments != 'ERROR No matching routes found.':
-                continue           
+                continue
+
+            # Saved by an earlier run
+            if id in done:
+                continue
 
             print('Processing {}'.format(id))
 
@@ -74,22 +123,27 @@ with open(inputData, 'r') as csvFile:
                     print('    Shape len = {}'.format(row[0].length))
 
             print('    Save line geometry')
-            # First iteration will create a new feature class.  Subsequent iterations will append to it.
-            if not outputRecords:
-                print('    --Creating {}'.format(outputLinesFileName))
-                arcpy.FeatureClassToFeatureClass_conversion(r"rteLyr\Routes", outputLinesPath, outputLinesFileName)
-                arcpy.AddField_management("{}\\{}".format(outputLinesPath, outputLinesFileName), 'nameID', 'TEXT')
-                outputRecords = True
-            else:
-                print('    --Appending to {}'.format(outputLinesFileName))
-                arcpy.Append_management(r"rteLyr\Routes","{}\\{}".format(outputLinesPath, outputLinesFileName),"NO_TEST")
-            
-            with arcpy.da.UpdateCursor(outputLines, "nameID", 'nameID is Null') as cur:
+            # The id is set on a copy of the route, so only this project's lines are changed
+            solvedRoute = arcpy.CopyFeatures_management(r"rteLyr\Routes", r"in_memory\solvedRoute")
+            arcpy.AddField_management(solvedRoute, 'nameID', 'TEXT')
+            with arcpy.da.UpdateCursor(solvedRoute, "nameID") as cur:
                 for row in cur:
                     row[0] = id
                     cur.updateRow(row)
 
-            
+            # The first project creates the output feature class.  Later ones are appended to it.
+            if not arcpy.Exists(outputLines):
+                print('    --Creating {}'.format(outputLinesFileName))
+                arcpy.CopyFeatures_management(solvedRoute, outputLines)
+            else:
+                print('    --Appending to {}'.format(outputLinesFileName))
+                arcpy.Append_management(solvedRoute, outputLines, "NO_TEST")
+
+            # Record the project once its lines are saved
+            progressFile.write('{}\n'.format(id))
+            progressFile.flush()
+            os.fsync(progressFile.fileno())
+
             print('Done')
         except Exception as e:
             print('    --- ERROR on {} ---'.format(id))
@@ -99,8 +153,14 @@ with open(inputData, 'r') as csvFile:
         finally:
             arcpy.DeleteRows_management(r"rteLyr\Routes")
             arcpy.DeleteRows_management(r"rteLyr\Stops")
+            if arcpy.Exists(r"in_memory\solvedRoute"):
+                arcpy.Delete_management(r"in_memory\solvedRoute")
             print('\n')
 
+# Every project has been processed, so the next run starts over
+progressFile.close()
+os.remove(progressPath)
+
 
 
 
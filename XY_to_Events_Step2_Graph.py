@@ -0,0 +1,52 @@
+#-------------------------------------------------------------------------------
+# Name:        XY_to_Events_Step2_Graph.py
+# Purpose:     This script takes the output of XY_to_Events_Step1.py as input
+#              and finds the events that span more than one route by tracing
+#              the shortest path along the LRS between their begin and end
+#              points.  It does the same job as XY_to_Events_Step2.py without
+#              arcpy or the network analyst: the LRS that CreateEventTable
+#              loads is turned into a graph with nodes at shared vertices, and
+#              paths are solved in batches with scipy.  The graph is saved next
+#              to the LRS (LRS_Salem.graphcache) and only rebuilt when the LRS
+#              changes.
+#
+#              The output has one row for each route that a traced event
+#              follows, with the begin and end measure on that route.  Use
+#              --format to read and write Parquet or Arrow event tables
+#              instead of csv.  With --checkpoint, the events are traced
+#              --chunk-size at a time and each chunk is saved as it is done,
+#              so a run that is stopped carries on where it left off when it
+#              is started again.
+#
+#              Written for Python 3.7
+#-------------------------------------------------------------------------------
+import argparse
+from RouteGraph import trace_events, trace_events_checkpointed, get_graph
+from EventTableIO import read_events, write_events, with_format
+
+# Event table created by XY_to_Events_Step1.py
+inputData = r'data\AllProjects_Events.csv'
+
+outputEventTable = r'data\AllProjects_NetworkEvents.csv'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trace the events that Step 1 could not place on a single route')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'arrow'],
+                        help='format of the input and output event tables (default: csv)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='trace and save the events in chunks so that a stopped run can be resumed')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='events read at a time with --checkpoint (default: 10000)')
+    args = parser.parse_args()
+    inputData = with_format(inputData, args.format)
+    outputEventTable = with_format(outputEventTable, args.format)
+
+    if args.checkpoint:
+        trace_events_checkpointed(inputData, outputEventTable, args.chunk_size)
+    else:
+        events = read_events(inputData, typed=True)
+        traced = trace_events(events)
+        write_events(traced, outputEventTable)
+    print(f'Traced events saved at "{outputEventTable}"')
+    print(f'Search trees: {get_graph().trees.stats()}')
@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import CreateEventTable
+import SyntheticData
+
+
+@pytest.fixture(scope='session')
+def lrsPath(tmp_path_factory):
+    """ A small synthetic LRS shapefile (see SyntheticData.make_lrs) """
+    path = str(tmp_path_factory.mktemp('lrs') / 'LRS_Synthetic.shp')
+    SyntheticData.make_lrs(path, routeCount=40)
+    return path
+
+
+@pytest.fixture(scope='session')
+def projects(lrsPath):
+    """ Projects on the synthetic LRS, as make_projects returns them """
+    return SyntheticData.make_projects(SyntheticData.LRSLoader.read_lrs(lrsPath), 300)
+
+
+@pytest.fixture
+def network(lrsPath):
+    """ Loads the synthetic LRS as CreateEventTable's network, and puts back
+        the one that was loaded before after the test """
+    saved = CreateEventTable.lrsPath, CreateEventTable.targetCRS, CreateEventTable.network
+    yield CreateEventTable.load_lrs(lrsPath, CreateEventTable.targetCRS)
+    CreateEventTable.lrsPath, CreateEventTable.targetCRS, CreateEventTable.network = saved
+
+
+@pytest.fixture
+def rawCsv(projects, tmp_path):
+    """ The projects as the input csv of XY_to_Events_Step1.py """
+    path = str(tmp_path / 'Projects.csv')
+    SyntheticData.write_projects_csv(projects, path)
+    return path
+
+
+@pytest.fixture
+def ddCsv(projects, tmp_path):
+    """ The projects as the DD csv that XY_to_Events_Step1.py creates """
+    path = str(tmp_path / 'Projects_DD.csv')
+    SyntheticData.write_dd_csv(projects, path)
+    return path
@@ -0,0 +1,91 @@
+import filecmp
+import os
+import pandas as pd
+import pytest
+import Checkpoint
+import CreateEventTable
+import EventTableIO
+import RouteGraph
+import XY_to_Events_Step1
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(monkeypatch, chunks):
+    """ Makes Checkpoint.save fail once chunks have been committed, like a run
+        that is stopped part way """
+    save = Checkpoint.Checkpoint.save
+
+    def failing_save(self, events):
+        if self.completed >= chunks:
+            raise Crash()
+        save(self, events)
+    monkeypatch.setattr(Checkpoint.Checkpoint, 'save', failing_save)
+
+
+def test_step1_resume(network, rawCsv, tmp_path, monkeypatch):
+    wholePath = str(tmp_path / 'Whole.csv')
+    XY_to_Events_Step1.run_pipeline(rawCsv, wholePath, chunkSize=40)
+
+    outPath = str(tmp_path / 'Events.csv')
+    with monkeypatch.context() as patch:
+        crash_after(patch, 3)
+        with pytest.raises(Crash):
+            XY_to_Events_Step1.run_pipeline(rawCsv, outPath, chunkSize=40, checkpoint=True)
+    assert not os.path.exists(outPath)
+    assert Checkpoint.Checkpoint(outPath, Checkpoint.run_key('step1', rawCsv, 40)).completed == 3
+
+    # The second run only locates the chunks after the third
+    saved = []
+    save = Checkpoint.Checkpoint.save
+    monkeypatch.setattr(Checkpoint.Checkpoint, 'save', lambda self, events: saved.append(len(events)) or save(self, events))
+    XY_to_Events_Step1.run_pipeline(rawCsv, outPath, chunkSize=40, checkpoint=True)
+    assert sum(saved) == 300 - 3 * 40
+    assert filecmp.cmp(outPath, wholePath, shallow=False)
+    assert not os.path.exists(Checkpoint.checkpoint_path(outPath))
+
+
+def test_changed_key_starts_over(network, rawCsv, tmp_path):
+    outPath = str(tmp_path / 'Events.csv')
+    key = Checkpoint.run_key('step1', rawCsv, 40)
+    run = Checkpoint.Checkpoint(outPath, key)
+    run.save(pd.DataFrame([['a'] * len(CreateEventTable.eventFields)], columns=CreateEventTable.eventFields))
+    assert Checkpoint.Checkpoint(outPath, key).completed == 1
+
+    assert Checkpoint.run_key('step1', rawCsv, 50) != key
+    os.utime(rawCsv, ns=(0, 0))
+    changedKey = Checkpoint.run_key('step1', rawCsv, 40)
+    assert changedKey != key
+    run = Checkpoint.Checkpoint(outPath, changedKey)
+    assert run.completed == 0
+    assert os.listdir(run.folder) == []
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_finish_columnar(network, rawCsv, tmp_path, format):
+    pytest.importorskip('pyarrow')
+    csvPath = str(tmp_path / 'Events.csv')
+    XY_to_Events_Step1.run_pipeline(rawCsv, csvPath, chunkSize=40, checkpoint=True)
+    outPath = str(tmp_path / f'Events.{format}')
+    XY_to_Events_Step1.run_pipeline(rawCsv, outPath, chunkSize=40, checkpoint=True)
+
+    text = pd.read_csv(csvPath, dtype=str, keep_default_na=False)
+    assert EventTableIO.read_events(outPath).astype(object).equals(text.astype(object))
+
+
+def test_step2_resume(network, ddCsv, tmp_path, monkeypatch):
+    eventPath = str(tmp_path / 'Events.csv')
+    CreateEventTable.create_event_table_batch(ddCsv, eventPath)
+    wholePath = str(tmp_path / 'Traced_whole.csv')
+    EventTableIO.write_events(RouteGraph.trace_events(EventTableIO.read_events(eventPath)), wholePath)
+
+    outPath = str(tmp_path / 'Traced.csv')
+    with monkeypatch.context() as patch:
+        crash_after(patch, 2)
+        with pytest.raises(Crash):
+            RouteGraph.trace_events_checkpointed(eventPath, outPath, chunkSize=40)
+    rowCount = RouteGraph.trace_events_checkpointed(eventPath, outPath, chunkSize=40)
+    assert rowCount == len(pd.read_csv(wholePath))
+    assert filecmp.cmp(outPath, wholePath, shallow=False)
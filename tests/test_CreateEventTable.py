@@ -0,0 +1,73 @@
+import filecmp
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+import CreateEventTable
+from Instrumentation import metrics
+from LRSNetwork import LRSNetwork
+from Projection import project_coordinates
+from RouteMeasures import RouteMeasures
+
+
+@pytest.mark.parametrize('value', [None, 'nan', ' NaN ', '+nan', 'inf', '-inf', '1e400', 'x'])
+def test_row_loop_same_as_batch(network, ddCsv, tmp_path, value):
+    """ With value put in a begin and an end coordinate of line and point
+        events, such as 'nan', which float() reads but no route is near """
+    if value is not None:
+        df = pd.read_csv(ddCsv, dtype=str, keep_default_na=False)
+        df.loc[[0, 5], 'begin_lat'] = value
+        df.loc[[1, 6], 'end_lng'] = value
+        df.loc[[5, 6], ['end_lat', 'end_lng']] = ''
+        ddCsv = str(tmp_path / 'Projects_bad.csv')
+        df.to_csv(ddCsv, index=False)
+
+    rowPath = str(tmp_path / 'Row.csv')
+    batchPath = str(tmp_path / 'Batch.csv')
+    CreateEventTable.create_event_table(ddCsv, rowPath)
+    CreateEventTable.create_event_table_batch(ddCsv, batchPath)
+    assert filecmp.cmp(rowPath, batchPath, shallow=False)
+
+
+def test_row_loop_timed_once(network, ddCsv, tmp_path):
+    metrics.reset()
+    CreateEventTable.create_event_table(ddCsv, str(tmp_path / 'Row.csv'))
+    assert metrics.stages['locate'].count == 1
+    assert 'projection' not in metrics.stages and 'route_search' not in metrics.stages
+    assert 'routes_per_point' not in metrics.values
+
+
+def test_empty_input(network, tmp_path):
+    csvPath = tmp_path / 'Empty_DD.csv'
+    csvPath.write_text('organization,id,begin_lat,begin_lng,end_lat,end_lng\n')
+    outPath = tmp_path / 'Events.csv'
+    CreateEventTable.create_event_table(str(csvPath), str(outPath))
+    assert outPath.read_text().splitlines() == [','.join(CreateEventTable.eventFields)]
+
+
+def test_workers_same_as_single_process(network, ddCsv, tmp_path):
+    singlePath = str(tmp_path / 'Single.csv')
+    poolPath = str(tmp_path / 'Pool.csv')
+    CreateEventTable.create_event_table(ddCsv, singlePath, workers=1)
+    CreateEventTable.create_event_table(ddCsv, poolPath, workers=2)
+    assert filecmp.cmp(singlePath, poolPath, shallow=False)
+
+
+@pytest.mark.parametrize('names', [['NB', 'SB'], ['SB', 'NB']])
+def test_tied_routes_first_in_lrs_order(monkeypatch, names):
+    """ Both directions of a route with the same geometry tie, and the one
+        first in the LRS wins """
+    x0, y0 = 300000, 4150000
+    line = shapely.LineString([(x0, y0), (x0, y0 + 1000)])
+    net = LRSNetwork(names, RouteMeasures.from_routes([line, line], [[0, 1], [0, 1]]), CreateEventTable.targetCRS)
+    monkeypatch.setattr(CreateEventTable, 'network', net)
+
+    begin, end = shapely.Point(x0 + 3, y0 + 200), shapely.Point(x0 + 3, y0 + 700)
+    assert CreateEventTable.match_routes(begin, end) == names
+    assert CreateEventTable.match_routes_bulk(np.array([begin]), np.array([end])).tolist() == [0]
+
+    (lng, lat) = project_coordinates(np.array([begin.x, end.x]), np.array([begin.y, end.y]),
+                                     CreateEventTable.targetCRS, CreateEventTable.wgs84)
+    df = pd.DataFrame({'organization': ['Test'], 'id': ['1'], 'begin_lat': [str(lat[0])], 'begin_lng': [str(lng[0])],
+                       'end_lat': [str(lat[1])], 'end_lng': [str(lng[1])]})
+    assert CreateEventTable.locate_events(df, net=net)['rte_nm'].tolist() == [names[0]]
@@ -0,0 +1,92 @@
+import math
+import numpy as np
+import pandas as pd
+import SyntheticData
+from DMSToDD import dms_to_dd, dms_to_dd_series
+from LRUCache import LRUCache
+
+# Values that dms_to_dd reads, warns about, or fails on
+examples = [
+    '37 19 09.05N', 'W79-30\'-16.35"', '-80.214244°', '37.3192', '79.5045', '37°19\'9.05"', 'N37-19\'-9.05"',
+    '37.3192N', '79.5045W', '-79.5045W', '79 30 16.35 W', '79 30 16.35 w', 'S37 19 09', '37 19 09.05N ',
+    ' 37.5 ', '+37.5', '.5', '5.', '1e2', ' 1e2 ', '1E-2', '1_0', '1_000.5', '1__0', '_10', '10_', 'inf', '-Infinity',
+    'nan', 'NaN', '37 19', '37', '37.5.1', '37.5.1 19 09', '37.5 19 09', '37 19.5 09', '37 19 09 12', '1.2.3 4 5 6',
+    '..5 1 2', '37 19 .5', '37--19--09', 'abc', '', ' ', 'N', 'W', 'NW', '-', '°', '٣٧ ١٩ ٠٩', '٣٧.٥', '37 19 09',
+    ' 37.5 ', '0x10', '37,5', '37 19 09.05N\n'
+]
+
+alphabet = list('0123456789') * 3 + list('.-+_ NWSEnwse°\'"')
+
+
+def random_values(count, seed=0):
+    """ Short strings of digits, separators and hemisphere letters """
+    rng = np.random.default_rng(seed)
+    return [''.join(rng.choice(alphabet, rng.integers(1, 14))) for i in range(count)]
+
+
+def formatted_values():
+    """ Coordinates in each format of the project spreadsheets """
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(36.5, 39.5, 2000)
+    lng = rng.uniform(-83.7, -75.2, 2000)
+    return (SyntheticData.format_coordinates(lat, True, seed=2) +
+            SyntheticData.format_coordinates(lng, False, seed=3) +
+            SyntheticData.format_coordinates(lng, False, dmsShare=0, seed=4))
+
+
+def scalar(value):
+    """ What dms_to_dd returns for value, with None where it fails """
+    try:
+        return dms_to_dd(value)
+    except Exception:
+        return None
+
+
+def assert_same(values):
+    dd, failed = dms_to_dd_series(pd.Series(values, dtype=object))
+    for value, seriesDD, seriesFailed in zip(values, dd, failed):
+        expected = scalar(value)
+        if expected is None:
+            assert seriesFailed, f'{value!r} should fail'
+        elif math.isnan(expected):
+            assert not seriesFailed and math.isnan(seriesDD), f'{value!r} should be NaN'
+        else:
+            assert not seriesFailed and seriesDD == expected, f'{value!r}: {seriesDD!r} != {expected!r}'
+
+
+def test_examples():
+    assert_same(examples)
+
+
+def test_formatted():
+    assert_same(formatted_values())
+
+
+def test_random():
+    assert_same(random_values(20000))
+
+
+def test_rounding():
+    """ DMS values are rounded like Python's round, not np.round """
+    values = [f'{d} {m} {s / 100:.2f}' for d in [36, 37, 79, 80] for m in range(60) for s in range(0, 6000, 7)]
+    assert_same(values)
+
+    # Seconds that put the DD value halfway between two rounded values
+    values = [f'37 0 {(k + 0.5) * 0.00036:.5f}' for k in range(2000)]
+    assert_same(values)
+
+
+def test_missing():
+    dd, failed = dms_to_dd_series(pd.Series(['37.5', None, np.nan], dtype=object))
+    assert dd[0] == 37.5
+    assert dd[1:].isna().all() and not failed.any()
+
+
+def test_cache():
+    values = formatted_values()[:500] + examples
+    cache = LRUCache(100)
+    first = dms_to_dd_series(pd.Series(values, dtype=object), cache)
+    second = dms_to_dd_series(pd.Series(values, dtype=object), cache)
+    pd.testing.assert_series_equal(first[0], second[0])
+    pd.testing.assert_series_equal(first[1], second[1])
+    assert_same(values)
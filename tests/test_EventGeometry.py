@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+import shapely.ops
+import CreateEventTable
+import EventGeometry
+from RouteMeasures import RouteMeasures
+
+
+@pytest.fixture
+def index():
+    """ Routes with m-values that increase unevenly, decrease, go back and
+        forth, and that skip a gap between two parts """
+    geoms = [
+        shapely.LineString([(0, 0), (10, 0), (10, 30), (40, 70)]),
+        shapely.LineString([(0, 0), (0, 20), (15, 20)]),
+        shapely.LineString([(0, 0), (10, 0), (20, 0), (30, 0)]),
+        shapely.MultiLineString([[(0, 0), (10, 0)], [(20, 0), (30, 0)]])
+    ]
+    mValues = [[0, 1, 7, 8], [9, 5, 2], [0, 10, 5, 15], [0, 1, 3, 4]]
+    return EventGeometry.MeasureIndex(RouteMeasures.from_routes(geoms, mValues)), geoms, mValues
+
+
+def distance_along(line, m, measure):
+    """ Distance along line to measure, with m-values linear along each
+        segment, for m-values that only increase or only decrease """
+    cumulative = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(shapely.get_coordinates(line), axis=0).T))])
+    m = np.asarray(m, dtype=float)
+    if m[-1] < m[0]:
+        return np.interp(-measure, -m, cumulative)
+    return np.interp(measure, m, cumulative)
+
+
+@pytest.mark.parametrize('route', [0, 1])
+def test_points_match_line_interpolate_point(index, route):
+    index, geoms, mValues = index
+    measures = np.random.default_rng(route).uniform(min(mValues[route]), max(mValues[route]), 200)
+    measures[:len(mValues[route])] = mValues[route]
+    i, ratio, status = index.segment_at(np.full(len(measures), route), measures)
+    assert (status == EventGeometry.positionFound).all()
+
+    expected = shapely.line_interpolate_point(geoms[route], distance_along(geoms[route], mValues[route], measures))
+    assert np.allclose(index.points(i, ratio), shapely.get_coordinates(expected), rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('route', [0, 1])
+def test_lines_match_substring(index, route):
+    index, geoms, mValues = index
+    rng = np.random.default_rng(route)
+    low, high = min(mValues[route]), max(mValues[route])
+    measures = np.sort(rng.uniform(low, high, (100, 2)), axis=1)
+    if mValues[route][-1] < mValues[route][0]:
+        measures = measures[:, ::-1]
+    routes = np.full(len(measures), route)
+    begin = index.segment_at(routes, measures[:, 0])[:2]
+    end = index.segment_at(routes, measures[:, 1])[:2]
+    lines = index.lines(begin, end)
+
+    for line, (m0, m1) in zip(lines, measures):
+        expected = shapely.ops.substring(geoms[route], distance_along(geoms[route], mValues[route], m0),
+                                         distance_along(geoms[route], mValues[route], m1))
+        assert line.length == pytest.approx(expected.length, abs=1e-9)
+        assert shapely.hausdorff_distance(line, expected) < 1e-9
+
+
+def test_not_monotonic_uses_first_appearance(index):
+    index, geoms, mValues = index
+    # 7 is on the first segment (0 to 10) and again on the second (10 to 5)
+    i, ratio, status = index.segment_at([2, 2], [7, 12])
+    assert index.directions[2] == 0
+    assert np.allclose(index.points(i, ratio), [[7, 0], [27, 0]])
+
+
+def test_gap_and_outside(index):
+    index, geoms, mValues = index
+    measures = np.array([2.2, 3.5, 8.05, 9])
+    i, ratio, status = index.segment_at([3, 3, 0, 0], measures, tolerance=0.1)
+    assert status.tolist() == [EventGeometry.positionGap, EventGeometry.positionFound,
+                               EventGeometry.positionFound, EventGeometry.positionOutside]
+    assert np.allclose(index.points(i, ratio)[1:3], [[25, 0], [40, 70]])
+    # 2.2 is in the gap, closer to the second part
+    assert np.allclose(index.points(i, index.nearest_part(i, ratio, status, measures))[0], [20, 0])
+
+
+def test_events_on_network(network, ddCsv, tmp_path):
+    """ Points at the begin_msr of located events against the route geometry """
+    outPath = str(tmp_path / 'Events.csv')
+    CreateEventTable.create_event_table_batch(ddCsv, outPath)
+    events = pd.read_csv(outPath, dtype=str, keep_default_na=False)
+    geometry, comments = EventGeometry.event_geometries(events, 'begin', net=network)
+
+    index = EventGeometry.get_index(network)
+    measures = network.measures
+    checked = 0
+    for k, (rte_nm, begin_msr) in enumerate(zip(events['rte_nm'], events['begin_msr'])):
+        if rte_nm not in network.routeIndex or comments[k]:
+            continue
+        route = network.routeIndex[rte_nm][0]
+        start, end = measures.offsets[route], measures.offsets[route + 1]
+        if measures.routeParts[route + 1] - measures.routeParts[route] != 1 or index.directions[route] == 0:
+            continue
+        line = shapely.LineString(measures.xy[start:end])
+        expected = shapely.line_interpolate_point(line, distance_along(line, measures.m[start:end], float(begin_msr)))
+        assert shapely.distance(geometry[k], expected) < 1e-6
+        checked += 1
+
+    assert checked > 100
@@ -0,0 +1,73 @@
+import filecmp
+import numpy as np
+import pandas as pd
+import pytest
+import CreateEventTable
+import EventTableIO
+import EventValidation
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def eventCsv(network, ddCsv, tmp_path):
+    path = str(tmp_path / 'Events.csv')
+    CreateEventTable.create_event_table_batch(ddCsv, path)
+    return path
+
+
+def write_chunked(events, path, chunkSize):
+    with EventTableIO.EventWriter(path) as writer:
+        for start in range(0, len(events), chunkSize):
+            writer.write(events.iloc[start:start + chunkSize])
+
+
+def test_to_text_matches_str():
+    df = pd.DataFrame({
+        'text': ['a', None, 'b', 'a'],
+        'float': [37.0, np.nan, 0.1 + 0.2, 1e16],
+        'int': [1, 2, 3, 1],
+        'category': pd.Categorical(['x', None, 'y', 'x'])
+    })
+    expected = df.apply(lambda column: column.map(lambda value: '' if pd.isna(value) else str(value)))
+    assert CreateEventTable.to_text(df).astype(object).equals(expected.astype(object))
+
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_read_as_csv_text(eventCsv, tmp_path, format):
+    text = pd.read_csv(eventCsv, dtype=str, keep_default_na=False)
+    path = str(tmp_path / f'Events.{format}')
+    write_chunked(text, path, 70)
+
+    assert EventTableIO.read_events(path).astype(object).equals(text.astype(object))
+    typed = EventTableIO.read_events(path, typed=True)
+    assert typed['begin_msr'].dtype == float
+    assert isinstance(typed['rte_nm'].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize('format', ['csv', 'parquet', 'arrow'])
+@pytest.mark.parametrize('typed', [False, True])
+def test_chunks_match_whole_table(eventCsv, tmp_path, format, typed):
+    path = eventCsv
+    if format != 'csv':
+        path = str(tmp_path / f'Events.{format}')
+        write_chunked(pd.read_csv(eventCsv, dtype=str, keep_default_na=False), path, 70)
+
+    whole = EventTableIO.read_events(path, typed=typed)
+    chunks = list(EventTableIO.read_event_chunks(path, 45, typed=typed))
+    assert [len(chunk) for chunk in chunks[:-1]] == [45] * (len(chunks) - 1)
+    assert 0 < len(chunks[-1]) <= 45
+    joined = pd.concat(chunks)
+    assert joined.index.equals(pd.RangeIndex(len(whole)))
+    assert joined.astype(object).equals(whole.astype(object))
+
+
+def test_typed_validation_matches_text(eventCsv, tmp_path):
+    """ Validation reads Parquet typed and csv as text, and must write the
+        same table from either """
+    parquetPath = str(tmp_path / 'Events.parquet')
+    write_chunked(pd.read_csv(eventCsv, dtype=str, keep_default_na=False), parquetPath, 70)
+
+    EventValidation.create_validation_table(eventCsv, str(tmp_path / 'QA_text.csv'), chunkSize=100)
+    EventValidation.create_validation_table(parquetPath, str(tmp_path / 'QA_typed.csv'), chunkSize=100)
+    assert filecmp.cmp(str(tmp_path / 'QA_text.csv'), str(tmp_path / 'QA_typed.csv'), shallow=False)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+import CreateEventTable
+import EventValidation
+from LRSNetwork import LRSNetwork
+from Projection import project_coordinates
+from RouteMeasures import RouteMeasures
+
+# A divided highway: NB runs north with measures 0 to 1 over 1000 meters,
+# and SB runs south 10 meters east of it
+x0, y0 = 300000, 4150000
+
+
+@pytest.fixture
+def highway():
+    geoms = [shapely.LineString([(x0, y0), (x0, y0 + 1000)]),
+             shapely.LineString([(x0 + 10, y0 + 1000), (x0 + 10, y0)])]
+    measures = RouteMeasures.from_routes(geoms, [[0, 1], [0, 1]])
+    return LRSNetwork(['NB', 'SB'], measures, CreateEventTable.targetCRS)
+
+
+def event(rte_nm, begin_msr, end_msr, begin, end):
+    """ An event table row with input points at (x, y) in the LRS crs """
+    (beginLng, endLng), (beginLat, endLat) = project_coordinates(np.array([begin[0], end[0]]), np.array([begin[1], end[1]]),
+                                                                CreateEventTable.targetCRS, CreateEventTable.wgs84)
+    return {'organization': 'Test', 'id': rte_nm, 'rte_nm': rte_nm, 'begin_msr': str(begin_msr), 'end_msr': str(end_msr),
+            'begin_lat': str(beginLat), 'begin_lng': str(beginLng), 'end_lat': str(endLat), 'end_lng': str(endLng),
+            'comments': ''}
+
+
+def validate(highway, *rows):
+    events = pd.DataFrame(list(rows), columns=CreateEventTable.eventFields)
+    return EventValidation.validate_events(events, net=highway)
+
+
+def test_clean_event_passes(highway):
+    # 1 meter from SB, running with its measures, and 9 meters from NB
+    checked = validate(highway, event('SB', 0.4, 0.6, (x0 + 9, y0 + 600), (x0 + 9, y0 + 400))).iloc[0]
+    assert checked['route_found'] and checked['qa_pass']
+    assert checked['max_offset'] == pytest.approx(1, abs=1e-6)
+    assert checked['m_direction'] == 1
+    assert checked['alt_rte_nm'] == 'NB'
+    assert checked['alt_m_direction'] == -1
+    assert not (checked['offset_exceeded'] or checked['ambiguous'] or checked['direction_mismatch'] or checked['nudged'])
+
+
+def test_wrong_carriageway(highway):
+    """ The same points put on NB run against its measures, while SB is
+        closer and runs with them """
+    checked = validate(highway, event('NB', 0.6, 0.4, (x0 + 9, y0 + 600), (x0 + 9, y0 + 400))).iloc[0]
+    assert checked['route_found']
+    assert checked['m_direction'] == -1
+    assert checked['direction_mismatch'] and checked['ambiguous']
+    assert not checked['offset_exceeded'] and not checked['qa_pass']
+
+
+def test_moved_measures_exceed_offset(highway):
+    checked = validate(highway, event('SB', 0.1, 0.3, (x0 + 9, y0 + 600), (x0 + 9, y0 + 400))).iloc[0]
+    assert checked['max_offset'] == pytest.approx(300, abs=0.01)
+    assert checked['offset_exceeded'] and not checked['qa_pass']
+
+
+def test_unknown_route_not_found(highway):
+    checked = validate(highway, event('XX', 0.4, 0.6, (x0 + 9, y0 + 600), (x0 + 9, y0 + 400))).iloc[0]
+    assert not checked['route_found'] and not checked['qa_pass']
+    assert np.isnan(checked['max_offset'])
+    # A route that was not found is not also reported as out of place
+    assert not (checked['offset_exceeded'] or checked['ambiguous'] or checked['direction_mismatch'])
+
+
+def test_nudged_point_event(highway):
+    """ Step 1 moves the measures of a point event 0.1 apart, and they are
+        checked at the point itself """
+    checked = validate(highway, event('SB', 0.4, 0.6, (x0 + 9, y0 + 500), (x0 + 9, y0 + 500))).iloc[0]
+    assert checked['nudged'] and checked['qa_pass']
+    assert checked['m_direction'] == 0
+    assert checked['max_offset'] == pytest.approx(1, abs=1e-6)
+
+
+def test_step1_events_pass(network, ddCsv, tmp_path):
+    """ Events located by Step 1 on the synthetic LRS come within the search
+        radius of their input points """
+    outPath = str(tmp_path / 'Events.csv')
+    CreateEventTable.create_event_table_batch(ddCsv, outPath)
+    events = pd.read_csv(outPath, dtype=str, keep_default_na=False)
+    checked = EventValidation.validate_events(events, net=network)
+
+    located = (events['rte_nm'] != '').to_numpy()
+    assert checked['route_found'].to_numpy()[located].all()
+    assert not checked['offset_exceeded'].to_numpy()[located].any()
+    assert not checked['route_found'].to_numpy()[~located].any()
@@ -0,0 +1,56 @@
+import filecmp
+import shutil
+import pandas as pd
+import CreateEventTable
+import IncrementalEvents
+
+
+def batch(ddCsv, outPath):
+    CreateEventTable.create_event_table_batch(ddCsv, outPath)
+    return outPath
+
+
+def test_unchanged_rows_reused(network, ddCsv, tmp_path):
+    outPath = str(tmp_path / 'Events.csv')
+    IncrementalEvents.create_event_table_incremental(ddCsv, outPath)
+    assert filecmp.cmp(outPath, batch(ddCsv, str(tmp_path / 'Batch.csv')), shallow=False)
+
+    # Everything is copied from the first run the second time
+    previous = IncrementalEvents.load_previous(outPath, IncrementalEvents.run_key())
+    assert previous is not None
+    IncrementalEvents.create_event_table_incremental(ddCsv, outPath)
+    assert filecmp.cmp(outPath, str(tmp_path / 'Batch.csv'), shallow=False)
+
+
+def test_changed_rows_located(network, ddCsv, tmp_path):
+    outPath = str(tmp_path / 'Events.csv')
+    IncrementalEvents.create_event_table_incremental(ddCsv, outPath)
+
+    df = pd.read_csv(ddCsv, dtype=str, keep_default_na=False)
+    df.loc[5, ['begin_lat', 'begin_lng']] = df.loc[9, ['begin_lat', 'begin_lng']].to_numpy()
+    changedCsv = str(tmp_path / 'Changed_DD.csv')
+    df.to_csv(changedCsv, index=False)
+
+    IncrementalEvents.create_event_table_incremental(changedCsv, outPath)
+    assert filecmp.cmp(outPath, batch(changedCsv, str(tmp_path / 'Batch.csv')), shallow=False)
+
+
+def test_manifest_from_another_run_rejected(network, ddCsv, tmp_path):
+    """ A crash between writing the table and the manifest leaves the new
+        table with the old manifest, which must not be used """
+    outPath = str(tmp_path / 'Events.csv')
+    IncrementalEvents.create_event_table_incremental(ddCsv, outPath)
+    oldManifest = str(tmp_path / 'old.manifest.json')
+    shutil.copy(IncrementalEvents.manifest_path(outPath), oldManifest)
+
+    # Same number of rows, but one removed and one added
+    df = pd.read_csv(ddCsv, dtype=str, keep_default_na=False)
+    moved = pd.concat([df.iloc[1:], df.iloc[[0]].assign(id='new')], ignore_index=True)
+    movedCsv = str(tmp_path / 'Moved_DD.csv')
+    moved.to_csv(movedCsv, index=False)
+    IncrementalEvents.create_event_table_incremental(movedCsv, outPath)
+    shutil.copy(oldManifest, IncrementalEvents.manifest_path(outPath))
+
+    assert IncrementalEvents.load_previous(outPath, IncrementalEvents.run_key()) is None
+    IncrementalEvents.create_event_table_incremental(ddCsv, outPath)
+    assert filecmp.cmp(outPath, batch(ddCsv, str(tmp_path / 'Batch.csv')), shallow=False)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+import CreateEventTable
+import LRSCache
+from LRSNetwork import LRSNetwork
+from RouteGraph import RouteGraph
+
+
+@pytest.fixture
+def shapefile(lrsPath, tmp_path):
+    """ A copy of the synthetic LRS that a test can change """
+    for extension in ['.shp', '.shx', '.dbf', '.prj']:
+        shutil.copy(lrsPath[:-4] + extension, tmp_path / f'LRS{extension}')
+    return str(tmp_path / 'LRS.shp')
+
+
+def test_cache_round_trip(shapefile):
+    built = LRSNetwork.load(shapefile, CreateEventTable.targetCRS)
+    cached = LRSCache.load_cache(shapefile, CreateEventTable.targetCRS)
+    assert cached is not None
+    names, measures, attributes = cached
+
+    assert list(names) == list(built.names)
+    np.testing.assert_array_equal(measures.xy, built.measures.xy)
+    np.testing.assert_array_equal(measures.m, built.measures.m)
+    np.testing.assert_array_equal(measures.offsets, built.measures.offsets)
+    pd.testing.assert_frame_equal(attributes, built.attributes)
+    assert not any(name.endswith('.pkl') for name in os.listdir(LRSCache.cache_path(shapefile)))
+
+
+@pytest.mark.parametrize('change', ['mtime', 'size', 'crs'])
+def test_cache_invalidated(shapefile, change):
+    crs = CreateEventTable.targetCRS
+    LRSNetwork.load(shapefile, crs)
+    assert LRSCache.load_cache(shapefile, crs) is not None
+
+    if change == 'mtime':
+        stat = os.stat(shapefile)
+        os.utime(shapefile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    elif change == 'size':
+        with open(shapefile[:-4] + '.dbf', 'ab') as file:
+            file.write(b' ')
+    else:
+        crs = 'EPSG:26917'
+    assert LRSCache.load_cache(shapefile, crs) is None
+
+
+def test_missing_names_kept(shapefile, network):
+    names = network.names.copy()
+    names[[0, 3]] = None
+    attributes = network.attributes.assign(RTE_NM=names)
+    LRSCache.save_cache(shapefile, CreateEventTable.targetCRS, names, network.measures, attributes)
+
+    cachedNames, measures, cachedAttributes = LRSCache.load_cache(shapefile, CreateEventTable.targetCRS)
+    assert cachedNames[0] is None and cachedNames[3] is None
+    assert list(cachedNames[4:]) == list(network.names[4:])
+    assert pd.isna(cachedAttributes['RTE_NM'][0])
+
+
+@pytest.mark.parametrize('damage', ['missing', 'truncated'])
+def test_damaged_cache_rebuilt(shapefile, damage):
+    built = LRSNetwork.load(shapefile, CreateEventTable.targetCRS)
+    arrayPath = os.path.join(LRSCache.cache_path(shapefile), 'xy.npy')
+    if damage == 'missing':
+        os.remove(arrayPath)
+    else:
+        with open(arrayPath, 'r+b') as file:
+            file.truncate(os.path.getsize(arrayPath) // 2)
+
+    assert LRSCache.load_cache(shapefile, CreateEventTable.targetCRS) is None
+    rebuilt = LRSNetwork.load(shapefile, CreateEventTable.targetCRS)
+    np.testing.assert_array_equal(rebuilt.measures.xy, built.measures.xy)
+    assert LRSCache.load_cache(shapefile, CreateEventTable.targetCRS) is not None
+
+
+def test_cache_write_failure_logged(shapefile, monkeypatch, caplog, capsys):
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr(LRSCache, 'save_cache', fail)
+    monkeypatch.setattr(LRSCache, 'write_arrays', fail)
+
+    network = LRSNetwork.load(shapefile, CreateEventTable.targetCRS)
+    RouteGraph.load(network)
+    assert [record.levelname for record in caplog.records] == ['WARNING', 'WARNING']
+    assert 'disk full' in caplog.text
+    assert capsys.readouterr().out == ''
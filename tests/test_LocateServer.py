@@ -0,0 +1,83 @@
+import asyncio
+import io
+import json
+import os
+import numpy as np
+import pytest
+import CreateEventTable
+import LocateServer
+from Locator import Locator
+from Projection import project_coordinates
+
+
+@pytest.fixture
+def locator(lrsPath, monkeypatch):
+    loaded = Locator.load(lrsPath, CreateEventTable.targetCRS)
+    monkeypatch.setattr(LocateServer, 'locator', loaded)
+    return loaded
+
+
+async def http_request(request):
+    """ Sends raw request bytes to a server on a free port and returns every
+        byte of the reply until the server closes the connection """
+    server = await asyncio.start_server(lambda reader, writer: LocateServer.handle_http(reader, writer, None),
+                                        '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    return response
+
+
+@pytest.mark.parametrize('length', ['-5', 'abc', '1_0', '+3'])
+def test_bad_content_length(locator, length):
+    response = asyncio.run(http_request(f'POST /locate HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}'.encode()))
+    assert response.startswith(b'HTTP/1.1 400 Bad Request')
+    assert b'Connection: close' in response
+    assert b'Invalid Content-Length' in response
+
+
+def test_health_cache_scope(locator):
+    response = asyncio.run(http_request(b'GET /health HTTP/1.1\r\nConnection: close\r\n\r\n'))
+    result = json.loads(response.split(b'\r\n\r\n', 1)[1])
+    assert result['routes'] == len(locator.network.names)
+    assert result['cacheScope'] == 'server process'
+    assert LocateServer.health(object())['cacheScope'].startswith('server process; batch workers')
+
+
+def test_stdio_reads_pipe(locator, projects):
+    """ stdin is read in a thread, so any pipe works on any event loop """
+    lng, lat = projects.loc[0, ['begin_lng', 'begin_lat']].astype(float)
+    readFd, writeFd = os.pipe()
+    with open(writeFd, 'wb') as requests:
+        requests.write(json.dumps({'id': 1, 'method': 'locate', 'params': {'lng': lng, 'lat': lat}}).encode() + b'\n')
+        requests.write(b'not json\n')
+
+    output = io.StringIO()
+    with open(readFd, 'rb') as input:
+        asyncio.run(LocateServer.serve_stdio(None, input, output))
+
+    replies = {reply['id']: reply for reply in map(json.loads, output.getvalue().splitlines())}
+    assert replies[1]['result'] == locator.locate(lng, lat)
+    assert replies[1]['result']
+    assert 'Invalid request' in replies[None]['error']
+
+
+@pytest.mark.parametrize('radius, rte_nm', [(CreateEventTable.searchRadius, 'R-VA   SR00001EB'), (5, None)])
+def test_event_uses_search_radius(lrsPath, monkeypatch, radius, rte_nm):
+    """ A point 10 meters from route 1 is only matched with a search radius
+        over 10 meters, by /event as well as /locate """
+    loaded = Locator.load(lrsPath, CreateEventTable.targetCRS, searchRadius=radius)
+    monkeypatch.setattr(LocateServer, 'locator', loaded)
+    x, y = loaded.network.measures.xy[loaded.network.measures.offsets[1] + 4]
+    lng, lat = project_coordinates(np.array([x]), np.array([y + 10]), loaded.network.crs, CreateEventTable.wgs84)
+    body = json.dumps({'organization': 'Test', 'id': '1', 'begin_lat': lat[0], 'begin_lng': lng[0]}).encode()
+
+    response = asyncio.run(http_request(b'POST /event HTTP/1.1\r\nConnection: close\r\n'
+                                        b'Content-Length: %d\r\n\r\n%s' % (len(body), body)))
+    result = json.loads(response.split(b'\r\n\r\n', 1)[1])
+    assert result['rte_nm'] == rte_nm
+    assert bool(loaded.locate(lng[0], lat[0])) == (rte_nm is not None)
@@ -0,0 +1,46 @@
+import pandas as pd
+import CreateEventTable
+
+
+def located(ddCsv, cache):
+    events = pd.read_csv(ddCsv, dtype=str, keep_default_na=False)
+    return CreateEventTable.locate_events(events, cache)
+
+
+def test_cache_same_as_uncached(network, ddCsv):
+    expected = located(ddCsv, None)
+    cache = CreateEventTable.point_cache()
+    pd.testing.assert_frame_equal(located(ddCsv, cache), expected)
+
+    # Every point is in memory the second time
+    misses = cache.memory.misses
+    pd.testing.assert_frame_equal(located(ddCsv, cache), expected)
+    assert cache.memory.misses == misses
+
+
+def test_disk_cache(network, ddCsv, tmp_path):
+    expected = located(ddCsv, None)
+    path = str(tmp_path / 'points.sqlite')
+    first = CreateEventTable.point_cache(path)
+    pd.testing.assert_frame_equal(located(ddCsv, first), expected)
+    first.close()
+
+    second = CreateEventTable.point_cache(path)
+    pd.testing.assert_frame_equal(located(ddCsv, second), expected)
+    assert second.stats()['diskHits'] > 0
+    second.close()
+
+
+def test_cache_cleared_for_another_lrs(network, ddCsv, tmp_path):
+    path = str(tmp_path / 'points.sqlite')
+    cache = CreateEventTable.point_cache(path)
+    located(ddCsv, cache)
+    cache.close()
+
+    CreateEventTable.searchRadius, saved = 10, CreateEventTable.searchRadius
+    try:
+        cache = CreateEventTable.point_cache(path)
+    finally:
+        CreateEventTable.searchRadius = saved
+    assert cache.db.execute('SELECT COUNT(*) FROM points').fetchone()[0] == 0
+    cache.close()
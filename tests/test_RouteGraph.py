@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse.csgraph import dijkstra
+import CreateEventTable
+import RouteGraph as RouteGraphModule
+from Projection import project_coordinates
+from RouteGraph import RouteGraph
+
+
+@pytest.fixture
+def graph(network):
+    return RouteGraph.from_network(network)
+
+
+@pytest.mark.parametrize('limit', [300, 2000, 100000])
+def test_local_search_same_as_whole_graph(graph, limit):
+    sources = np.random.default_rng(0).choice(graph.nodeCount, 20, replace=False)
+    trees = graph.search_trees(sources, limit)
+    distances, predecessors = dijkstra(graph.matrix, indices=sources, limit=limit, return_predecessors=True)
+
+    for source, sourceDistances, sourcePredecessors in zip(sources, distances, predecessors):
+        tree = trees[source]
+        reached = np.flatnonzero(np.isfinite(sourceDistances))
+        np.testing.assert_array_equal(tree.nodes, reached)
+        np.testing.assert_array_equal(tree.distances, sourceDistances[reached])
+        np.testing.assert_array_equal(tree.predecessors, np.where(sourcePredecessors[reached] >= 0, sourcePredecessors[reached], -1))
+
+
+def test_local_graph_is_local(graph):
+    source = np.array([graph.vertexNode[0]])
+    nodes, matrix = graph.local_graph(source, 300)
+    assert len(nodes) < graph.nodeCount // 10
+    assert matrix.shape == (len(nodes), len(nodes))
+
+
+def test_trees_reused(graph):
+    sources = np.array([graph.vertexNode[0], graph.vertexNode[10]])
+    first = graph.search_trees(sources, 1000)
+    second = graph.search_trees(sources, 500)
+    assert all(first[node] is second[node] for node in sources)
+
+
+def vertex_coordinates(network, route, k):
+    """ (lng, lat) of the k-th vertex of a route """
+    x, y = network.measures.xy[network.measures.offsets[route] + k]
+    lng, lat = project_coordinates(np.array([x]), np.array([y]), network.crs, CreateEventTable.wgs84)
+    return str(lng[0]), str(lat[0])
+
+
+def unmatched(id, begin, end):
+    return {'organization': 'Test', 'id': id, 'rte_nm': '', 'begin_msr': '', 'end_msr': '',
+            'begin_lat': begin[1], 'begin_lng': begin[0], 'end_lat': end[1], 'end_lng': end[0],
+            'comments': RouteGraphModule.noMatchComment}
+
+
+def test_trace_known_path(network):
+    """ Route 1 runs east 400 meters north of route 0, and route 21 runs
+        north 400 meters east of route 20, so they cross at vertex 8 of both.
+        From 200 meters along route 1 to 700 meters along route 21 the only
+        shortest path turns at the crossing.  M-values are miles. """
+    begin = vertex_coordinates(network, 1, 4)
+    end = vertex_coordinates(network, 21, 14)
+    events = pd.DataFrame([unmatched('forward', begin, end), unmatched('back', end, begin)],
+                          columns=CreateEventTable.eventFields)
+    traced = RouteGraphModule.trace_events(events)
+
+    assert traced[['id', 'rte_nm', 'begin_msr', 'end_msr', 'comments']].values.tolist() == [
+        ['forward', 'R-VA   SR00001EB', 0.124, 0.249, 'Traced route 1 of 2'],
+        ['forward', 'R-VA   SR00021NB', 0.249, 0.435, 'Traced route 2 of 2'],
+        ['back', 'R-VA   SR00021NB', 0.435, 0.249, 'Traced route 1 of 2'],
+        ['back', 'R-VA   SR00001EB', 0.249, 0.124, 'Traced route 2 of 2']
+    ]
+
+
+@pytest.mark.parametrize('value', ['', 'nan', 'x'])
+def test_trace_unreadable_coordinates(network, value):
+    begin = vertex_coordinates(network, 1, 4)
+    end = vertex_coordinates(network, 21, 14)
+    events = pd.DataFrame([unmatched('bad', (begin[0], value), end), unmatched('good', begin, end)],
+                          columns=CreateEventTable.eventFields)
+    traced = RouteGraphModule.trace_events(events)
+
+    assert traced['id'].tolist() == ['bad', 'good', 'good']
+    assert traced.loc[0, 'comments'] == 'ERROR Missing or unreadable coordinates.'
+    assert pd.isna(traced.loc[0, 'rte_nm'])
+    assert traced.loc[1:, 'rte_nm'].tolist() == ['R-VA   SR00001EB', 'R-VA   SR00021NB']
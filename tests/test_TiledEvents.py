@@ -0,0 +1,25 @@
+import filecmp
+import pytest
+import CreateEventTable
+import TiledEvents
+
+
+@pytest.mark.parametrize('tileSize, workers', [(1000, 1), (1000, 2), (100000, 1)])
+def test_tiled_matches_whole_network(network, ddCsv, tmp_path, tileSize, workers):
+    wholePath = str(tmp_path / 'Whole.csv')
+    tiledPath = str(tmp_path / 'Tiled.csv')
+    CreateEventTable.create_event_table_batch(ddCsv, wholePath)
+    TiledEvents.create_event_table_tiled(ddCsv, tiledPath, tileSize, workers=workers)
+    assert filecmp.cmp(wholePath, tiledPath, shallow=False)
+
+
+def test_small_tiles_load_fewer_routes(network):
+    bounds = TiledEvents.route_bounds(TiledEvents.cached_measures(CreateEventTable.lrsPath, CreateEventTable.targetCRS)[2])
+    tile = (bounds[:, :2].min(axis=0) // 1000)
+    routes = TiledEvents.tile_routes(bounds, tile, 1000, CreateEventTable.searchRadius)
+    assert 0 < len(routes) < len(network.names)
+
+
+def test_margin_below_search_radius(network, ddCsv, tmp_path):
+    with pytest.raises(ValueError):
+        TiledEvents.create_event_table_tiled(ddCsv, str(tmp_path / 'Tiled.csv'), margin=CreateEventTable.searchRadius / 2)